@@ -3,6 +3,9 @@ import multiprocessing as mp
 import matplotlib.pyplot as plt
 import numpy as np
 
+from genetic_algorithms.result_store import ResultStore, open_store
+from helper import (ProgressMonitor, SweepTelemetry, get_sweep_random_state, report_task_done, report_task_start,
+                    telemetry_worker_init)
 from shepherd_simulation import ShepherdSimulation
 from datetime import datetime
 
@@ -10,13 +13,26 @@ no_timesteps = 8000
 max_no_neighbours = 140
 no_sims_per_combination = 50
 verbose = True
+# entropy of the sweep, every simulation derives its random stream from it and (N, n, repetition).
+# None draws fresh entropy, which is printed so that any cell can be recomputed later.
+sweep_seed = None
+# abort simulations in which the herd made no progress for this many steps (None runs every simulation in full)
+stall_window = None
+# only record stalls without aborting the simulations, to validate the detector against full-length runs
+validate_stall_detection = False
+# seconds between two progress summaries (throughput, ETA, worker utilization) of the sweep, which are also written
+# to telemetry_file. telemetry_port serves them as JSON at http://127.0.0.1:telemetry_port/ (None to disable)
+telemetry_interval = 30.
+telemetry_port = None
 
 timestamp = datetime.now().strftime('%Y.%m.%d.%H.%M')
-result_file = f"results/evaluation_strombom.{timestamp}.npy"
+# result store of the sweep, see genetic_algorithms/result_store.py
+result_file = f"results/evaluation_strombom.{timestamp}.npz"
 result_fig_file = f"results/evaluation_strombom.{timestamp}.png"
+telemetry_file = f"results/evaluation_strombom.{timestamp}.telemetry.json"
 
 
-def single_sim_eval(N, n, id, total_evaluations_num, start_time):
+def single_sim_eval(N, n, seed, id, total_evaluations_num, start_time):
     """
     Helper function needed for parallelization.
     Computes the simulation result for specifc [N, n] pair.
@@ -26,22 +42,58 @@ def single_sim_eval(N, n, id, total_evaluations_num, start_time):
         print(
             f"Evaluating N: {N}\tn: {n}\tprocess_id: {mp.current_process().name[len('ForkPoolWorker-'):]}\telapsed: {str(datetime.now() - start_time).split('.')[0]}\tprogress: {round(100 * id / total_evaluations_num, 2)}%")
 
+    report_task_start()
     # Repeat simulation for 50 times, 8000 time steps each (default parameter)
     avg_success = 0
-    for _ in range(no_sims_per_combination):
-        sim = ShepherdSimulation(N, n, no_timesteps)
-        _, success = sim.run()
+    success_steps = []
+    stall_stats = {'runs': 0, 'stalled': 0, 'stalled_successful': 0, 'steps': 0, 'steps_saved': 0}
+    for repetition in range(no_sims_per_combination):
+        sim = ShepherdSimulation(N, n, no_timesteps, random_state=get_sweep_random_state(seed, N, n, repetition))
+        monitor = None
+        if stall_window is not None:
+            monitor = ProgressMonitor(stall_window, terminate=not validate_stall_detection)
+        steps, success = sim.run(progress_monitor=monitor)
         avg_success += success
+        if success:
+            success_steps.append(steps)
+
+        stall_stats['runs'] += 1
+        stall_stats['steps'] += steps
+        if monitor is not None and monitor.stalled:
+            stall_stats['stalled'] += 1
+            stall_stats['stalled_successful'] += success
+            stall_stats['steps_saved'] += no_timesteps - monitor.stalled_at
     avg_success /= no_sims_per_combination
+    report_task_done(stall_stats['runs'], stall_stats['steps'])
 
-    res = None
-    with open(result_file, 'rb') as f:
-        res = np.load(f)
-        res[N, n] = avg_success
-    if res is not None:
-        with open(result_file, 'wb') as f:
-            np.save(f, res)
-    return {(N, n): avg_success}
+    # fields of the result store, which is written by the main process
+    cell = {'N': N, 'n': n, 'success_rate': avg_success, 'runs': stall_stats['runs']}
+    if success_steps:
+        cell['mean_steps'] = np.mean(success_steps)
+        cell['p50_steps'], cell['p90_steps'] = np.percentile(success_steps, [50, 90])
+    return {(N, n): avg_success}, stall_stats, cell
+
+
+def single_sim_eval_packed(args):
+    return single_sim_eval(*args)
+
+
+def report_stalls(out):
+    """
+    Print how many simulations were detected as stalled and how many time steps this saved.
+    In validation mode the simulations run in full, so stalled runs which succeeded later are false positives.
+    :param out: list of return values of single_sim_eval
+    :return:
+    """
+    total = {key: sum(stats[key] for _, stats, _ in out) for key in out[0][1]}
+    if total['runs'] == 0:
+        return
+    print(f"Stalled runs: {total['stalled']}/{total['runs']} ({round(100 * total['stalled'] / total['runs'], 2)}%)")
+    # steps_saved are hypothetical in validation mode, since every simulation runs in full there
+    steps_budget = total['steps'] + (0 if validate_stall_detection else total['steps_saved'])
+    print(f"Steps saved: {total['steps_saved']}/{steps_budget} ({round(100 * total['steps_saved'] / steps_budget, 2)}%)")
+    if validate_stall_detection:
+        print(f"Stalled runs which succeeded later (false positives): {total['stalled_successful']}")
 
 
 def generate_N_n_pairs():
@@ -56,45 +108,67 @@ def generate_N_n_pairs():
     return pairs
 
 
-def generate_simulations_args():
+def generate_simulations_args(seed):
     """
     Returns list of arguments to be passed to single_sim_eval function.
-    :return: [[N, n, id, total_evaluations_num, start_time]]
+    :return: [[N, n, seed, id, total_evaluations_num, start_time]]
     """
     pairs_N_n = generate_N_n_pairs()
     total_evaluations_num = len(pairs_N_n)
     start_time = datetime.now()
-    return [p + [i, total_evaluations_num, start_time] for i, p in enumerate(pairs_N_n)]
+    return [p + [seed, i, total_evaluations_num, start_time] for i, p in enumerate(pairs_N_n)]
 
 
-def evaluate_paper():
+def create_result_store(seed):
     """
-    Run the evaluation algorithm specified
-    :return:
+    Empty result store of a sweep, with the settings of this module as metadata
     """
+    return ResultStore(max_no_neighbours, {
+        'model': 'fuzzy_dog',
+        'sweep_seed': int(seed),
+        'no_timesteps': no_timesteps,
+        'no_sims_per_combination': no_sims_per_combination,
+        'stall_window': stall_window,
+        'timestamp': timestamp,
+    })
 
-    results = np.zeros((max_no_neighbours + 1, max_no_neighbours + 1))
 
-    with open(result_file, 'wb') as f:
-        np.save(f, results)
+def evaluate_paper():
+    """
+    Run the evaluation algorithm specified
+    :return: store: result store of the sweep, which is saved to result_file every CHECKPOINT_INTERVAL seconds (see
+    genetic_algorithms/result_store.py) and at the end
+    """
+    seed = sweep_seed if sweep_seed is not None else np.random.SeedSequence().entropy
+    print(f"Sweep seed: {seed}")
+    store = create_result_store(seed)
+    store.save(result_file)
 
-    with mp.Pool(processes=mp.cpu_count()) as pool:
-        out = pool.starmap(
-            single_sim_eval, generate_simulations_args(), chunksize=1)
+    out = []
+    args = generate_simulations_args(seed)
+    with SweepTelemetry(len(args), mp.cpu_count(), metrics_file=telemetry_file, refresh_interval=telemetry_interval,
+                        http_port=telemetry_port) as telemetry, \
+            mp.Pool(processes=mp.cpu_count(), initializer=telemetry_worker_init, initargs=telemetry.initargs) as pool:
+        for result in pool.imap_unordered(single_sim_eval_packed, args, chunksize=1):
+            out.append(result)
+            store.set_cell(**result[2])
+            store.checkpoint(result_file)
+    store.save(result_file)
 
-    with open(result_file, 'rb') as f:
-        results = np.load(f)
+    if stall_window is not None:
+        report_stalls(out)
 
-    return results
+    return store
 
 
-def plot_results(results, out_fig_fname=None):
+def plot_results(store, out_fig_fname=None):
     """
-    Function to generate an annotated heatmap using the results array
-    :param results:
+    Function to generate an annotated heatmap from a result store, cells which were not evaluated are left blank
+    :param store: ResultStore, e.g. memory-mapped with open_store
     :param out_fig_fname:
     :return:
     """
+    results = store.matrix('success_rate')[1:, 1:].T
     # Plot the results
     fig, ax = plt.subplots()
 
@@ -129,6 +203,6 @@ def plot_results(results, out_fig_fname=None):
 
 if __name__ == '__main__':
     print("Start evaluation")
-    results = evaluate_paper()
-    print(results)
-    plot_results(results[1:, 1:].T, result_fig_file)
+    store = evaluate_paper()
+    print(store.matrix('success_rate'))
+    plot_results(open_store(result_file), result_fig_file)
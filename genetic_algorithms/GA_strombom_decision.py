@@ -3,10 +3,13 @@
 import time
 from os.path import isfile
 from datetime import datetime
-from multiprocessing import Pool, cpu_count
+from multiprocessing import cpu_count
 from timeit import default_timer as timer
-from fitness_function import fitness_func_strombom, STEP_BETWEEN_SIMULATIONS_FOR_N_AND_n
-from pooled_ga import PooledGA
+from fitness_function import simulation_count, fitness_func_strombom, fitness_func_batch_strombom, STEP_BETWEEN_SIMULATIONS_FOR_N_AND_n
+from ask_tell import CMAES, DifferentialEvolution
+from island_ga import run_islands
+from pooled_ga import FitnessPool, PooledGA
+from surrogate import GaussianProcessSurrogate, SurrogateScreening
 import numpy as np
 import pandas as pd
 
@@ -38,17 +41,27 @@ def on_generation(ga):
         old_logs = pd.read_pickle(filepath)
     else:
         old_logs = create_log()
-    new_logs = pd.concat([old_logs, create_log(
-        alphas, betas, gammas, fitness, indices, generation, timestamp)])
+    generation_logs = create_log(
+        alphas, betas, gammas, fitness, indices, generation, timestamp)
+    screening = getattr(ga, 'surrogate_screening', None)
+    if screening is not None:
+        # the fitness of the other solutions was predicted by the surrogate
+        generation_logs['simulated'] = ga.last_generation_simulated
+    new_logs = pd.concat([old_logs, generation_logs])
     pd.to_pickle(new_logs, filepath)
 
     elapsed = round(timer() - last_timer, 2)
     last_timer = timer()
     print(f'Generation {ga.generations_completed} was completed in {elapsed}s')
     idx_best = np.argmax(fitness, axis=0)
+    if screening is not None:
+        # only a simulated solution is reported as the best one
+        _, _, idx_best = ga.best_solution(pop_fitness=fitness)
     print(
         f'Best solution was {fitness[idx_best]} with parameters {ga.population[idx_best]}')
     print(f'The change was {fitness[idx_best] - last_fitness}')
+    if screening is not None and screening.errors:
+        print(f'Surrogate error: {screening.errors[-1]}')
     last_fitness = fitness[idx_best]
 
 
@@ -69,25 +82,84 @@ if __name__ == '__main__':
     parent_selection_type = "rws"
     crossover_type = "uniform"
     mutation_by_replacement = False
+    # simulate the whole population at once per (N, n) environment instead of every solution on its own
+    batch_evaluation = False
+    # island model: populations evolving in separate processes, exchanging their best solutions (see island_ga.py)
+    num_islands = 1
+    migration_interval = 10
+    num_migrants = 2
+    # "ga" for pygad, or one of the ask/tell optimizers "cmaes" and "de" (see ask_tell.py)
+    optimizer = "ga"
+    # stop the ask/tell optimizers once this fitness is reached (e.g. the best fitness of a previous GA run)
+    target_fitness = None
+    # simulate only the most promising and most uncertain offspring, the fitness of the others is predicted by a
+    # Gaussian process trained on the simulated solutions (and on surrogate_log, a log of a previous run, if given)
+    surrogate_screening = False
+    surrogate_log = None
     gen_space = [{"low": 0, 'high': 10}, {
         "low": 0, "high": 4}, {"low": -100, "high": 100}]
 
-    with Pool(processes=cpu_num) as pool:
-        ga_instance = PooledGA(pool,
-                               num_generations=num_generations,
-                               num_parents_mating=num_parents_mating,
-                               fitness_func=fitness_func_strombom,
-                               sol_per_pop=sol_per_pop,
-                               num_genes=num_genes,
-                               parent_selection_type=parent_selection_type,
-                               crossover_type=crossover_type,
-                               mutation_by_replacement=mutation_by_replacement,
-                               gene_space=gen_space,
-                               on_generation=on_generation)
-
-        ga_instance.run()
-        solution, solution_fitness, solution_idx = ga_instance.best_solution()
-        print("Parameters of the best solution : {solution}".format(
-            solution=solution))
-        print("Fitness value of the best solution = {solution_fitness}".format(
-            solution_fitness=solution_fitness))
+    ga_kwargs = dict(num_generations=num_generations,
+                     num_parents_mating=num_parents_mating,
+                     fitness_func=fitness_func_strombom,
+                     sol_per_pop=sol_per_pop,
+                     num_genes=num_genes,
+                     parent_selection_type=parent_selection_type,
+                     crossover_type=crossover_type,
+                     mutation_by_replacement=mutation_by_replacement,
+                     gene_space=gen_space)
+    batch_fitness_func = fitness_func_batch_strombom if batch_evaluation else None
+
+    if num_islands > 1:
+        logs = run_islands(num_islands, filepath, create_log, fitness_func_strombom, ga_kwargs,
+                           batch_fitness_func=batch_fitness_func,
+                           migration_interval=migration_interval,
+                           num_migrants=num_migrants,
+                           processes=max(1, cpu_num // num_islands))
+        best = logs.sort_values('fitness').iloc[-1]
+        print("Best solution of all islands : {best}".format(best=best))
+    elif optimizer != "ga":
+        init_bounds = bounds = np.array([[gene['low'], gene['high']] for gene in gen_space])
+        with FitnessPool(fitness_func_strombom, sol_per_pop, num_genes, processes=cpu_num) as pool:
+            if optimizer == "cmaes":
+                ask_tell = CMAES(init_bounds.mean(axis=1), 0.3 * (init_bounds[:, 1] - init_bounds[:, 0]),
+                                 popsize=sol_per_pop, bounds=bounds)
+            else:
+                ask_tell = DifferentialEvolution(init_bounds, sol_per_pop, bounds=bounds)
+            if batch_fitness_func is not None:
+                evaluate = lambda population: batch_fitness_func(population, pool=pool)
+            else:
+                evaluate = pool.map_fitness
+
+            solution, solution_fitness = ask_tell.run(evaluate, num_generations, on_generation=on_generation,
+                                                      target_fitness=target_fitness)
+            print("Parameters of the best solution : {solution}".format(
+                solution=solution))
+            print("Fitness value of the best solution = {solution_fitness}".format(
+                solution_fitness=solution_fitness))
+            print("Fitness evaluations: {evaluations} ({simulations} simulations)".format(
+                evaluations=ask_tell.num_evaluations, simulations=ask_tell.num_evaluations * simulation_count()))
+    else:
+        screening = None
+        if surrogate_screening:
+            surrogate = GaussianProcessSurrogate()
+            if surrogate_log is not None:
+                surrogate.add_log(surrogate_log, ['alpha', 'beta', 'gamma'])
+            screening = SurrogateScreening(surrogate)
+
+        # workers receive the fitness function once, each generation only the genes are shared with them
+        with FitnessPool(fitness_func_strombom, sol_per_pop, num_genes, processes=cpu_num) as pool:
+            ga_instance = PooledGA(pool,
+                                   batch_fitness_func=batch_fitness_func,
+                                   surrogate_screening=screening,
+                                   on_generation=on_generation,
+                                   **ga_kwargs)
+
+            ga_instance.run()
+            solution, solution_fitness, solution_idx = ga_instance.best_solution()
+            print("Parameters of the best solution : {solution}".format(
+                solution=solution))
+            print("Fitness value of the best solution = {solution_fitness}".format(
+                solution_fitness=solution_fitness))
+            print("Fitness evaluations: {evaluations} ({simulations} simulations)".format(
+                evaluations=ga_instance.num_evaluations, simulations=ga_instance.num_evaluations * simulation_count()))
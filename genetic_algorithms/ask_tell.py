@@ -0,0 +1,189 @@
+"""Continuous optimizers of the decision parameters with an ask / tell interface
+ask() returns the solutions to evaluate next, tell() takes their fitness (maximized, like in pygad).
+The evaluation is up to the caller, e.g. a FitnessPool or a batched fitness function. The attributes population,
+last_generation_fitness and generations_completed mirror pygad.GA, so the on_generation logging of the GA scripts
+works for these optimizers too.
+"""
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class AskTellOptimizer(ABC):
+
+    def __init__(self, num_genes, popsize, bounds=None, random_state=None):
+        """
+        :param num_genes: number of parameters of a solution
+        :param popsize: number of solutions per generation
+        :param bounds: optional array (num_genes, 2) of the lower and upper bound of each parameter
+        :param random_state: np.random.RandomState
+        """
+        self.num_genes = num_genes
+        self.popsize = popsize
+        self.bounds = None if bounds is None else np.asarray(bounds, dtype=float)
+        self.random_state = random_state or np.random.RandomState()
+
+        self.population = None
+        self.last_generation_fitness = None
+        self.generations_completed = 0
+        self.num_evaluations = 0
+        self.best_solution_fitness = -np.inf
+        self.best_solution_genes = None
+
+    def clip(self, solutions):
+        if self.bounds is None:
+            return solutions
+        return np.clip(solutions, self.bounds[:, 0], self.bounds[:, 1])
+
+    @abstractmethod
+    def ask(self):
+        """
+        :return: array (popsize, num_genes) of the solutions to evaluate next, also stored as population
+        """
+
+    def tell(self, fitness):
+        """
+        :param fitness: fitness of the solutions of the last ask()
+        """
+        fitness = np.asarray(fitness, dtype=float)
+        self.last_generation_fitness = fitness
+        self.generations_completed += 1
+        self.num_evaluations += len(fitness)
+        best = np.argmax(fitness)
+        if fitness[best] > self.best_solution_fitness:
+            self.best_solution_fitness = fitness[best]
+            self.best_solution_genes = self.population[best].copy()
+
+    def best_solution(self):
+        return self.best_solution_genes, self.best_solution_fitness
+
+    def run(self, evaluate, num_generations, on_generation=None, target_fitness=None):
+        """
+        :param evaluate: function returning the fitness of every solution of a population
+        :param num_generations: maximum number of generations
+        :param on_generation: optional function called with the optimizer after every generation
+        :param target_fitness: stop as soon as a solution reaches this fitness
+        :return: best solution, its fitness
+        """
+        for _ in range(num_generations):
+            self.tell(evaluate(self.ask()))
+            if on_generation is not None:
+                on_generation(self)
+            if target_fitness is not None and self.best_solution_fitness >= target_fitness:
+                break
+        return self.best_solution()
+
+
+class CMAES(AskTellOptimizer):
+    """Covariance matrix adaptation evolution strategy, (mu/mu_w, lambda) with rank-one and rank-mu updates
+    (Hansen, The CMA Evolution Strategy: A Tutorial). Solutions outside of the bounds are clipped.
+    """
+
+    def __init__(self, mean, sigma, popsize=None, bounds=None, random_state=None):
+        """
+        :param mean: initial mean of the search distribution
+        :param sigma: initial step size, or initial standard deviation of every parameter for differently scaled ones
+        """
+        mean = np.array(mean, dtype=float)
+        n = len(mean)
+        super().__init__(n, popsize or 4 + int(3 * np.log(n)), bounds, random_state)
+        self.mean = mean
+        stds = np.broadcast_to(np.asarray(sigma, dtype=float), (n,))
+        self.sigma = np.max(stds)
+
+        self.mu = self.popsize // 2
+        weights = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / np.sum(weights)
+        self.mueff = 1 / np.sum(self.weights ** 2)
+
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0, np.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.B = np.eye(n)
+        self.D = stds / self.sigma
+        self.C = np.diag(self.D ** 2)
+        # steps of the last solutions from the mean, in units of sigma
+        self.y = None
+
+    def ask(self):
+        z = self.random_state.standard_normal((self.popsize, self.num_genes))
+        solutions = self.clip(self.mean + self.sigma * (z * self.D) @ self.B.T)
+        self.y = (solutions - self.mean) / self.sigma
+        self.population = solutions
+        return solutions
+
+    def tell(self, fitness):
+        super().tell(fitness)
+        n = self.num_genes
+        selected = self.y[np.argsort(-self.last_generation_fitness, kind='stable')[:self.mu]]
+        y_w = self.weights @ selected
+        self.mean = self.mean + self.sigma * y_w
+
+        C_inv_sqrt = self.B @ np.diag(1 / self.D) @ self.B.T
+        self.ps = (1 - self.cs) * self.ps + np.sqrt(self.cs * (2 - self.cs) * self.mueff) * C_inv_sqrt @ y_w
+        ps_norm = np.linalg.norm(self.ps)
+        h_sigma = ps_norm / np.sqrt(1 - (1 - self.cs) ** (2 * self.generations_completed)) / self.chi_n < 1.4 + 2 / (n + 1)
+        self.pc = (1 - self.cc) * self.pc + h_sigma * np.sqrt(self.cc * (2 - self.cc) * self.mueff) * y_w
+
+        rank_one = np.outer(self.pc, self.pc) + (1 - h_sigma) * self.cc * (2 - self.cc) * self.C
+        rank_mu = (selected * self.weights[:, None]).T @ selected
+        self.C = (1 - self.c1 - self.cmu) * self.C + self.c1 * rank_one + self.cmu * rank_mu
+        self.sigma *= np.exp(self.cs / self.damps * (ps_norm / self.chi_n - 1))
+
+        self.C = (self.C + self.C.T) / 2
+        eigenvalues, self.B = np.linalg.eigh(self.C)
+        self.D = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+
+class DifferentialEvolution(AskTellOptimizer):
+    """Differential evolution, DE/rand/1/bin
+    The first generation is sampled uniformly within init_bounds, afterwards every member of the population is
+    challenged by one trial solution per generation and replaced if the trial is at least as fit.
+    """
+
+    def __init__(self, init_bounds, popsize, bounds=None, mutation=0.8, crossover=0.9, random_state=None):
+        """
+        :param init_bounds: array (num_genes, 2) of the range of each parameter in the first generation
+        :param mutation: differential weight F
+        :param crossover: crossover probability CR
+        """
+        self.init_bounds = np.asarray(init_bounds, dtype=float)
+        super().__init__(len(self.init_bounds), popsize, bounds, random_state)
+        self.mutation = mutation
+        self.crossover = crossover
+        # population of the accepted solutions and their fitness, None before the first generation is evaluated
+        self.members = None
+        self.members_fitness = None
+
+    def ask(self):
+        if self.members is None:
+            low, high = self.init_bounds[:, 0], self.init_bounds[:, 1]
+            self.population = low + self.random_state.uniform(size=(self.popsize, self.num_genes)) * (high - low)
+            return self.population
+
+        trials = np.empty_like(self.members)
+        for i in range(self.popsize):
+            others = [j for j in range(self.popsize) if j != i]
+            a, b, c = self.members[self.random_state.choice(others, 3, replace=False)]
+            mutant = a + self.mutation * (b - c)
+            cross = self.random_state.uniform(size=self.num_genes) < self.crossover
+            cross[self.random_state.randint(self.num_genes)] = True
+            trials[i] = np.where(cross, mutant, self.members[i])
+        self.population = self.clip(trials)
+        return self.population
+
+    def tell(self, fitness):
+        super().tell(fitness)
+        if self.members is None:
+            self.members = self.population.copy()
+            self.members_fitness = self.last_generation_fitness.copy()
+            return
+        improved = self.last_generation_fitness >= self.members_fitness
+        self.members[improved] = self.population[improved]
+        self.members_fitness[improved] = self.last_generation_fitness[improved]
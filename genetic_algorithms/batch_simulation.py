@@ -0,0 +1,308 @@
+"""Batched shepherding simulation, evaluating many decision parameter sets on the same seeded environment at once
+Run this module to check that the batch reproduces ShepherdSimulation
+"""
+import numpy as np
+
+from shepherd_simulation import Decision_type, ShepherdSimulation
+from workspace import StepWorkspace, normalize_rows
+
+
+class BatchShepherdSimulation:
+    """Runs P variants of one seeded environment, which only differ in their decision parameters, as a single
+    vectorized simulation on a (P, N, 2) state. Every row keeps the random state of the ShepherdSimulation it was
+    created from and draws from it in the same order, and every operation is rounded like in ShepherdSimulation
+    (with its default options), so each row reproduces the single simulation bit for bit. Rows are retired as soon as
+    they succeed or run out of steps.
+    """
+
+    def __init__(self, decision_params, num_sheep_total=30, num_sheep_neighbors=15,
+                 decision_type=Decision_type.DEFAULT_STROMBOM, max_steps=1000, random_seed=0):
+        """
+        :param decision_params: list of P decision parameter vectors, see ShepherdSimulation.set_thresh_field_params
+        """
+        sims = []
+        for params in decision_params:
+            sim = ShepherdSimulation(num_sheep_total=num_sheep_total, num_sheep_neighbors=num_sheep_neighbors,
+                                     decision_type=decision_type, max_steps=max_steps, random_seed=random_seed)
+            sim.set_thresh_field_params(params)
+            sims.append(sim)
+
+        # all constants of the environment are taken from the single simulation
+        self.template = sims[0]
+        self.num_sheep_total = num_sheep_total
+        self.num_sheep_neighbors = num_sheep_neighbors
+        self.decision_type = decision_type
+        self.max_steps = max_steps
+        self.target = self.template.target
+
+        # state of the active rows, rows are removed once retired
+        self.rows = np.arange(len(sims))
+        self.random_states = [sim.random_state for sim in sims]
+        self.sheep_poses = np.stack([sim.sheep_poses for sim in sims])
+        self.inertia = np.stack([sim.inertia for sim in sims])
+        self.dog_pose = np.stack([sim.dog_pose for sim in sims]).astype(float)
+        self.thresh_strombom = np.array([[sim.thresh_alpha, sim.thresh_beta, sim.thresh_gamma] for sim in sims])
+        self.thresh_sigmoid = np.array([[sim.thresh_N, sim.thresh_n, sim.thresh_furthest, sim.thresh_variance,
+                                         sim.thresh_angle] for sim in sims])
+
+        self.sheep_com = np.mean(self.sheep_poses, axis=1)
+        # number of values the error term of the dog draws in the current step, per row
+        self.dog_noise_counts = np.zeros(len(sims), dtype=int)
+        self.workspace = StepWorkspace()
+
+        # results of the retired rows
+        self.steps = np.zeros(len(sims), dtype=int)
+        self.success = np.zeros(len(sims), dtype=bool)
+        self.final_sheep_poses = np.empty_like(self.sheep_poses)
+
+    def success_criteria(self):
+        return np.linalg.norm(self.target - self.sheep_com, axis=1) < 1.0
+
+    def run(self):
+        """
+        Run all rows until they succeed or reach max_steps
+        :return: steps, success, sheep_poses: arrays over the P rows, as returned by ShepherdSimulation.run
+        """
+        counter = 0
+        while len(self.rows) > 0:
+            success = self.success_criteria()
+            self.__retire(success | (counter >= self.max_steps), success, counter)
+            if len(self.rows) == 0:
+                break
+
+            counter += 1
+            self.dog_strombom_model()
+            self.update_environment()
+
+        return self.steps, self.success, self.final_sheep_poses
+
+    def __retire(self, done, success, counter):
+        if not np.any(done):
+            return
+        retired = self.rows[done]
+        self.steps[retired] = counter
+        self.success[retired] = success[done]
+        self.final_sheep_poses[retired] = self.sheep_poses[done]
+
+        keep = ~done
+        self.rows = self.rows[keep]
+        self.random_states = [rs for rs, k in zip(self.random_states, keep) if k]
+        self.sheep_poses = self.sheep_poses[keep]
+        self.inertia = self.inertia[keep]
+        self.dog_pose = self.dog_pose[keep]
+        self.thresh_strombom = self.thresh_strombom[keep]
+        self.thresh_sigmoid = self.thresh_sigmoid[keep]
+        self.sheep_com = self.sheep_com[keep]
+        self.dog_noise_counts = self.dog_noise_counts[keep]
+
+    def update_environment(self):
+        t = self.template
+        # find sheep near and far dog
+        dist_to_dog = np.linalg.norm(self.sheep_poses - self.dog_pose[:, None, :], axis=2)
+        inds_sheep_near_dog = dist_to_dog < t.dog_repulsion_dist
+        inds_sheep_far_dog = np.logical_not(inds_sheep_near_dog)
+        noise, moving_sheep, moves = self.__draw_random_terms(np.count_nonzero(inds_sheep_near_dog, axis=1),
+                                                              np.count_nonzero(inds_sheep_far_dog, axis=1))
+        self.__compute_inertia_for_sheep_near_from_dog(inds_sheep_near_dog, noise)
+        self.__compute_inertia_for_sheep_far_from_dog(inds_sheep_far_dog, moving_sheep, moves)
+
+        # find new sheep position
+        self.sheep_poses += t.delta_sheep_pose * self.inertia
+        self.sheep_com = np.mean(self.sheep_poses, axis=1)
+
+    def __draw_random_terms(self, num_near_sheep, num_far_sheep):
+        """
+        All random draws of a step. The rows draw from their own random states, so this is the only loop over the
+        rows, in the order of ShepherdSimulation: error term of the dog (not applied), error term of the sheep near
+        the dog, grazing moves of the sheep far from the dog.
+        :return: noise: error terms of the near sheep packed to the front of every row, moving_sheep, moves: whether
+        the far sheep of all rows (in row-major order) move and the moves of the moving ones
+        """
+        t = self.template
+        noise = np.zeros((len(self.rows), self.num_sheep_total, 2))
+        moving_sheep, moves = [], []
+        for row, random_state in enumerate(self.random_states):
+            random_state.randn(self.dog_noise_counts[row], 2)
+            noise[row, :num_near_sheep[row]] = random_state.randn(num_near_sheep[row], 2)
+            moving_sheep.append(random_state.choice([True, False], num_far_sheep[row],
+                                                    p=[t.grazing_prob, 1 - t.grazing_prob]))
+            moves.append(random_state.randn(np.count_nonzero(moving_sheep[-1]), 2))
+        return noise, np.concatenate(moving_sheep), np.concatenate(moves)
+
+    def __compute_inertia_for_sheep_far_from_dog(self, indices, moving_sheep, moves):
+        # compute random movements while grazing (with prob grazing_prob)
+        far_rows, far_sheep = np.nonzero(indices)
+        self.inertia[far_rows, far_sheep] = 0
+        self.inertia[far_rows[moving_sheep], far_sheep[moving_sheep]] = np.linalg.norm(moves, axis=1, keepdims=True)
+
+    def __compute_inertia_for_sheep_near_from_dog(self, indices, noise):
+        t = self.template
+        R, N = indices.shape
+        rows = np.arange(R)[:, None]
+        num_near_sheep = np.count_nonzero(indices, axis=1)
+
+        # the near sheep of every row are moved to the front (in order) and the rows padded with the far ones
+        order = np.argsort(~indices, axis=1, kind='stable')
+        valid = np.arange(N)[None, :] < num_near_sheep[:, None]
+        pair_valid = valid[:, :, None] & valid[:, None, :]
+        near_sheep_poses = self.sheep_poses[rows, order]
+        inertia_sheep_near_dog = self.inertia[rows, order]
+        # like in ShepherdSimulation, the pairwise terms are taken from the first k rows of the sheep poses
+        poses = self.sheep_poses
+
+        # compute a distance matrix
+        sq_norms = np.sum(near_sheep_poses ** 2, axis=2)
+        distance_matrix = np.sqrt(-2 * np.matmul(near_sheep_poses, near_sheep_poses.transpose(0, 2, 1).copy())
+                                  + sq_norms[:, None, :] + sq_norms[:, :, None])
+
+        # find the sheep which are within sheep repulsion distance between each other
+        interact = (distance_matrix < t.sheep_repulsion_dist) & (distance_matrix != 0) & pair_valid
+
+        # compute the repulsion forces within sheep, summed over the (sparse) list of interacting pairs
+        row_ids, xvals, yvals = np.nonzero(interact)
+        transit = poses[row_ids, xvals] - poses[row_ids, yvals]
+        transit /= np.linalg.norm(transit, axis=1, keepdims=True)
+        repulsion_sheep = np.zeros((R, N, 2))
+        np.add.at(repulsion_sheep, (row_ids, xvals), transit)
+        normalize_rows(repulsion_sheep, self.workspace)
+
+        # repulsion from dog
+        repulsion_dog = near_sheep_poses - self.dog_pose[:, None, :]
+        normalize_rows(repulsion_dog, self.workspace)
+
+        # attraction to LCMs, the padding is sorted behind the invalid (nan) distances of the sheep itself
+        sort_key = np.where(np.isnan(distance_matrix), np.finfo(float).max, distance_matrix)
+        sort_key[~pair_valid] = np.inf
+        sheep_neighbors = np.argsort(sort_key, axis=2)[:, :, 0:self.num_sheep_neighbors + 1]
+        num_lcm_sheep = np.minimum(self.num_sheep_neighbors + 1, num_near_sheep)
+        neighbor_valid = np.arange(sheep_neighbors.shape[2])[None, :] < num_lcm_sheep[:, None]
+        neighbor_poses = poses[rows[:, :, None], sheep_neighbors]
+        if not np.all(neighbor_valid):
+            neighbor_poses = np.where(neighbor_valid[:, None, :, None], neighbor_poses, 0)
+        sheep_lcms = np.sum(neighbor_poses, axis=2) / num_lcm_sheep[:, None, None]
+        attraction_lcm = sheep_lcms - near_sheep_poses
+        normalize_rows(attraction_lcm, self.workspace)
+
+        # error term
+        normalize_rows(noise, self.workspace)
+
+        # compute sheep motion direction
+        inertia_sheep_near_dog = t.inertia_term * inertia_sheep_near_dog + t.lcm_term * attraction_lcm + \
+                                 t.repulsion_sheep_term * repulsion_sheep + t.repulsion_dog_term * repulsion_dog + \
+                                 t.noise_term * noise
+        normalize_rows(inertia_sheep_near_dog, self.workspace)
+
+        # update general inertia
+        self.inertia[np.broadcast_to(rows, (R, N))[valid], order[valid]] = inertia_sheep_near_dog[valid]
+
+    def dog_strombom_model(self):
+        t = self.template
+        # check if a sheep is closer than r_a to dog, if yes stop walking
+        dist_sheep_dog = np.linalg.norm(self.sheep_poses - self.dog_pose[:, None, :], axis=2)
+        walking = np.min(dist_sheep_dog, axis=1) >= 3 * t.sheep_repulsion_dist
+
+        # determine the dog position, collecting if the decision function returns 1
+        dist_to_com = np.linalg.norm(self.sheep_poses - self.sheep_com[:, None, :], axis=2)
+        collecting = self.__decision_function(dist_to_com)
+        int_goal = np.where(collecting[:, None], self.__get_collecting_point(dist_to_com), self.__get_driving_point())
+
+        # compute increments in x,y components
+        direction = int_goal - self.dog_pose
+        direction /= row_norms(direction)[:, None]
+
+        # error term, not applied but drawn (in update_environment) to keep the random states in sync with
+        # ShepherdSimulation
+        num_near_sheep = np.count_nonzero(dist_sheep_dog < t.dog_repulsion_dist, axis=1)
+        self.dog_noise_counts = np.where(walking, num_near_sheep, 0)
+
+        # update position
+        self.dog_pose[walking] += t.dog_speed * direction[walking]
+
+    def __farthest_sheep(self, dist_to_com):
+        return self.sheep_poses[np.arange(len(self.rows)), np.argmax(dist_to_com, axis=1)]
+
+    def __get_collecting_point(self, dist_to_com):
+        farthest_sheep = self.__farthest_sheep(dist_to_com)
+        direction = farthest_sheep - self.sheep_com
+        direction /= row_norms(direction)[:, None]
+        return farthest_sheep + direction * self.template.sheep_repulsion_dist
+
+    def __get_driving_point(self):
+        t = self.template
+        direction = self.sheep_com - self.target
+        direction /= row_norms(direction)[:, None]
+        return self.sheep_com + direction * (t.sheep_repulsion_dist * np.sqrt(self.num_sheep_total))
+
+    def __decision_func_default_strombom(self, dist_to_com):
+        alpha, beta, gamma = self.thresh_strombom.T
+        field = alpha * self.template.sheep_repulsion_dist * (self.num_sheep_total ** beta) + gamma
+        return ~(np.max(dist_to_com, axis=1) < field)
+
+    def __decision_func_sigmoid(self, dist_to_com):
+        farthest_sheep = self.__farthest_sheep(dist_to_com)
+        distance_to_furthest_sheep = row_norms(farthest_sheep - self.dog_pose)
+
+        # angle between driving point, shepherd, collecting point
+        ba = self.__get_driving_point() - self.dog_pose
+        bc = self.__get_collecting_point(dist_to_com) - self.dog_pose
+        cosine_angle = row_dots(ba, bc) / (row_norms(ba) * row_norms(bc))
+        angle = np.degrees(np.arccos(cosine_angle))
+
+        variance = np.var(dist_to_com, axis=1)
+
+        # params are normalized like in ShepherdSimulation
+        norm_N = self.num_sheep_total / 140
+        norm_n = self.num_sheep_neighbors / self.num_sheep_total
+        norm_angle = angle / 180
+        norm_dist_to_fur_sheep = np.where(distance_to_furthest_sheep / 150 < 1, distance_to_furthest_sheep / 150, 1)
+        norm_variance = np.where(variance / 200 < 1, variance / 200, 1)
+
+        thresh_N, thresh_n, thresh_furthest, thresh_variance, thresh_angle = self.thresh_sigmoid.T
+        g = thresh_N * norm_N + thresh_n * norm_n + thresh_variance * norm_variance + \
+            thresh_furthest * norm_dist_to_fur_sheep + thresh_angle * norm_angle
+        sigmoid = 1 / (1 + np.exp(-g))
+        return ~(sigmoid <= 0.5)
+
+    def __decision_function(self, dist_to_com):
+        if self.decision_type == Decision_type.DEFAULT_STROMBOM:
+            return self.__decision_func_default_strombom(dist_to_com)
+        elif self.decision_type == Decision_type.SIGMOID:
+            return self.__decision_func_sigmoid(dist_to_com)
+        else:
+            raise Exception("invalid decision type")
+
+
+def row_dots(a, b):
+    """Dot products of the rows of two (R, 2) arrays, rounded like np.dot of every pair of rows on its own"""
+    return np.matmul(a[:, None, :], b[:, :, None])[:, 0, 0]
+
+
+def row_norms(vectors):
+    """Norms of the rows of a (R, 2) array, rounded like np.linalg.norm of every row on its own"""
+    return np.sqrt(row_dots(vectors, vectors))
+
+
+
+if __name__ == '__main__':
+    # every row of a batch must reproduce the single simulation of its decision parameters bit for bit
+    rng = np.random.default_rng(0)
+    populations = [
+        (Decision_type.DEFAULT_STROMBOM, [(1., 2 / 3, 0.)] + list(rng.uniform(-1, 1, (7, 3)))),
+        (Decision_type.SIGMOID, list(rng.uniform(-1, 1, (8, 5)))),
+    ]
+    for decision_type, population in populations:
+        for N, n, seed in [(30, 15, 0), (50, 10, 1), (80, 40, 2)]:
+            batch = BatchShepherdSimulation(population, num_sheep_total=N, num_sheep_neighbors=n,
+                                            decision_type=decision_type, max_steps=500, random_seed=seed)
+            steps, success, sheep_poses = batch.run()
+            for row, params in enumerate(population):
+                sim = ShepherdSimulation(num_sheep_total=N, num_sheep_neighbors=n, decision_type=decision_type,
+                                         max_steps=500, random_seed=seed)
+                sim.set_thresh_field_params(params)
+                expected_steps, expected_success, expected_poses = sim.run()
+                if (steps[row] != expected_steps or success[row] != expected_success or
+                        not np.array_equal(sheep_poses[row], expected_poses)):
+                    raise Exception(f"Row {row} of the batch differs from the single simulation for "
+                                    f"{decision_type} N={N} n={n} seed={seed}")
+            print(f"{decision_type} N={N} n={n} seed={seed}: {len(population)} rows equal, "
+                  f"{int(np.sum(success))} successful")
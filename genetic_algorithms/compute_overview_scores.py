@@ -1,5 +1,7 @@
 import numpy as np
 
+from result_store import cell_index, open_results
+
 results_meta = [
     {
         'name': 'Original Strombom',
@@ -21,23 +23,21 @@ results_meta = [
 
 analysis_range = 101
 
-base = np.zeros((140, 140), dtype=bool)
-mask_all = np.copy(base)
+# the results are memory-mapped, only the cells with N < analysis_range are read
+stores = {res['name']: open_results(res['res_path'], res['name']) for res in results_meta}
 
-for N in range(1, analysis_range):
-    for n in range(1, N):
-        mask_all[N,n] = True
+cells_all = stores['GA Sigmoid + Original Strombom'].query(N_range=(2, analysis_range - 1), evaluated_only=False)
+index_all = cell_index(cells_all['N'], cells_all['n'])
 
-data_sigmoid = np.load('results/evaluation.sigmoid.transition_only.npy')
-mask_transit = data_sigmoid != -1
-mask_transit[:, analysis_range:] = False
-mask_transit[analysis_range:,:] = False
+# the transitional area is the range in which the GA sigmoid was evaluated
+cells_transit = stores['GA Sigmoid'].query(N_range=(2, analysis_range - 1))
+index_transit = cell_index(cells_transit['N'], cells_transit['n'])
 
 
 for res in results_meta:
-    data = np.load(res['res_path'])
+    success_rate = stores[res['name']].fields['success_rate']
 
-    data_masked = data[mask_transit]
+    data_masked = success_rate[index_transit]
     mean_triangle, std_triangle = round(np.mean(data_masked), 3), round(np.std(data_masked), 3)
 
     print(f"{res['name']} - transit:\t\tmean:\t{mean_triangle}\tstd:\t{std_triangle}")
@@ -45,6 +45,6 @@ for res in results_meta:
     if res['name'] == 'GA Sigmoid':
         continue
 
-    data_masked = data[mask_all]
+    data_masked = success_rate[index_all]
     mean_all, std_all = round(np.mean(data_masked), 3), round(np.std(data_masked), 3)
     print(f"{res['name']} - all:\t\tmean:\t{mean_all}\tstd:\t{std_all}")
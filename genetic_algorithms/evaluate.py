@@ -6,6 +6,11 @@ import pandas as pd
 from shepherd_simulation import Decision_type
 
 from shepherd_simulation import ShepherdSimulation
+from job_service import JobClient
+from result_store import ResultStore, open_store
+from progress_monitor import ProgressMonitor
+from sweep import adaptive_sweep, get_sweep_random_state
+from telemetry import SweepTelemetry, report_task_done, report_task_start, telemetry_worker_init
 from datetime import datetime
 
 NO_TIMESTEPS = 8000
@@ -13,8 +18,26 @@ MAX_NO_NEIGHBOURS = 139
 NO_SIMS_PER_COMBINATION = 50
 DIFFICULT_RANGE_ONLY = True
 VERBOSE = True
-
-RESULTS_INITIAL_FILL_VAL = -1.
+# entropy of the sweep, every simulation derives its random stream from it and (N, n, repetition).
+# None draws fresh entropy, which is printed so that any cell can be recomputed later.
+SWEEP_SEED = None
+# abort simulations in which the herd made no progress for this many steps (None runs every simulation in full)
+STALL_WINDOW = None
+# only record stalls without aborting the simulations, to validate the detector against full-length runs
+VALIDATE_STALL_DETECTION = False
+# simulate a coarse lattice of (N, n) cells and refine it only where the success rate changes or is uncertain,
+# the other cells are interpolated and flagged as estimated in the result store
+ADAPTIVE_SWEEP = False
+ADAPTIVE_COARSE_STEP = 8
+ADAPTIVE_MAX_STD_ERR = 0.05
+ADAPTIVE_MAX_DISAGREEMENT = 0.2
+# seconds between two progress summaries (throughput, ETA, worker utilization) of the sweep, which are also written
+# to TELEMETRY_FILE. TELEMETRY_PORT serves them as JSON at http://127.0.0.1:TELEMETRY_PORT/ (None to disable)
+TELEMETRY_INTERVAL = 30.
+TELEMETRY_PORT = None
+# address of a running job service (see job_service.py) which simulates the cells instead of a local pool,
+# None to simulate locally
+JOB_SERVICE_ADDRESS = None
 
 evaluated_counter = 0
 total_evaluations_num = 0
@@ -23,11 +46,13 @@ DECISION_TYPE = Decision_type.SIGMOID
 DECISION_PARAMS = None
 
 timestamp = datetime.now().strftime('%Y.%m.%d.%H.%M')
-result_file = f"results/evaluation_strombom.{DECISION_TYPE}.{timestamp}.npy"
-result_fig_file = f"results/evaluation_strombom.{DECISION_TYPE}.{timestamp}.png"
+# result store of the sweep, see result_store.py
+RESULT_FILE = f"results/evaluation_strombom.{DECISION_TYPE}.{timestamp}.npz"
+RESULT_FIG_FILE = f"results/evaluation_strombom.{DECISION_TYPE}.{timestamp}.png"
+TELEMETRY_FILE = f"results/evaluation_strombom.{DECISION_TYPE}.{timestamp}.telemetry.json"
 
 
-def _sim_with_agents(N, n, id, total_evaluations_num, start_time):
+def _sim_with_agents(N, n, seed, id, total_evaluations_num, start_time):
     """
     Helper function needed for parallelization.
     Computes the simulation result for one specifc N, n.
@@ -35,24 +60,100 @@ def _sim_with_agents(N, n, id, total_evaluations_num, start_time):
     if VERBOSE:
         print(f"Evaluating N: {N}\tn: {n}\tprocess_id: {mp.current_process().name[len('ForkPoolWorker-'):]}\telapsed: {str(datetime.now() - start_time).split('.')[0]}\tprogress: {round(100 * id / total_evaluations_num, 2)}")
 
-    result = []
+    _, result, cell = _simulate_cell(N, n, seed)
+    return { (N, n): result }, cell
+
+def _sim_with_agents_packed(args):
+    return _sim_with_agents(*args)
+
+def _simulate_cell(N, n, seed):
+    """
+    Repeats the simulation of one specific N, n.
+    :return: avg_success, result, cell: success rate, stall statistics and the fields of the result store of the
+    repetitions
+    """
+    report_task_start()
+    runs = []
     # Repeat simulation for 50 times, 8000 time steps each (default parameter)
-    avg_success = 0
-    for _ in range(NO_SIMS_PER_COMBINATION):
-        sim = ShepherdSimulation(num_sheep_total=N, num_sheep_neighbors=n, max_steps=NO_TIMESTEPS, decision_type=DECISION_TYPE, random_state=np.random.RandomState())
+    for repetition in range(NO_SIMS_PER_COMBINATION):
+        sim = ShepherdSimulation(num_sheep_total=N, num_sheep_neighbors=n, max_steps=NO_TIMESTEPS, decision_type=DECISION_TYPE, random_state=get_sweep_random_state(seed, N, n, repetition))
         sim.set_thresh_field_params(DECISION_PARAMS)
-        _, success, _ = sim.run()
-        avg_success += success
+        monitor = ProgressMonitor(STALL_WINDOW, terminate=not VALIDATE_STALL_DETECTION) if STALL_WINDOW is not None else None
+        steps, success, _ = sim.run(progress_monitor=monitor)
+        runs.append({'steps': steps, 'success': success, 'stalled_at': monitor.stalled_at if monitor is not None else None})
+    avg_success, result, cell = _aggregate_runs(N, n, runs)
+    report_task_done(result['runs'], result['steps'])
+    return avg_success, result, cell
+
+def _aggregate_runs(N, n, runs):
+    """
+    :param runs: list of dicts steps, success, stalled_at of the repetitions of one N, n
+    :return: avg_success, result, cell as returned by _simulate_cell
+    """
+    result = {'runs': 0, 'stalled': 0, 'stalled_successful': 0, 'steps': 0, 'steps_saved': 0}
+    success_steps = []
+    avg_success = 0
+    for run in runs:
+        avg_success += run['success']
+        if run['success']:
+            success_steps.append(run['steps'])
+
+        result['runs'] += 1
+        result['steps'] += run['steps']
+        if run['stalled_at'] is not None:
+            result['stalled'] += 1
+            result['stalled_successful'] += run['success']
+            result['steps_saved'] += NO_TIMESTEPS - run['stalled_at']
     avg_success /= NO_SIMS_PER_COMBINATION
+    cell = {'N': N, 'n': n, 'success_rate': avg_success, 'runs': result['runs']}
+    if success_steps:
+        cell['mean_steps'] = np.mean(success_steps)
+        cell['p50_steps'], cell['p90_steps'] = np.percentile(success_steps, [50, 90])
+    return avg_success, result, cell
+
+def _simulate_cells_via_service(client, cells, seed):
+    """
+    Simulate the repetitions of all cells as one batch on the job service, see job_service.py
+    :return: generator of (avg_success, result, cell) as returned by _simulate_cell, in completion order of the cells
+    """
+    decision_params = [float(param) for param in DECISION_PARAMS] if DECISION_PARAMS is not None else None
+    specs = [{'N': int(N), 'n': int(n), 'seed': int(seed), 'repetition': repetition, 'max_steps': NO_TIMESTEPS,
+              'decision_type': DECISION_TYPE, 'decision_params': decision_params, 'stall_window': STALL_WINDOW,
+              'validate_stall': VALIDATE_STALL_DETECTION}
+             for N, n in cells for repetition in range(NO_SIMS_PER_COMBINATION)]
+    runs = {}
+    for index, run, _ in client.stream_batch(specs):
+        N, n = specs[index]['N'], specs[index]['n']
+        runs.setdefault((N, n), [None] * NO_SIMS_PER_COMBINATION)[specs[index]['repetition']] = run
+        if all(r is not None for r in runs[N, n]):
+            yield _aggregate_runs(N, n, runs.pop((N, n)))
+
+
+def _adaptive_sim_with_agents(N, n, seed, start_time):
+    """
+    Helper function needed for parallelization of the adaptive sweep, the results are collected by the caller.
+    """
+    if VERBOSE:
+        print(f"Evaluating N: {N}\tn: {n}\tprocess_id: {mp.current_process().name[len('ForkPoolWorker-'):]}\telapsed: {str(datetime.now() - start_time).split('.')[0]}")
+    avg_success, result, cell = _simulate_cell(N, n, seed)
+    return avg_success, { (N, n): result }, cell
 
-    res = None
-    with open(RESULT_FILE, 'rb') as f:
-        res = np.load(f)
-        res[N, n] = avg_success
-    if res is not None:
-        with open(RESULT_FILE, 'wb') as f:
-            np.save(f, res)
-    return { (N, n): result }
+def report_stalls(out):
+    """
+    Print how many simulations were detected as stalled and how many time steps this saved.
+    In validation mode the simulations run in full, so stalled runs which succeeded later are false positives.
+    :param out: list of return values of _sim_with_agents
+    """
+    stats = [result for res in out for result in res.values()]
+    total = {key: sum(result[key] for result in stats) for key in stats[0]}
+    if total['runs'] == 0:
+        return
+    print(f"Stalled runs: {total['stalled']}/{total['runs']} ({round(100 * total['stalled'] / total['runs'], 2)}%)")
+    # steps_saved are hypothetical in validation mode, since every simulation runs in full there
+    steps_budget = total['steps'] + (0 if VALIDATE_STALL_DETECTION else total['steps_saved'])
+    print(f"Steps saved: {total['steps_saved']}/{steps_budget} ({round(100 * total['steps_saved'] / steps_budget, 2)}%)")
+    if VALIDATE_STALL_DETECTION:
+        print(f"Stalled runs which succeeded later (false positives): {total['stalled_successful']}")
 
 def generate_N_n_pairs():
     pairs = []
@@ -68,30 +169,115 @@ def generate_N_n_pairs_difficult_range():
             pairs.append([N, n])
     return pairs
 
-def generate_simulations_args(difficult_range_only=False):
+def generate_simulations_args(seed, difficult_range_only=False):
     pairs_N_n = generate_N_n_pairs_difficult_range() if difficult_range_only else generate_N_n_pairs()
     total_evaluations_num = len(pairs_N_n)
     start_time = datetime.now()
-    return [p + [i, total_evaluations_num, start_time] for i, p in enumerate(pairs_N_n)]
+    return [p + [seed, i, total_evaluations_num, start_time] for i, p in enumerate(pairs_N_n)]
+
+def create_result_store(seed):
+    """
+    Empty result store of a sweep, with the settings of this module as metadata
+    """
+    decision_params = [float(param) for param in DECISION_PARAMS] if DECISION_PARAMS is not None else None
+    return ResultStore(MAX_NO_NEIGHBOURS, {
+        'decision_type': DECISION_TYPE,
+        'decision_params': decision_params,
+        'sweep_seed': int(seed),
+        'no_timesteps': NO_TIMESTEPS,
+        'no_sims_per_combination': NO_SIMS_PER_COMBINATION,
+        'stall_window': STALL_WINDOW,
+        'adaptive_sweep': ADAPTIVE_SWEEP,
+        'timestamp': timestamp,
+    })
+
+def create_telemetry(total_tasks):
+    return SweepTelemetry(total_tasks, mp.cpu_count(), metrics_file=TELEMETRY_FILE,
+                          refresh_interval=TELEMETRY_INTERVAL, http_port=TELEMETRY_PORT)
 
 def evaluate_paper():
     """
     Run the evaluation algorithm specified
-    :return:
+    :return: store: result store of the sweep, which is saved to RESULT_FILE every CHECKPOINT_INTERVAL seconds
+    (see result_store.py) and at the end
     """
+    seed = SWEEP_SEED if SWEEP_SEED is not None else np.random.SeedSequence().entropy
+    print(f"Sweep seed: {seed}")
+    store = create_result_store(seed)
+    store.save(RESULT_FILE)
+
+    out = []
+    args = generate_simulations_args(seed, difficult_range_only=DIFFICULT_RANGE_ONLY)
+    if JOB_SERVICE_ADDRESS is not None:
+        with JobClient(JOB_SERVICE_ADDRESS) as client:
+            for _, result, cell in _simulate_cells_via_service(client, [arg[:2] for arg in args], seed):
+                out.append({ (cell['N'], cell['n']): result })
+                store.set_cell(**cell)
+                store.checkpoint(RESULT_FILE)
+    else:
+        with create_telemetry(len(args)) as telemetry, \
+                mp.Pool(processes=mp.cpu_count(), initializer=telemetry_worker_init, initargs=telemetry.initargs) as pool:
+            for stats, cell in pool.imap_unordered(_sim_with_agents_packed, args, chunksize=1):
+                out.append(stats)
+                store.set_cell(**cell)
+                store.checkpoint(RESULT_FILE)
+    store.save(RESULT_FILE)
 
-    results = np.full((MAX_NO_NEIGHBOURS + 1, MAX_NO_NEIGHBOURS + 1), RESULTS_INITIAL_FILL_VAL)
-    results = results.astype('float64')
-    with open(RESULT_FILE, 'wb') as f:
-        np.save(f, results)
+    if STALL_WINDOW is not None:
+        report_stalls(out)
 
-    with mp.Pool(processes=mp.cpu_count()) as pool:
-        out = pool.starmap(_sim_with_agents, generate_simulations_args(difficult_range_only=DIFFICULT_RANGE_ONLY), chunksize=1)
+    return store
 
-    with open(RESULT_FILE, 'rb') as f:
-        results = np.load(f)
+def evaluate_adaptive():
+    """
+    Run the evaluation on a coarse lattice of (N, n) cells, refined where needed (see sweep.adaptive_sweep)
+    :return: store: result store of the sweep, the interpolated cells are flagged as estimated
+    """
+    seed = SWEEP_SEED if SWEEP_SEED is not None else np.random.SeedSequence().entropy
+    print(f"Sweep seed: {seed}")
+    pairs_N_n = generate_N_n_pairs_difficult_range() if DIFFICULT_RANGE_ONLY else generate_N_n_pairs()
+    start_time = datetime.now()
+    out = []
+    store = create_result_store(seed)
+
+    def store_cells(cells_out):
+        out.extend(stats for _, stats, _ in cells_out)
+        for _, _, cell in cells_out:
+            store.set_cell(**cell)
+        store.checkpoint(RESULT_FILE)
+        return [avg_success for avg_success, _, _ in cells_out]
+
+    def sweep(evaluate_cells):
+        return adaptive_sweep(evaluate_cells, pairs_N_n, NO_SIMS_PER_COMBINATION, ADAPTIVE_COARSE_STEP,
+                              ADAPTIVE_MAX_STD_ERR, ADAPTIVE_MAX_DISAGREEMENT)
+
+    if JOB_SERVICE_ADDRESS is not None:
+        with JobClient(JOB_SERVICE_ADDRESS) as client:
+            def evaluate_cells(cells):
+                cells_out = {(cell['N'], cell['n']): (avg_success, { (cell['N'], cell['n']): result }, cell)
+                             for avg_success, result, cell in _simulate_cells_via_service(client, cells, seed)}
+                return store_cells([cells_out[N, n] for N, n in cells])
+
+            sweep_results, sweep_estimated = sweep(evaluate_cells)
+    else:
+        with create_telemetry(0) as telemetry, \
+                mp.Pool(processes=mp.cpu_count(), initializer=telemetry_worker_init, initargs=telemetry.initargs) as pool:
+            def evaluate_cells(cells):
+                # the number of cells to simulate is only known per refinement step
+                telemetry.total_tasks += len(cells)
+                return store_cells(pool.starmap(_adaptive_sim_with_agents, [[N, n, seed, start_time] for N, n in cells],
+                                                chunksize=1))
+
+            sweep_results, sweep_estimated = sweep(evaluate_cells)
 
-    return results
+    if STALL_WINDOW is not None:
+        report_stalls(out)
+
+    for N, n in zip(*np.nonzero(sweep_estimated)):
+        store.set_cell(N, n, success_rate=sweep_results[N, n], estimated=True)
+    store.save(RESULT_FILE)
+
+    return store
 
 def load_best_alpha_beta_gamma(fname):
     df = pd.read_pickle(fname)
@@ -119,13 +305,16 @@ def load_best_decision_params(fname):
     elif DECISION_TYPE == Decision_type.DEFAULT_STROMBOM:
         return load_best_alpha_beta_gamma(fname)
 
-def plot_results(results, plot_traingle_lines=True, out_fig_fname=None):
+def plot_results(store, plot_traingle_lines=True, out_fig_fname=None):
     """
-    Function to generate an annotated heatmap using the results array
-    :param results:
+    Function to generate an annotated heatmap from a result store, cells which were not evaluated are left blank and
+    the interpolated cells of an adaptive sweep are marked with a dot
+    :param store: ResultStore, e.g. memory-mapped with result_store.open_store
     :param out_fig_fname:
     :return:
     """
+    results = store.matrix('success_rate')[1:, 1:].T
+    estimated = store.matrix('estimated', fill=False)[1:, 1:].T
     # Plot the results
     fig, ax = plt.subplots()
 
@@ -139,6 +328,10 @@ def plot_results(results, plot_traingle_lines=True, out_fig_fname=None):
         plt.plot(x, y_up, 'black', linewidth=0.5)
         plt.plot(x, y_down, 'black', linewidth=0.5)
 
+    if np.any(estimated):
+        y, x = np.nonzero(estimated)
+        plt.scatter(x, y, s=0.5, c='gray', marker='.')
+
     # Create colorbar
     cbar = ax.figure.colorbar(im, ax=ax)
     cbar.ax.set_ylabel("Proportion of successful shepherding events", rotation=-90, va="bottom")
@@ -167,6 +360,6 @@ if __name__ == '__main__':
     print(f"Loaded decision params: {DECISION_PARAMS}")
 
     print("Start evaluation")
-    results = evaluate_paper()
-    print(results)
-    plot_results(results[1:, 1:].T, RESULT_FIG_FILE)
+    store = evaluate_adaptive() if ADAPTIVE_SWEEP else evaluate_paper()
+    print(store.matrix('success_rate'))
+    plot_results(open_store(RESULT_FILE), out_fig_fname=RESULT_FIG_FILE)
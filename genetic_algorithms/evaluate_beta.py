@@ -5,7 +5,9 @@ import numpy as np
 import pandas as pd
 from shepherd_simulation import Decision_type
 
-from fitness_function import fitness_func
+from fitness_function import fitness_func, simulation_count
+from parameter_scan import ParameterScan
+from telemetry import SweepTelemetry, report_task_done, report_task_start, telemetry_worker_init
 from datetime import datetime
 
 no_timesteps = 1000
@@ -15,6 +17,15 @@ verbose = True
 no_beta = 31
 max_beta = 3
 min_beta = 0
+# evaluate a coarse grid of no_coarse_beta betas and refine around the best one by golden-section search,
+# instead of the full grid of no_beta betas
+refine_scan = True
+no_coarse_beta = 11
+no_refine_iterations = 8
+# seconds between two progress summaries of the grid evaluation, also written to telemetry_file.
+# telemetry_port serves them as JSON at http://127.0.0.1:telemetry_port/ (None to disable)
+telemetry_interval = 30.
+telemetry_port = None
 
 evaluated_counter = 0
 total_evaluations_num = 0
@@ -25,6 +36,8 @@ DECISION_PARAMS = None
 timestamp = datetime.now().strftime('%Y.%m.%d.%H.%M')
 result_file = f"results/evaluation_beta.{timestamp}.npy"
 result_fig_file = f"results/evaluation_beta.{timestamp}.png"
+result_betas_file = f"results/evaluation_beta.{timestamp}.betas.npy"
+telemetry_file = f"results/evaluation_beta.{timestamp}.telemetry.json"
 
 
 def _fitness_per_beta(beta, random_seed, beta_idx, id, total_evaluations_num, start_time):
@@ -35,10 +48,13 @@ def _fitness_per_beta(beta, random_seed, beta_idx, id, total_evaluations_num, st
     if verbose:
         print(f"Evaluating beta: {beta}\tprocess_id: {mp.current_process().name[len('ForkPoolWorker-'):]}\telapsed: {str(datetime.now() - start_time).split('.')[0]}\tprogress: {round(100 * id / total_evaluations_num, 2)}")
 
+    report_task_start()
     result = []
     # Repeat fitness for 20 times (default parameter)
     avg_score = 0
     score = fitness_func([1,beta,0],decision_type=DECISION_TYPE, random_seed=random_seed, max_steps_in_sim=no_timesteps)
+    # fitness_func does not expose the number of steps of its simulations
+    report_task_done(simulation_count())
 
     res = None
     with open(result_file, 'rb') as f:
@@ -74,23 +90,51 @@ def evaluate_paper():
     with open(result_file, 'wb') as f:
         np.save(f, results)
 
-    with mp.Pool(processes=mp.cpu_count()) as pool:
-        out = pool.starmap(_fitness_per_beta, generate_fitness_args(), chunksize=1)
+    args = generate_fitness_args()
+    with SweepTelemetry(len(args), mp.cpu_count(), metrics_file=telemetry_file, refresh_interval=telemetry_interval,
+                        http_port=telemetry_port) as telemetry, \
+            mp.Pool(processes=mp.cpu_count(), initializer=telemetry_worker_init, initargs=telemetry.initargs) as pool:
+        out = pool.starmap(_fitness_per_beta, args, chunksize=1)
 
     with open(result_file, 'rb') as f:
         results = np.load(f)
 
     return results
 
-def plot_results(results, out_fig_fname=None):
+def _fitness(params, random_seed):
+    """
+    Fitness (to maximize) of the parameters for one seed, the same seeds are used for every beta of the scan.
+    """
+    return fitness_func(params, decision_type=DECISION_TYPE, random_seed=random_seed, max_steps_in_sim=no_timesteps)
+
+def evaluate_scan():
+    """
+    Run the coarse grid with refinement around the best beta
+    :return: betas, results: evaluated betas in increasing order, fitness of shape (no_sims_per_beta, betas) like
+    the results of evaluate_paper
+    """
+    with mp.Pool(processes=mp.cpu_count()) as pool:
+        scan = ParameterScan(_fitness, [1, 0, 0], 1, seeds=range(no_sims_per_beta), pool=pool, maximize=True)
+        betas, results = scan.run(min_beta, max_beta, num_coarse=no_coarse_beta, num_refine=no_refine_iterations)
+
+    with open(result_file, 'wb') as f:
+        np.save(f, results)
+    with open(result_betas_file, 'wb') as f:
+        np.save(f, betas)
+    print(f"Best beta: {scan.best()[0]} ({len(betas)} betas evaluated)")
+    return betas, results
+
+def plot_results(results, out_fig_fname=None, betas=None):
     """
     Function to generate an annotated heatmap using the results array
     :param results:
     :param out_fig_fname:
+    :param betas: betas of the results columns, the full grid by default
     :return:
     """
 
-    betas = np.linspace(min_beta, max_beta, no_beta)
+    if betas is None:
+        betas = np.linspace(min_beta, max_beta, no_beta)
     plt.plot(betas, np.sum(results, axis=0)/no_sims_per_beta)
 
 
@@ -109,6 +153,9 @@ def plot_results(results, out_fig_fname=None):
 if __name__ == '__main__':
 
     print("Start evaluation")
-    results = evaluate_paper()
+    if refine_scan:
+        betas, results = evaluate_scan()
+    else:
+        betas, results = None, evaluate_paper()
     print(results)
-    plot_results(results, result_fig_file)
+    plot_results(results, result_fig_file, betas)
@@ -1,47 +1,26 @@
-import numpy as np
+from multiprocessing import Pool, cpu_count
+
 from fitness_function import fitness_func
+from parameter_scan import ParameterScan
+from shepherd_simulation import Decision_type
 import matplotlib.pyplot as plt
-import pickle
 
 
 # THIS SCRIPT COMPUTE THE BEST EXPONENT FOR NUMBER OF SHEEP IN DECISION FUNCTION,
 # ALPHA AND GAMMA ARE SAME AS IN STROMBOM MODEL
 
-def get_fitness(beta):
-    score = fitness_func([1, beta, 0], 0)
+def get_score(params, random_seed):
+    score = fitness_func(params, Decision_type.DEFAULT_STROMBOM, random_seed=random_seed)
     score = 1 / score
     print(score)
     return score
 
 
-betas = np.linspace(0, 4, 41)
-
-scores = list(map(get_fitness, betas))
-# with open("betas_scores.pkl", "wr") as fb:
-#    pickle.dump(scores,fb)
-#scores = [
-    # 427655.5728045554,
-    # 417172.3518815973,
-    # 467633.22193663137,
-    # 415139.18645559164,
-    # 442230.45202836284,
-    # 276283.3273224374,
-    # 304737.0873321866,
-    # 175970.49621785906,
-    # 274876.9932362772,
-    # 211767.91619375107,
-    # 162219.64884185634,
-    # 133115.66044006683,
-    # 163670.47923140138,
-    # 101272.12521814943,
-    # 146852.44723003195,
-    # 180225.53847183072,
-    # 163731.88042086494,
-    # 134980.83381891772,
-    # 103920.5451062532,
-    # 165368.81642590847,
-    # 164708.84478877578,
-# ]
+if __name__ == '__main__':
+    # coarse grid over [0, 4] in parallel, refined around the best beta by golden-section search
+    with Pool(cpu_count()) as pool:
+        betas, scores = ParameterScan(get_score, [1, 0, 0], 1, pool=pool).run(0, 4, num_coarse=11, num_refine=8)
+    scores = scores[0]
 
-plt.plot(betas, scores)
-plt.show()
\ No newline at end of file
+    plt.plot(betas, scores, marker='.')
+    plt.show()
\ No newline at end of file
@@ -1,8 +1,15 @@
+from itertools import starmap
+
 import numpy as np
 from shepherd_simulation  import Decision_type, ShepherdSimulation
+from batch_simulation import BatchShepherdSimulation
+from workspace import StepWorkspace
 
 STEP_BETWEEN_SIMULATIONS_FOR_N_AND_n = 4
 
+# step buffers of the simulations run in this process, kept warm across solutions and generations
+WORKSPACE = StepWorkspace()
+
 
 def simulation_count():
     """Compute number of simulation in fitness function"""
@@ -18,7 +25,7 @@ def fitness_func_single_sim(solution, num_sheep_total, num_sheep_neighbors, sim_
     Is based on running shepherd simulation
     """
     sim = ShepherdSimulation(
-        num_sheep_total=num_sheep_total, num_sheep_neighbors=num_sheep_neighbors, decision_type=decision_type, random_seed=random_seed, max_steps=max_steps_per_sim)
+        num_sheep_total=num_sheep_total, num_sheep_neighbors=num_sheep_neighbors, decision_type=decision_type, random_seed=random_seed, max_steps=max_steps_per_sim, workspace=WORKSPACE)
     sim.set_thresh_field_params(solution)
 
     t_steps, success, sheep_poses = sim.run()
@@ -33,6 +40,25 @@ def fitness_func_single_sim(solution, num_sheep_total, num_sheep_neighbors, sim_
     return score
 
 
+def fitness_scores_batch(solutions, num_sheep_total, num_sheep_neighbors, sim_count, decision_type, random_seed, max_steps_per_sim):
+    """Batched version of fitness_func_single_sim, returns the scores of all solutions for certain total and neighbor
+    numbers of sheep. All solutions are simulated on the same seeded environment in one vectorized simulation, the
+    scores are equal to the ones of fitness_func_single_sim (run batch_simulation.py to check it)
+    """
+    sim = BatchShepherdSimulation(
+        solutions, num_sheep_total=num_sheep_total, num_sheep_neighbors=num_sheep_neighbors, decision_type=decision_type, random_seed=random_seed, max_steps=max_steps_per_sim)
+
+    t_steps, success, sheep_poses = sim.run()
+
+    sheep_target_dists = np.linalg.norm(sheep_poses - sim.target, axis=2)
+
+    # score calculation - same as in fitness_func_single_sim
+    scores = t_steps.astype(float)
+    failed = t_steps >= sim.max_steps
+    scores[failed] = sim.max_steps * sim_count + np.sum(sheep_target_dists[failed], axis=1)
+    return scores
+
+
 def fitness_func(solution, decision_type, random_seed = 0, max_steps_in_sim=1000):
     """Returns the score of provided solution
     To be used in PyGAD, needs to be maximization function
@@ -49,9 +75,33 @@ def fitness_func(solution, decision_type, random_seed = 0, max_steps_in_sim=1000
     return 1 / total_score
 
 
+def fitness_func_batch(solutions, decision_type, random_seed=0, max_steps_in_sim=1000, pool=None):
+    """Returns the scores of all solutions of a population, batched version of fitness_func
+    Every (N, n) environment is simulated once for the whole population, in parallel if a pool is given
+    """
+    sim_count = simulation_count()
+    args = []
+    for N in range(30, 140, STEP_BETWEEN_SIMULATIONS_FOR_N_AND_n):
+        for n in range(int(np.floor(3 * np.log2(N))), int(np.ceil(0.53 * N)), STEP_BETWEEN_SIMULATIONS_FOR_N_AND_n):
+            args.append((solutions, N, n, sim_count, decision_type, random_seed, max_steps_in_sim))
+    scores = pool.starmap(fitness_scores_batch, args, chunksize=1) if pool is not None else list(starmap(fitness_scores_batch, args))
+
+    # score calculation, every solution summed over its own contiguous row like in fitness_func
+    total_score = np.sum(np.ascontiguousarray(np.transpose(scores)), axis=1)
+    return 1 / total_score
+
+
 def fitness_func_strombom(solution, solution_idx):
     return fitness_func(solution, Decision_type.DEFAULT_STROMBOM)
 
 
 def fitness_func_sigmoid(solution, solution_idx):
     return fitness_func(solution, Decision_type.SIGMOID)
+
+
+def fitness_func_batch_strombom(solutions, pool=None):
+    return fitness_func_batch(solutions, Decision_type.DEFAULT_STROMBOM, pool=pool)
+
+
+def fitness_func_batch_sigmoid(solutions, pool=None):
+    return fitness_func_batch(solutions, Decision_type.SIGMOID, pool=pool)
@@ -0,0 +1,104 @@
+"""Per-step state of the herd shared within a simulation
+GrazingScheduler samples the grazing moves of the sheep far from the dog, HerdStatistics caches the statistics of the
+herd which several consumers need in the same step.
+"""
+import numpy as np
+
+
+class GrazingScheduler:
+    """Event driven sampling of the grazing moves of the sheep far from the dog.
+    Instead of drawing in every step whether each far sheep moves, the step of its next move is sampled from a
+    geometric distribution, so only the sheep whose move is due have to be touched.
+    """
+
+    def __init__(self, num_sheep, grazing_prob, random_state):
+        self.grazing_prob = grazing_prob
+        self.random_state = random_state
+        self.step = 0
+        # sheep farther than the dog repulsion distance in the last step
+        self.is_far = np.zeros(num_sheep, dtype=bool)
+        # step of the next grazing move of each sheep, only valid while the sheep is far from the dog
+        self.next_move = np.full(num_sheep, -1, dtype=np.int64)
+        # step -> list of arrays of sheep indices with a move scheduled at this step
+        self.events = {}
+
+    def __schedule(self, sheep, first_step):
+        next_move = first_step + self.random_state.geometric(self.grazing_prob, len(sheep)) - 1
+        self.next_move[sheep] = next_move
+        order = np.argsort(next_move, kind='stable')
+        steps, starts = np.unique(next_move[order], return_index=True)
+        for step, group in zip(steps, np.split(sheep[order], starts[1:])):
+            self.events.setdefault(step, []).append(group)
+
+    def update(self, is_far):
+        """
+        Advance the scheduler by one step
+        :param is_far: boolean mask of the sheep which are far from the dog in this step
+        :return: newly_far, moving: indices of the sheep which just left the dog and of the sheep moving in this step
+        """
+        newly_far = np.flatnonzero(is_far & ~self.is_far)
+        self.is_far = is_far
+        if len(newly_far) > 0:
+            # memoryless: a sheep leaving the dog may already move in this step
+            self.__schedule(newly_far, self.step)
+
+        due = self.events.pop(self.step, [])
+        moving = np.concatenate(due) if due else np.empty(0, dtype=np.intp)
+        # drop events of sheep which came close to the dog in the meantime (they were rescheduled on leaving)
+        moving = moving[(self.next_move[moving] == self.step) & is_far[moving]]
+        if len(moving) > 0:
+            self.__schedule(moving, self.step + 1)
+
+        self.step += 1
+        return newly_far, moving
+
+
+class HerdStatistics:
+    """Statistics of the herd, shared by all consumers within one simulation step.
+    The center of mass is computed once per step, the distances to it, the farthest sheep and the variance of the
+    distances are computed lazily at most once per step.
+    """
+
+    def __init__(self, sheep_poses):
+        """
+        :param sheep_poses: array of the sheep positions, updated in place by the simulation
+        """
+        self.sheep_poses = sheep_poses
+        self.update()
+
+    def update(self):
+        """
+        Update the statistics after the sheep positions were moved
+        """
+        # summed row by row in every state layout, a contiguous axis of sheep (struct of arrays) would be summed
+        # pairwise
+        self.com = np.mean(np.ascontiguousarray(self.sheep_poses), axis=0)
+        self._dist_to_com = None
+        self._farthest_idx = None
+        self._dist_variance = None
+
+    @property
+    def dist_to_com(self):
+        if self._dist_to_com is None:
+            self._dist_to_com = np.linalg.norm(self.sheep_poses - self.com[None, :], axis=1)
+        return self._dist_to_com
+
+    @property
+    def farthest_idx(self):
+        if self._farthest_idx is None:
+            self._farthest_idx = np.argmax(self.dist_to_com)
+        return self._farthest_idx
+
+    @property
+    def farthest_sheep(self):
+        return self.sheep_poses[self.farthest_idx, :]
+
+    @property
+    def max_dist_to_com(self):
+        return self.dist_to_com[self.farthest_idx]
+
+    @property
+    def dist_variance(self):
+        if self._dist_variance is None:
+            self._dist_variance = np.var(self.dist_to_com)
+        return self._dist_variance
@@ -0,0 +1,169 @@
+"""Island model of the genetic algorithm
+Several PooledGA populations (islands) evolve in separate processes, possibly on separate hosts, and periodically
+send their best solutions to the next island of a ring.
+"""
+import multiprocessing as mp
+import os
+import random
+import time
+from os.path import isfile
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from pooled_ga import FitnessPool, PooledGA
+
+
+class FileMigrationBroker:
+    """Exchanges the migrants between the islands through files in a directory
+    For islands on several hosts the directory has to be on a file system shared by them. Any object with the same
+    publish / receive methods (e.g. backed by a socket server) can replace it.
+    """
+
+    def __init__(self, directory, timeout=600, poll_interval=0.1):
+        """
+        :param directory: directory of the migrant files
+        :param timeout: seconds to wait for the migrants of another island, after that the migration is skipped
+        :param poll_interval: seconds between checks for the migrant file
+        """
+        self.directory = directory
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, island_id, generation):
+        return os.path.join(self.directory, f'migrants.island_{island_id}.generation_{generation}.npz')
+
+    def publish(self, island_id, generation, migrants, fitness):
+        """
+        :param migrants: genes of the migrating solutions
+        :param fitness: their fitness
+        """
+        path = self.__path(island_id, generation)
+        # written under another name first, so a reader never sees a partial file
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, migrants=migrants, fitness=fitness)
+        os.replace(path + '.tmp', path)
+
+    def receive(self, island_id, generation):
+        """
+        :return: migrants, fitness: genes and fitness of the solutions published by the island in this generation,
+        None if they did not arrive in time
+        """
+        path = self.__path(island_id, generation)
+        deadline = time.time() + self.timeout
+        while not isfile(path):
+            if time.time() > deadline:
+                return None
+            time.sleep(self.poll_interval)
+        with np.load(path) as data:
+            return data['migrants'], data['fitness']
+
+
+def island_log_path(log_path, island_id):
+    root, ext = os.path.splitext(log_path)
+    return f'{root}.island_{island_id}{ext}'
+
+
+def run_island(island_id, num_islands, broker, log_path, create_log, fitness_func, ga_kwargs,
+               batch_fitness_func=None, migration_interval=10, num_migrants=2, processes=None):
+    """
+    Evolve one island. Every migration_interval generations, its num_migrants best solutions are published and
+    replace the worst solutions of the next island. Can be started on its own on each host.
+    :param island_id: index of the island in the ring
+    :param num_islands: number of islands in the ring
+    :param broker: FileMigrationBroker (or an object with the same interface)
+    :param log_path: path of the merged log, the island logs next to it
+    :param create_log: create_log function of the GA script, taking the genes columns, fitnesses, indices,
+    generation and timestamp
+    :param fitness_func: fitness function of the solutions
+    :param ga_kwargs: arguments of PooledGA (pygad.GA), without on_generation
+    :param batch_fitness_func: optional function computing the fitness of the whole population at once
+    :param migration_interval: number of generations between migrations
+    :param num_migrants: number of solutions sent to the next island
+    :param processes: number of fitness pool processes of this island
+    :return: best solution, its fitness
+    """
+    # forked islands would otherwise start from the same random state, hence the same initial population
+    np.random.seed()
+    random.seed()
+    path = island_log_path(log_path, island_id)
+    last_timer = timer()
+
+    def on_generation(ga):
+        nonlocal last_timer
+        fitness = ga.last_generation_fitness
+        generation = ga.generations_completed
+
+        logs = pd.read_pickle(path) if isfile(path) else None
+        new_logs = create_log(*ga.population.T, fitness, list(range(len(fitness))), generation, time.time())
+        new_logs['island'] = island_id
+        pd.to_pickle(pd.concat([logs, new_logs]) if logs is not None else new_logs, path)
+
+        elapsed = round(timer() - last_timer, 2)
+        last_timer = timer()
+        print(f'Island {island_id}: generation {generation} was completed in {elapsed}s, '
+              f'best fitness {np.max(fitness)}')
+
+        if num_islands > 1 and generation % migration_interval == 0:
+            order = np.argsort(fitness)
+            best = order[-num_migrants:]
+            broker.publish(island_id, generation, ga.population[best], fitness[best])
+            received = broker.receive((island_id - 1) % num_islands, generation)
+            if received is None:
+                print(f'Island {island_id}: no migrants arrived in generation {generation}')
+            else:
+                # the next generation selects its parents by last_generation_fitness, so the migrants bring theirs
+                migrants, migrants_fitness = received
+                worst = order[:len(migrants)]
+                ga.population[worst] = migrants
+                ga.last_generation_fitness[worst] = migrants_fitness
+
+    with FitnessPool(fitness_func, ga_kwargs['sol_per_pop'], ga_kwargs['num_genes'], processes=processes) as pool:
+        ga_instance = PooledGA(pool, batch_fitness_func=batch_fitness_func, on_generation=on_generation,
+                               **ga_kwargs)
+        ga_instance.run()
+        solution, solution_fitness, _ = ga_instance.best_solution()
+    return solution, solution_fitness
+
+
+def merge_island_logs(log_path, num_islands):
+    """
+    Merge the island logs into one log of the same format as a single population, with an additional island
+    column. The solution indices are numbered through all islands of a generation.
+    :return: merged log
+    """
+    logs = pd.concat([pd.read_pickle(island_log_path(log_path, island_id))
+                      for island_id in range(num_islands)
+                      if isfile(island_log_path(log_path, island_id))])
+    logs = logs.sort_values(['generation', 'island', 'index'], kind='stable')
+    logs['index'] = logs.groupby('generation').cumcount()
+    pd.to_pickle(logs, log_path)
+    return logs
+
+
+def run_islands(num_islands, log_path, create_log, fitness_func, ga_kwargs, batch_fitness_func=None,
+                migration_interval=10, num_migrants=2, processes=None, island_ids=None, broker=None):
+    """
+    Run the islands of this host in separate processes and merge their logs.
+    :param island_ids: islands run on this host, all by default. With several hosts, every host runs its share of
+    the islands with a broker in a shared directory, and the logs are merged by the last host to finish
+    :param broker: migration broker, by default a FileMigrationBroker in a directory next to the log
+    :return: merged log
+    """
+    if island_ids is None:
+        island_ids = range(num_islands)
+    if broker is None:
+        broker = FileMigrationBroker(os.path.splitext(log_path)[0] + '.migrants')
+
+    islands = [mp.Process(target=run_island,
+                          args=(island_id, num_islands, broker, log_path, create_log, fitness_func, ga_kwargs,
+                                batch_fitness_func, migration_interval, num_migrants, processes))
+               for island_id in island_ids]
+    for island in islands:
+        island.start()
+    for island in islands:
+        island.join()
+
+    return merge_island_logs(log_path, num_islands)
@@ -0,0 +1,378 @@
+"""Local simulation job service
+A long-running asyncio server which runs batches of simulation specs on a persistent pool of warm worker processes
+(imported simulation, reused step buffers). A spec describes exactly one simulation, its random stream is derived from
+the sweep seed and (N, n, repetition) with get_sweep_random_state, so results are cached by their normalized spec:
+repeated specs are answered from the cache, specs which are already running are awaited instead of being simulated
+twice. The cache is appended to CACHE_FILE and reloaded at start. Its first line holds the code_version the results
+were computed with, a cache of another version is discarded.
+
+The protocol is newline-delimited JSON over a Unix socket (address given as path) or localhost TCP ((host, port)):
+    {"op": "batch", "specs": [spec, ...]}  -> one {"index", "result", "cached"} line per spec as soon as it is done
+                                             (in completion order), then {"op": "done", "count", "cached"}
+    {"op": "stats"}                        -> {"workers", "version", "cache_size", "computed", "cache_hits",
+                                               "in_flight"}
+    {"op": "shutdown"}                     -> {"op": "bye"}, then the service stops
+A spec has the keys of SPEC_DEFAULTS, of which N, n, seed and repetition are required. Its result is
+{"steps", "success", "stalled_at"}. A failed spec is answered with {"index", "error"} and does not end its batch.
+JobClient is the blocking client used by evaluate.py (JOB_SERVICE_ADDRESS). The beta scans (evaluate_beta.py,
+exponent_guess.py) score solutions with fitness_func, whose legacy seeding and final sheep positions a spec does not
+cover, and the root evaluation.py runs the root simulation, so they keep their local pools.
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from shepherd_simulation import Decision_type, ShepherdSimulation
+from progress_monitor import ProgressMonitor
+from sweep import get_sweep_random_state
+from workspace import StepWorkspace
+
+SERVICE_ADDRESS = 'results/job_service.sock'
+NUM_WORKERS = mp.cpu_count()
+CACHE_FILE = 'results/job_service_cache.jsonl'
+# specs of a batch in flight per worker
+BATCH_WINDOW_PER_WORKER = 4
+# sources the results depend on, a change of any of them invalidates the cache
+SIMULATION_SOURCES = ('shepherd_simulation.py', 'herd.py', 'neighbor_list.py', 'progress_monitor.py', 'quadtree.py',
+                      'sweep.py', 'utils.py', 'workspace.py', 'job_service.py')
+
+SPEC_DEFAULTS = {
+    'N': None,
+    'n': None,
+    'seed': None,
+    'repetition': None,
+    'max_steps': 1000,
+    'decision_type': Decision_type.DEFAULT_STROMBOM,
+    'decision_params': None,
+    # abort the simulation after this many steps without progress of the herd (None runs it in full)
+    'stall_window': None,
+    # only record the stall without aborting the simulation
+    'validate_stall': False,
+}
+REQUIRED_KEYS = ('N', 'n', 'seed', 'repetition')
+
+# step buffers of a worker process, reused by all of its simulations
+_workspace = None
+
+
+def normalize_spec(spec):
+    """
+    :return: spec completed with the defaults and JSON-compatible values, raises an Exception if it is invalid
+    """
+    unknown = set(spec) - set(SPEC_DEFAULTS)
+    if unknown:
+        raise Exception(f"Unknown spec keys: {sorted(unknown)}")
+    spec = dict(SPEC_DEFAULTS, **spec)
+    missing = [key for key in REQUIRED_KEYS if spec[key] is None]
+    if missing:
+        raise Exception(f"Missing spec keys: {missing}")
+    for key in ('N', 'n', 'seed', 'repetition', 'max_steps'):
+        spec[key] = int(spec[key])
+    if not 1 <= spec['n'] < spec['N']:
+        raise Exception(f"Invalid number of neighbors {spec['n']} for {spec['N']} sheep")
+    if spec['decision_params'] is not None:
+        spec['decision_params'] = [float(param) for param in spec['decision_params']]
+    if spec['stall_window'] is not None:
+        spec['stall_window'] = int(spec['stall_window'])
+    spec['validate_stall'] = bool(spec['validate_stall'])
+    return spec
+
+
+def spec_key(spec):
+    return json.dumps(spec, sort_keys=True)
+
+
+def code_version():
+    """
+    :return: hash of SIMULATION_SOURCES and the numpy version, whose rounding the seeded results depend on as well
+    """
+    digest = hashlib.sha256(np.__version__.encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for fname in SIMULATION_SOURCES:
+        with open(os.path.join(directory, fname), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def _init_worker():
+    global _workspace
+    _workspace = StepWorkspace()
+
+
+def run_spec(spec):
+    """
+    Run the simulation of a normalized spec
+    :return: dict steps, success, stalled_at
+    """
+    sim = ShepherdSimulation(num_sheep_total=spec['N'], num_sheep_neighbors=spec['n'], max_steps=spec['max_steps'],
+                             decision_type=spec['decision_type'], workspace=_workspace,
+                             random_state=get_sweep_random_state(spec['seed'], spec['N'], spec['n'], spec['repetition']))
+    if spec['decision_params'] is not None:
+        sim.set_thresh_field_params(spec['decision_params'])
+    monitor = None
+    if spec['stall_window'] is not None:
+        monitor = ProgressMonitor(spec['stall_window'], terminate=not spec['validate_stall'])
+    steps, success, _ = sim.run(progress_monitor=monitor)
+    return {'steps': int(steps), 'success': bool(success), 'stalled_at': monitor.stalled_at if monitor else None}
+
+
+class JobService:
+    def __init__(self, address=SERVICE_ADDRESS, num_workers=NUM_WORKERS, cache_file=CACHE_FILE, version=None):
+        """
+        :param address: path of the Unix socket or (host, port) of the TCP server
+        :param num_workers: number of worker processes of the pool
+        :param cache_file: JSON lines file of the result cache, None to keep the cache in memory only
+        :param version: version of the simulation code, code_version() by default
+        """
+        self.address = address
+        self.num_workers = num_workers
+        self.cache_file = cache_file
+        self.version = version if version is not None else code_version()
+
+        self.cache = {}
+        self.running = {}
+        self.computed = 0
+        self.cache_hits = 0
+        self.executor = None
+        self.stopped = None
+        # writer -> handler task of the open connections
+        self.connections = {}
+
+        if cache_file is not None:
+            self.__load_cache()
+
+    def __load_cache(self):
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file) as f:
+                header = json.loads(f.readline() or '{}')
+                if header.get('version') == self.version:
+                    for line in f:
+                        entry = json.loads(line)
+                        self.cache[entry['key']] = entry['result']
+                    return
+            print(f"Discarding the cache {self.cache_file} of version {header.get('version')}, "
+                  f"the simulation code is version {self.version}")
+        with open(self.cache_file, 'w') as f:
+            f.write(json.dumps({'version': self.version}) + '\n')
+
+    async def result(self, spec):
+        """
+        :param spec: normalized spec
+        :return: result, cached: whether it was answered from the cache (or an identical running spec)
+        """
+        key = spec_key(spec)
+        if key in self.cache:
+            self.cache_hits += 1
+            return self.cache[key], True
+        if key in self.running:
+            self.cache_hits += 1
+            return await asyncio.shield(self.running[key]), True
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, run_spec, spec)
+        self.running[key] = future
+        # the result is cached even if the client which submitted the spec disconnects in the meantime
+        future.add_done_callback(lambda done: self.__finished(key, done))
+        return await asyncio.shield(future), False
+
+    def __finished(self, key, future):
+        del self.running[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        self.cache[key] = result
+        self.computed += 1
+        if self.cache_file is not None:
+            with open(self.cache_file, 'a') as f:
+                f.write(json.dumps({'key': key, 'result': result}) + '\n')
+
+    def stats(self):
+        return {'workers': self.num_workers, 'version': self.version, 'cache_size': len(self.cache),
+                'computed': self.computed,
+                'cache_hits': self.cache_hits, 'in_flight': len(self.running)}
+
+    async def __batch(self, specs, writer):
+        try:
+            specs = [normalize_spec(spec) for spec in specs]
+        except Exception as e:
+            writer.write((json.dumps({'error': str(e)}) + '\n').encode())
+            return
+
+        async def indexed(index, spec):
+            try:
+                return index, await self.result(spec), None
+            except Exception as e:
+                return index, (None, False), f"spec {index}: {e!r}"
+
+        # only a window of the specs is in flight, so that large batches do not flood the pool queue
+        window = BATCH_WINDOW_PER_WORKER * self.num_workers
+        remaining = iter(enumerate(specs))
+        pending = set()
+        num_cached = 0
+        while True:
+            for index, spec in itertools.islice(remaining, window - len(pending)):
+                pending.add(asyncio.ensure_future(indexed(index, spec)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, (result, cached), error = task.result()
+                num_cached += cached
+                response = {'index': index, 'error': error} if error is not None else \
+                    {'index': index, 'result': result, 'cached': cached}
+                writer.write((json.dumps(response) + '\n').encode())
+            await writer.drain()
+        writer.write((json.dumps({'op': 'done', 'count': len(specs), 'cached': num_cached}) + '\n').encode())
+
+    async def __handle(self, reader, writer):
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while not reader.at_eof():
+                line = await reader.readline()
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                op = request.get('op')
+                if op == 'batch':
+                    await self.__batch(request.get('specs', []), writer)
+                elif op == 'stats':
+                    writer.write((json.dumps(self.stats()) + '\n').encode())
+                elif op == 'shutdown':
+                    writer.write((json.dumps({'op': 'bye'}) + '\n').encode())
+                    await writer.drain()
+                    self.stopped.set()
+                    break
+                else:
+                    writer.write((json.dumps({'error': f"Unknown op {op}"}) + '\n').encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+    async def serve(self):
+        """
+        Run the service until a shutdown request
+        """
+        self.stopped = asyncio.Event()
+        self.executor = ProcessPoolExecutor(self.num_workers, initializer=_init_worker)
+        # start the workers before the first request
+        await asyncio.gather(*[asyncio.get_running_loop().run_in_executor(self.executor, os.getpid)
+                               for _ in range(self.num_workers)])
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            server = await asyncio.start_unix_server(self.__handle, path=self.address)
+        else:
+            server = await asyncio.start_server(self.__handle, *self.address)
+        print(f"Job service listening on {self.address} with {self.num_workers} workers, "
+              f"{len(self.cache)} cached results")
+        async with server:
+            await self.stopped.wait()
+            # the other clients see the end of their connection, a running batch ends at its next result
+            handlers = list(self.connections.values())
+            for writer in list(self.connections):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+        self.executor.shutdown(cancel_futures=True)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class JobClient:
+    def __init__(self, address=SERVICE_ADDRESS):
+        """
+        Blocking client of a running JobService
+        :param address: path of the Unix socket or (host, port) of the TCP server
+        """
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        else:
+            self.socket = socket.create_connection(address)
+        self.file = self.socket.makefile('rwb')
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __request(self, request):
+        self.file.write((json.dumps(request) + '\n').encode())
+        self.file.flush()
+
+    def __response(self):
+        line = self.file.readline()
+        if not line:
+            raise Exception("Job service closed the connection")
+        return json.loads(line)
+
+    def __checked_response(self):
+        response = self.__response()
+        if 'error' in response:
+            raise Exception(f"Job service error: {response['error']}")
+        return response
+
+    def stream_batch(self, specs):
+        """
+        Submit a batch of specs. The failed specs do not end the batch, it is read up to its end before their errors
+        are raised, so that the connection stays usable. Also a batch which is not consumed in full is read to its end.
+        :return: generator of (index, result, cached) in completion order
+        """
+        self.__request({'op': 'batch', 'specs': list(specs)})
+        errors = []
+        done = False
+        try:
+            while True:
+                response = self.__response()
+                if response.get('op') == 'done':
+                    done = True
+                    break
+                if 'error' in response:
+                    if 'index' not in response:
+                        # the batch was rejected as a whole, nothing follows
+                        done = True
+                        raise Exception(f"Job service error: {response['error']}")
+                    errors.append(response['error'])
+                    continue
+                yield response['index'], response['result'], response['cached']
+        finally:
+            while not done:
+                done = self.__response().get('op') == 'done'
+        if errors:
+            raise Exception(f"Job service error in {len(errors)} specs: {'; '.join(errors)}")
+
+    def run_batch(self, specs):
+        """
+        :return: list of the results in the order of the specs
+        """
+        specs = list(specs)
+        results = [None] * len(specs)
+        for index, result, _ in self.stream_batch(specs):
+            results[index] = result
+        return results
+
+    def stats(self):
+        self.__request({'op': 'stats'})
+        return self.__checked_response()
+
+    def shutdown(self):
+        self.__request({'op': 'shutdown'})
+        return self.__checked_response()
+
+
+if __name__ == '__main__':
+    asyncio.run(JobService().serve())
@@ -0,0 +1,104 @@
+"""Tolerance study of the state layouts of the simulation (see State_layout)
+The success rates over a grid of (N, n) cells are compared between the reference layout and the single precision
+struct-of-arrays layout. Every repetition of a cell runs on the same seeded environment in both layouts, so the
+difference of a cell is estimated from paired runs. The double precision struct-of-arrays layout has to reproduce
+the reference layout bit for bit, which is checked on the same grid. The last part measures the time of one step with
+every sheep near the dog and the bytes of the step buffers for large herds.
+"""
+import multiprocessing as mp
+from timeit import default_timer as timer
+
+import numpy as np
+
+from shepherd_simulation import ShepherdSimulation, State_layout
+from sweep import get_sweep_random_state
+
+NO_TIMESTEPS = 1500
+NO_SIMS_PER_COMBINATION = 50
+SWEEP_SEED = 0
+GRID = [(N, n) for N in (20, 50, 80) for n in sorted({max(N // 10, 1), N // 2, N - 1})]
+LAYOUTS = [State_layout.ARRAY_OF_STRUCTS_64, State_layout.STRUCT_OF_ARRAYS_32]
+BANDWIDTH_N = (500, 1000, 2000)
+
+
+def _simulate(N, n, repetition, state_layout):
+    sim = ShepherdSimulation(num_sheep_total=N, num_sheep_neighbors=n, max_steps=NO_TIMESTEPS,
+                             random_state=get_sweep_random_state(SWEEP_SEED, N, n, repetition),
+                             state_layout=state_layout)
+    return sim.run()
+
+
+def _run(N, n, repetition, state_layout):
+    return _simulate(N, n, repetition, state_layout)[1]
+
+
+def check_identical_layouts(num_repetitions=3):
+    """
+    :return: list of the (N, n, repetition) of GRID whose run in STRUCT_OF_ARRAYS_64 differs from the reference layout
+    """
+    differing = []
+    for N, n in GRID:
+        for repetition in range(num_repetitions):
+            (steps, _, poses), (steps_soa, _, poses_soa) = [
+                _simulate(N, n, repetition, state_layout)
+                for state_layout in (State_layout.ARRAY_OF_STRUCTS_64, State_layout.STRUCT_OF_ARRAYS_64)]
+            if steps != steps_soa or not np.array_equal(poses, poses_soa):
+                differing.append((N, n, repetition))
+    return differing
+
+
+def compare_success_rates(pool=None):
+    """
+    :return: dict (N, n) -> success rates of LAYOUTS, mean paired difference (second - first) and its standard error
+    """
+    args = [(N, n, repetition, state_layout) for N, n in GRID for repetition in range(NO_SIMS_PER_COMBINATION)
+            for state_layout in LAYOUTS]
+    successes = pool.starmap(_run, args, chunksize=1) if pool is not None else [_run(*arg) for arg in args]
+    successes = np.array(successes, dtype=float).reshape(len(GRID), NO_SIMS_PER_COMBINATION, len(LAYOUTS))
+
+    results = {}
+    for cell, runs in zip(GRID, successes):
+        diff = runs[:, 1] - runs[:, 0]
+        results[cell] = (runs.mean(axis=0), diff.mean(), diff.std(ddof=1) / np.sqrt(len(diff)))
+    return results
+
+
+def measure_step(N, state_layout, num_steps=5):
+    """
+    :return: seconds per step and bytes of the step buffers, with every sheep near the dog and n = N / 2
+    """
+    sim = ShepherdSimulation(num_sheep_total=N, num_sheep_neighbors=N // 2, random_state=np.random.RandomState(0),
+                             state_layout=state_layout)
+    sim.dog_pose = sim.sheep_com.copy()
+    sim.update_environment()
+    start = timer()
+    for _ in range(num_steps):
+        sim.update_environment()
+    seconds = (timer() - start) / num_steps
+    return seconds, sum(buffer.nbytes for buffer in sim.workspace.buffers.values())
+
+
+if __name__ == '__main__':
+    with mp.Pool(mp.cpu_count()) as pool:
+        results = compare_success_rates(pool)
+
+    print(f'Success rates over {NO_SIMS_PER_COMBINATION} paired runs, {LAYOUTS[0]} vs {LAYOUTS[1]}')
+    print('    N     n   rates           difference   z')
+    for (N, n), (rates, diff, std_err) in results.items():
+        z = diff / std_err if std_err > 0 else 0.
+        print(f'{N:5d} {n:5d}   {rates[0]:.2f} / {rates[1]:.2f}     {diff:+.3f}      {z:+.2f}')
+    diffs = np.array([diff for _, diff, _ in results.values()])
+    std_errs = np.array([std_err for _, _, std_err in results.values()])
+    print(f'Mean difference over all cells: {diffs.mean():+.4f} '
+          f'(standard error {np.sqrt(np.sum(std_errs ** 2)) / len(diffs):.4f})')
+
+    differing = check_identical_layouts()
+    print(f'{State_layout.STRUCT_OF_ARRAYS_64} vs {State_layout.ARRAY_OF_STRUCTS_64}: '
+          + (f'runs differ for (N, n, repetition) {differing}' if differing else 'all runs identical'))
+
+    print('Step with every sheep near the dog, n = N / 2')
+    for N in BANDWIDTH_N:
+        seconds, nbytes = zip(*[measure_step(N, state_layout) for state_layout in LAYOUTS])
+        print(f'N={N}: ' + ', '.join(f'{state_layout} {1e3 * s:.1f}ms {b / 2 ** 20:.0f}MB'
+                                     for state_layout, s, b in zip(LAYOUTS, seconds, nbytes))
+              + f', {nbytes[0] / nbytes[1]:.2f}x fewer bytes, speedup {seconds[0] / seconds[1]:.2f}')
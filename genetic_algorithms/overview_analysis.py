@@ -0,0 +1,179 @@
+"""Overview scores of any number of sweep results
+The results are opened lazily on their first use, result stores are memory-mapped (see result_store.py) and legacy
+dense .npy matrices are converted on the fly. Regions of the (N, n) plane are boolean masks over the cells in the
+order of cell_index and are built vectorized: all cells up to ANALYSIS_MAX_N, the transitional band between
+n = 3 log2(N) and n = 0.53 N in which the success rate changes, or any polygon.
+For every method and region, the mean and std of the success rates of the cells are reported with a bootstrap
+confidence interval of the mean. The paired difference to the reference method is bootstrapped by resampling the same
+cells for both methods. The bootstrap jobs run in a process pool and the tables are written to OVERVIEW_FILE.
+"""
+import multiprocessing as mp
+
+import numpy as np
+
+from result_store import open_results
+
+RESULT_FILES = [
+    ('Original Strömbom', 'results/evaluation.original_strombom.npy'),
+    ('GA Strömbom', 'results/evaluation.ga_strombom.npy'),
+    ('GA Sigmoid', 'results/evaluation.sigmoid.transition_only.npy'),
+    ('GA Sigmoid + Original Strömbom', 'results/evaluation.sigmoid.original_strombom.npy'),
+]
+REFERENCE = 'Original Strömbom'
+ANALYSIS_MAX_N = 100
+NO_BOOTSTRAP_SAMPLES = 10000
+CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 0
+OVERVIEW_FILE = 'results/overview.md'
+
+
+class LazyResults:
+    def __init__(self, files):
+        """
+        Results by name, each one is opened on its first access.
+        :param files: list of (name, path) of result stores (.npz) or legacy result matrices (.npy)
+        """
+        self.files = dict(files)
+        self.stores = {}
+
+    def names(self):
+        return list(self.files)
+
+    def __getitem__(self, name):
+        if name not in self.stores:
+            self.stores[name] = open_results(self.files[name], name)
+        return self.stores[name]
+
+
+def mask_all(N, n, max_N=ANALYSIS_MAX_N):
+    return N <= max_N
+
+
+def mask_transitional(N, n, max_N=ANALYSIS_MAX_N, first_N=30):
+    """
+    Cells between the lines n = 3 log2(N) and n = 0.53 N, as in evaluate.generate_N_n_pairs_difficult_range
+    """
+    return (N >= first_N) & (N <= max_N) & (n >= np.floor(3 * np.log2(N))) & (n < np.ceil(0.53 * N))
+
+
+def mask_polygon(N, n, vertices):
+    """
+    Cells inside of a polygon (even-odd rule), tested against all edges at once.
+    :param vertices: list of (N, n) corners of the polygon
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    x, y = N[:, None], n[:, None]
+    # edges which straddle the horizontal line through the cell, crossed to the right of the cell
+    straddles = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return np.count_nonzero(straddles & (x < x_cross), axis=1) % 2 == 1
+
+
+def default_regions(N, n):
+    return {'All': mask_all(N, n), 'Transitional area': mask_transitional(N, n)}
+
+
+def bootstrap_interval(values, num_samples, seed, confidence=CONFIDENCE, chunk_size=256):
+    """
+    Percentile bootstrap confidence interval of the mean of values, resampling the values with replacement.
+    :return: low, high
+    """
+    rng = np.random.default_rng(seed)
+    means = np.empty(num_samples)
+    for start in range(0, num_samples, chunk_size):
+        stop = min(start + chunk_size, num_samples)
+        means[start:stop] = values[rng.integers(0, len(values), (stop - start, len(values)))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    return tuple(np.quantile(means, [alpha, 1 - alpha]))
+
+
+def analyse(results, regions=None, reference=REFERENCE, num_samples=NO_BOOTSTRAP_SAMPLES, pool=None):
+    """
+    :param results: LazyResults
+    :param regions: dict name -> function (N, n) -> mask of the cells, default_regions if None
+    :param reference: name of the method the others are compared to
+    :return: scores, differences: dicts (method, region) -> (mean, std, ci) and (mean difference, ci), methods
+    which did not evaluate every cell of a region are left out
+    """
+    names = results.names()
+    store = results[names[0]]
+    N, n = store.N, store.n
+    if regions is None:
+        masks = default_regions(N, n)
+    else:
+        masks = {region: mask(N, n) for region, mask in regions.items()}
+
+    values = {}
+    for name in names:
+        if results[name].max_N != store.max_N:
+            raise Exception(f"{name} has max_N {results[name].max_N} instead of {store.max_N}")
+        evaluated = results[name].evaluated()
+        for region, mask in masks.items():
+            if np.all(evaluated[mask]):
+                values[name, region] = np.asarray(results[name].fields['success_rate'][mask])
+
+    jobs = list(values)
+    job_values = [values[job] for job in jobs]
+    paired = [(name, region) for name, region in jobs if name != reference and (reference, region) in values]
+    job_values += [values[job] - values[reference, job[1]] for job in paired]
+
+    seeds = np.random.SeedSequence(BOOTSTRAP_SEED).spawn(len(job_values))
+    args = [(job_value, num_samples, seed) for job_value, seed in zip(job_values, seeds)]
+    intervals = pool.starmap(bootstrap_interval, args) if pool is not None else [bootstrap_interval(*arg) for arg in args]
+
+    scores = {job: (np.mean(values[job]), np.std(values[job]), ci) for job, ci in zip(jobs, intervals)}
+    differences = {job: (np.mean(diff), ci) for job, diff, ci in zip(paired, job_values[len(jobs):], intervals[len(jobs):])}
+    return scores, differences
+
+
+def overview_table(names, region_names, scores, differences, reference=REFERENCE):
+    """
+    :return: markdown of the scores and of the differences to the reference
+    """
+    percent = f"{round(100 * CONFIDENCE)}% CI"
+    lines = ['# Results', '',
+             f"Success rates of the cells with N <= {ANALYSIS_MAX_N}, {percent} from {NO_BOOTSTRAP_SAMPLES} bootstrap "
+             f"samples of the cells.", '',
+             '| Type | ' + ' | '.join(f'{region} {column}' for region in region_names
+                                     for column in ('Mean', 'Std', percent)) + ' |',
+             '|:--|' + ':-:|' * (3 * len(region_names))]
+    for name in names:
+        row = []
+        for region in region_names:
+            if (name, region) in scores:
+                mean, std, (low, high) = scores[name, region]
+                row += [f'{mean:.3f}', f'{std:.3f}', f'[{low:.3f}, {high:.3f}]']
+            else:
+                row += ['N/A'] * 3
+        lines.append(f'| {name} | ' + ' | '.join(row) + ' |')
+
+    lines += ['', f'Paired difference to {reference} over the same cells.', '',
+              '| Type | ' + ' | '.join(f'{region} {column}' for region in region_names
+                                     for column in ('Difference', percent)) + ' |',
+              '|:--|' + ':-:|' * (2 * len(region_names))]
+    for name in names:
+        if name == reference:
+            continue
+        row = []
+        for region in region_names:
+            if (name, region) in differences:
+                diff, (low, high) = differences[name, region]
+                row += [f'{diff:+.3f}', f'[{low:+.3f}, {high:+.3f}]']
+            else:
+                row += ['N/A'] * 2
+        lines.append(f'| {name} | ' + ' | '.join(row) + ' |')
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    results = LazyResults(RESULT_FILES)
+    with mp.Pool(mp.cpu_count()) as pool:
+        scores, differences = analyse(results, pool=pool)
+    region_names = list(default_regions(np.zeros(0), np.zeros(0)))
+    table = overview_table(results.names(), region_names, scores, differences)
+    with open(OVERVIEW_FILE, 'w') as f:
+        f.write(table)
+    print(table)
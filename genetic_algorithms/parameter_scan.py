@@ -0,0 +1,89 @@
+"""Scan of a single element of the decision parameters
+A coarse grid over the whole range is evaluated in parallel, then the minimum (or maximum) is refined by golden-section
+search within the grid cells around the best grid point. Every candidate is evaluated with the same seeds, so the
+differences between candidates are not blurred by different random environments.
+"""
+from itertools import starmap
+
+import numpy as np
+
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+
+
+def _with_value(params, index, value):
+    params = list(params)
+    params[index] = value
+    return params
+
+
+class ParameterScan:
+
+    def __init__(self, score_func, params, index, seeds=(0,), pool=None, maximize=False):
+        """
+        :param score_func: function(params, seed) returning the score to minimize, must be picklable for a pool
+        :param params: decision parameters, the scanned element is replaced
+        :param index: index of the scanned element in params
+        :param seeds: random seeds every candidate is evaluated with
+        :param pool: optional multiprocessing pool
+        :param maximize: search the maximum of the score instead (e.g. of a fitness)
+        """
+        self.score_func = score_func
+        self.params = params
+        self.index = index
+        self.seeds = list(seeds)
+        self.pool = pool
+        # the search minimizes sign * score
+        self.sign = -1 if maximize else 1
+        # value -> scores for the seeds
+        self.evaluated = {}
+
+    def evaluate(self, values):
+        """
+        Evaluate all seeds of all given values at once
+        :return: mean score of every value
+        """
+        new_values = [value for value in dict.fromkeys(values) if value not in self.evaluated]
+        args = [(_with_value(self.params, self.index, value), seed) for value in new_values for seed in self.seeds]
+        scores = self.pool.starmap(self.score_func, args, chunksize=1) if self.pool is not None \
+            else list(starmap(self.score_func, args))
+        for i, value in enumerate(new_values):
+            self.evaluated[value] = np.array(scores[i * len(self.seeds):(i + 1) * len(self.seeds)])
+        return [np.mean(self.evaluated[value]) for value in values]
+
+    def run(self, low, high, num_coarse=11, num_refine=8):
+        """
+        :param low: lower end of the scanned range
+        :param high: upper end of the scanned range
+        :param num_coarse: number of grid points over the range
+        :param num_refine: number of golden-section iterations, each evaluates one new value
+        :return: values, scores: all evaluated values in increasing order, scores of shape (seeds, values)
+        """
+        grid = np.linspace(low, high, num_coarse)
+        best = int(np.argmin(self.sign * np.array(self.evaluate(grid))))
+        a, b = grid[max(best - 1, 0)], grid[min(best + 1, num_coarse - 1)]
+
+        c = b - GOLDEN_RATIO * (b - a)
+        d = a + GOLDEN_RATIO * (b - a)
+        score_c, score_d = self.evaluate([c, d])
+        for _ in range(num_refine):
+            if self.sign * score_c < self.sign * score_d:
+                b, d, score_d = d, c, score_c
+                c = b - GOLDEN_RATIO * (b - a)
+                score_c, = self.evaluate([c])
+            else:
+                a, c, score_c = c, d, score_d
+                d = a + GOLDEN_RATIO * (b - a)
+                score_d, = self.evaluate([d])
+        return self.results()
+
+    def results(self):
+        values = np.array(sorted(self.evaluated))
+        return values, np.array([self.evaluated[value] for value in values]).T
+
+    def best(self):
+        """
+        :return: value, score: evaluated value with the lowest (or highest if maximizing) mean score
+        """
+        values, scores = self.results()
+        best = np.argmin(self.sign * scores.mean(axis=0))
+        return values[best], scores[:, best].mean()
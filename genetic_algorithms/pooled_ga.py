@@ -1,23 +1,99 @@
+import ctypes
+import multiprocessing as mp
+
 import pygad
 import numpy as np
 
+# state of a FitnessPool worker process, set once by _init_worker when the worker starts
+_worker_fitness_func = None
+_worker_population = None
+
+
+def _init_worker(fitness_func, genes, shape):
+    global _worker_fitness_func
+    global _worker_population
+    _worker_fitness_func = fitness_func
+    _worker_population = np.frombuffer(genes, dtype=np.float64).reshape(shape)
+
+
+def _fitness_task(solution_idx):
+    return _worker_fitness_func(_worker_population[solution_idx].copy(), solution_idx)
+
+
+class FitnessPool:
+    """Pool of long-lived workers computing the fitness of a population
+    The fitness function is sent to every worker once when it starts and the genes of the population are shared
+    through a shared memory array, so a task only transfers the index of a solution and its fitness back.
+    Simulation workspaces of the workers stay warm across generations.
+    """
+
+    def __init__(self, fitness_func, sol_per_pop, num_genes, processes=None):
+        self.genes = mp.RawArray(ctypes.c_double, sol_per_pop * num_genes)
+        self.population = np.frombuffer(self.genes, dtype=np.float64).reshape(sol_per_pop, num_genes)
+        self.pool = mp.Pool(processes=processes, initializer=_init_worker,
+                            initargs=(fitness_func, self.genes, self.population.shape))
+
+    def map_fitness(self, population):
+        self.population[:len(population)] = population
+        return self.pool.map(_fitness_task, range(len(population)))
+
+    def starmap(self, func, iterable, chunksize=None):
+        return self.pool.starmap(func, iterable, chunksize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.terminate()
+
 
 class PooledGA(pygad.GA):
     """Wrapper class for pygad.GA, enabling multiprocessing of fitness function computing
+    The pool is either a multiprocessing.Pool or a FitnessPool
     """
 
-    def __init__(self, pool, *args, **kwargs):
+    def __init__(self, pool, *args, batch_fitness_func=None, surrogate_screening=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.pool = pool
+        # optional function(population, pool) computing the fitness of the whole population at once
+        self.batch_fitness_func = batch_fitness_func
+        # number of solutions evaluated so far, to compare the cost with other optimizers
+        self.num_evaluations = 0
+        # optional SurrogateScreening, then only the promising and uncertain solutions are simulated
+        self.surrogate_screening = surrogate_screening
+        self.last_generation_simulated = None
 
     def fitness_wrapper(self, solution):
         return self.fitness_func(solution, 0)
 
-    def cal_pop_fitness(self):
-        pop_fitness = self.pool.map(self.fitness_wrapper, self.population)
+    def evaluate(self, population):
+        self.num_evaluations += len(population)
+        if self.batch_fitness_func is not None:
+            return np.array(self.batch_fitness_func(population, pool=self.pool))
+        if isinstance(self.pool, FitnessPool):
+            # only the genes are sent to the workers, through shared memory
+            return np.array(self.pool.map_fitness(population))
+        pop_fitness = self.pool.map(self.fitness_wrapper, population)
         pop_fitness = np.array(pop_fitness)
         return pop_fitness
 
+    def cal_pop_fitness(self):
+        if self.surrogate_screening is not None:
+            pop_fitness, self.last_generation_simulated = self.surrogate_screening.screen(self.population, self.evaluate)
+            return pop_fitness
+        self.last_generation_simulated = np.ones(len(self.population), dtype=bool)
+        return self.evaluate(self.population)
+
+    def best_solution(self, pop_fitness=None):
+        if self.surrogate_screening is None:
+            return super().best_solution(pop_fitness)
+        # a predicted fitness is never reported, the best solution is the best simulated one of the population
+        fitness = self.surrogate_screening.simulated_fitness(self.population)
+        if np.all(np.isnan(fitness)):
+            return super().best_solution(pop_fitness)
+        best_match_idx = int(np.nanargmax(fitness))
+        return self.population[best_match_idx, :].copy(), fitness[best_match_idx], best_match_idx
+
     # overriden to resolve the error of pickling pool object inside PooledGA instance
     def __getstate__(self):
         self_dict = self.__dict__.copy()
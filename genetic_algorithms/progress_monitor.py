@@ -0,0 +1,58 @@
+"""Outcome of a simulation and detection of stalled herds
+"""
+import numpy as np
+
+
+class Outcome:
+    SUCCESS = "success"
+    STALLED = "stalled"
+    TIMEOUT = "timeout"
+
+
+class ProgressMonitor:
+    """Detects hopeless simulations, in which the herd does not make any progress anymore.
+    The herd is considered stalled if neither the distance of its center of mass to the target nor its dispersion
+    (average distance of the sheep to the center of mass) improved within the last `window` steps.
+    """
+
+    def __init__(self, window=2000, min_progress=1.0, min_dispersion_progress=1.0, terminate=True):
+        """
+        :param window: number of steps without progress after which the herd is considered stalled
+        :param min_progress: decrease of the com to target distance [m] counted as progress
+        :param min_dispersion_progress: decrease of the herd dispersion [m] counted as progress
+        :param terminate: if False, the stall is only recorded and the simulation runs on (used for validation)
+        """
+        self.window = window
+        self.min_progress = min_progress
+        self.min_dispersion_progress = min_dispersion_progress
+        self.terminate = terminate
+
+        self.best_dist = np.inf
+        self.best_dist_step = 0
+        self.best_dispersion = np.inf
+        self.best_dispersion_step = 0
+        # step at which the stall was detected, None as long as the herd makes progress
+        self.stalled_at = None
+
+    @property
+    def stalled(self):
+        return self.stalled_at is not None
+
+    def update(self, step, target, sheep_com, sheep_poses):
+        """
+        Record the state of the herd after a simulation step
+        :return: True if the simulation shall be aborted
+        """
+        dist = np.linalg.norm(target - sheep_com)
+        if dist < self.best_dist - self.min_progress:
+            self.best_dist = dist
+            self.best_dist_step = step
+
+        dispersion = np.mean(np.linalg.norm(sheep_poses - sheep_com[None, :], axis=1))
+        if dispersion < self.best_dispersion - self.min_dispersion_progress:
+            self.best_dispersion = dispersion
+            self.best_dispersion_step = step
+
+        if self.stalled_at is None and step - max(self.best_dist_step, self.best_dispersion_step) >= self.window:
+            self.stalled_at = step
+        return self.terminate and self.stalled
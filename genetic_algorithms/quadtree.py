@@ -0,0 +1,243 @@
+"""Quadtree of the sheep near the dog, for the approximate local centers of mass (LCMs) of very large herds
+The exact LCM of a sheep is the mean of its n + 1 nearest sheep, found by a full sort of its row of the distance
+matrix, so a step costs O(k^2) time and memory for k sheep near the dog. LCMQuadtree answers the same query from
+cached cluster sums in O(1 / tolerance) per sheep, independent of k and n, and also finds the pairs of sheep within
+the repulsion distance without a distance matrix, which makes herds of N = 100,000 feasible. For small herds the
+exact step is faster, ShepherdSimulation only uses the tree from LCM_TREE_MIN_SHEEP sheep on.
+Run this module for the accuracy report against the exact computation, see scaling_study.py for the timings.
+"""
+import numpy as np
+
+
+class LCMQuadtree:
+    """Complete quadtree over the bounding square of the sheep with the number of sheep and the sum of their values
+    per cell, cached on every level as prefix sums along the rows of cells.
+    The disk of radius R around a sheep is covered row by row: a row contributes the cells between the two ends of
+    the disk on its center line, the cells at the ends only with the fraction of their width inside the disk
+    (boundary correction). Every disk is evaluated on the finest level whose cells are narrower than
+    tolerance * R (limited by the depth of the tree), so it takes at most about 2 / tolerance rows. R is found by
+    bisection such that the disk holds n + 1 sheep, the LCM is the sum of the values within the disk divided by n + 1.
+    """
+
+    def __init__(self, num_neighbors, tolerance=0.05, max_depth=10):
+        """
+        :param num_neighbors: number of nearest neighbors n, the LCM is the mean of the n + 1 nearest sheep
+        :param tolerance: width of the cells at the boundary of a disk relative to its radius
+        :param max_depth: maximum number of levels below the root, the finest level has 4^max_depth cells
+        """
+        self.num_neighbors = num_neighbors
+        self.tolerance = tolerance
+        self.max_depth = max_depth
+        self.keys = None
+
+    def build(self, keys, values=None):
+        """
+        :param keys: positions the tree is built on, array (k, 2)
+        :param values: positions whose means are returned for the neighborhoods of the keys, keys if None
+        """
+        self.keys = keys
+        self.values = keys if values is None else values
+        k = len(keys)
+        # about 16 cells per sheep on the finest level
+        self.depth = int(np.clip(np.ceil(np.log(max(k, 1)) / np.log(4)) + 2, 1, self.max_depth))
+        G = 1 << self.depth
+
+        self.origin = np.min(keys, axis=0)
+        self.size = max(float(np.max(np.max(keys, axis=0) - self.origin)), 1e-9) * (1 + 1e-9)
+        self.cells = np.minimum(((keys - self.origin) * (G / self.size)).astype(np.intp), G - 1)
+        # cell lists of pairs_within, by radius
+        self.cell_lists = {}
+
+        flat = self.cells[:, 1] * G + self.cells[:, 0]
+        grids = [np.bincount(flat, minlength=G * G).astype(float).reshape(G, G),
+                 np.bincount(flat, weights=self.values[:, 0], minlength=G * G).reshape(G, G),
+                 np.bincount(flat, weights=self.values[:, 1], minlength=G * G).reshape(G, G)]
+        # per level from the root: prefix sums over the rows of the counts, x and y sums, flattened (G, G + 1)
+        self.prefix = [None] * (self.depth + 1)
+        for level in range(self.depth, -1, -1):
+            G = 1 << level
+            prefix = []
+            for grid in grids:
+                rows = np.zeros((G, G + 1))
+                np.cumsum(grid, axis=1, out=rows[:, 1:])
+                prefix.append(rows.ravel())
+            self.prefix[level] = prefix
+            if level > 0:
+                grids = [grid.reshape(G // 2, 2, G // 2, 2).sum(axis=(1, 3)) for grid in grids]
+
+    def __disk(self, indices, radius, with_sums):
+        """
+        Approximate number of keys within the disks of the given radius around the keys of indices, and the sums of
+        their values if with_sums
+        """
+        counts = np.zeros(len(indices))
+        sums = np.zeros((len(indices), 2)) if with_sums else None
+        with np.errstate(divide='ignore'):
+            levels = np.clip(np.ceil(np.log2(self.size / (self.tolerance * radius))), 0, self.depth).astype(np.intp)
+        for level in np.unique(levels):
+            selected = np.flatnonzero(levels == level)
+            G = 1 << level
+            s = self.size / G
+            # in units of cells
+            centers = (self.keys[indices[selected]] - self.origin) / s
+            r = radius[selected] / s
+
+            first = np.maximum(np.floor(centers[:, 1] - r).astype(np.intp), 0)
+            last = np.minimum(np.floor(centers[:, 1] + r).astype(np.intp), G - 1)
+            rows = first[:, None] + np.arange(max(int(np.max(last - first)) + 1, 1))
+            valid = rows <= last[:, None]
+            rows = np.minimum(rows, G - 1)
+            half = np.sqrt(np.maximum(r[:, None] ** 2 - (rows + 0.5 - centers[:, 1:2]) ** 2, 0))
+            half[~valid] = 0
+
+            # cumulative sums along the rows up to both ends, linear within the end cells
+            ends = []
+            for x in (np.clip(centers[:, 0:1] - half, 0, G), np.clip(centers[:, 0:1] + half, 0, G)):
+                cell = np.minimum(x.astype(np.intp), G - 1)
+                ends.append((rows * (G + 1) + cell, x - cell))
+            grids = self.prefix[level] if with_sums else self.prefix[level][:1]
+            totals = []
+            for prefix in grids:
+                total = 0
+                for sign, (base, fraction) in zip((-1, 1), ends):
+                    low = np.take(prefix, base)
+                    total = total + sign * (low + fraction * (np.take(prefix, base + 1) - low))
+                # sequential sum over the rows, so the padding rows of shorter disks do not change the result
+                totals.append(np.cumsum(total, axis=1)[:, -1])
+            counts[selected] = totals[0]
+            if with_sums:
+                sums[selected, 0] = totals[1]
+                sums[selected, 1] = totals[2]
+        return counts, sums
+
+    def lcms(self, out=None, indices=None):
+        """
+        The result of a key does not depend on the other keys queried with it, so the keys can be split into shards
+        :param out: optional array (len(indices), 2) for the result
+        :param indices: keys to compute the LCMs for, all keys if None
+        :return: approximate means of the values of the n + 1 nearest keys of every key
+        """
+        k = len(self.keys)
+        indices = np.arange(k) if indices is None else np.asarray(indices)
+        q = len(indices)
+        if out is None:
+            out = np.empty((q, 2))
+        num_selected = min(self.num_neighbors + 1, k)
+        if num_selected >= k:
+            out[:] = np.mean(self.values, axis=0)
+            return out
+
+        # bracket [low, high] of the radius holding num_selected keys, low = 0 until a radius below was found
+        low = np.zeros(q)
+        high = np.full(q, np.sqrt(2) * self.size)
+        active = np.arange(q)
+        for _ in range(64):
+            mid = np.where(low[active] > 0, np.sqrt(low[active] * high[active]), high[active] / 4)
+            counts, _ = self.__disk(indices[active], mid, with_sums=False)
+            below = counts < num_selected
+            low[active[below]] = mid[below]
+            high[active[~below]] = mid[~below]
+            active = active[(low[active] == 0) | (high[active] > low[active] * (1 + self.tolerance))]
+            if len(active) == 0:
+                break
+
+        # interpolate the sums between both ends of the bracket to exactly num_selected keys
+        count_high, sum_high = self.__disk(indices, high, with_sums=True)
+        count_low, sum_low = self.__disk(indices, np.maximum(low, 1e-300), with_sums=True)
+        count_low[low == 0] = 0
+        sum_low[low == 0] = 0
+        gap = count_high - count_low
+        weight = np.divide(num_selected - count_low, gap, out=np.ones(q), where=gap > 0)
+        np.divide(sum_low + weight[:, None] * (sum_high - sum_low), num_selected, out=out)
+        return out
+
+    def pair_cells(self, radius):
+        """
+        Cell list of the keys on the finest level with cells at least radius wide, computed once per radius
+        :return: level, cells of the keys on that level, keys sorted by cell, start of every cell in that order
+        """
+        if radius in self.cell_lists:
+            return self.cell_lists[radius]
+        level = int(np.clip(np.floor(np.log2(self.size / radius)), 0, self.depth))
+        G = 1 << level
+        cells = self.cells >> (self.depth - level)
+        flat = cells[:, 1] * G + cells[:, 0]
+        order = np.argsort(flat, kind='stable')
+        starts = np.searchsorted(flat[order], np.arange(G * G + 1))
+        self.cell_lists[radius] = level, cells, order, starts
+        return self.cell_lists[radius]
+
+    def pairs_within(self, radius, indices=None, chunk_size=8192):
+        """
+        Pairs of keys closer than radius (keys at the same position excluded), found in the cells of the finest
+        level at least radius wide and their 8 neighbors. The pairs of a key, and their order, do not depend on the
+        other keys queried with it.
+        :param indices: keys to find the pairs for, all keys if None
+        :return: generator of arrays (p, j) for consecutive chunks of the queried keys, p the position of a key
+                 within indices, j the index of the other key of the pair
+        """
+        level, cells, order, starts = self.pair_cells(radius)
+        G = 1 << level
+        indices = np.arange(len(self.keys)) if indices is None else np.asarray(indices)
+
+        for start in range(0, len(indices), chunk_size):
+            positions = np.arange(start, min(start + chunk_size, len(indices)))
+            i = indices[positions]
+            firsts, counts = [], []
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    x, y = cells[i, 0] + dx, cells[i, 1] + dy
+                    inside = (x >= 0) & (x < G) & (y >= 0) & (y < G)
+                    neighbor = np.where(inside, y * G + x, 0)
+                    firsts.append(starts[neighbor])
+                    counts.append(np.where(inside, starts[neighbor + 1] - starts[neighbor], 0))
+            firsts = np.stack(firsts, axis=1).ravel()
+            counts = np.stack(counts, axis=1).ravel()
+            offsets = np.cumsum(counts) - counts
+            pair_p = np.repeat(np.repeat(positions, 9), counts)
+            pair_j = order[np.repeat(firsts - offsets, counts) + np.arange(len(pair_p))]
+
+            d = self.keys[indices[pair_p]] - self.keys[pair_j]
+            sq_dist = d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1]
+            keep = (sq_dist < radius * radius) & (sq_dist != 0)
+            yield pair_p[keep], pair_j[keep]
+
+
+def exact_lcms(keys, values, num_neighbors):
+    """Means of the values of the n + 1 nearest keys, as computed by the exact simulation step"""
+    distances = np.linalg.norm(keys[:, None, :] - keys[None, :, :], axis=2)
+    neighbors = np.argsort(distances, axis=1)[:, 0:num_neighbors + 1]
+    return np.mean(values[neighbors], axis=1)
+
+
+def accuracy_report(num_sheep=(100, 500, 2000), neighbor_fractions=(0.1, 0.5, 0.9), tolerances=(0.1, 0.05, 0.02),
+                    seed=0):
+    """
+    Compare the approximate LCMs with the exact ones on random herds (uniform on the initial area of the simulation)
+    Errors are given as the distance between the LCMs relative to the distance of the exact LCM from the sheep, and
+    as the angle between the resulting attraction directions, which is what enters the step.
+    """
+    random_state = np.random.RandomState(seed)
+    print('     N      n  tolerance  rel. error (mean / max)  angle deg (mean / max)')
+    for N in num_sheep:
+        poses = random_state.uniform(75, 150, size=(N, 2))
+        for fraction in neighbor_fractions:
+            n = max(int(fraction * N), 1)
+            exact = exact_lcms(poses, poses, n)
+            for tolerance in tolerances:
+                tree = LCMQuadtree(n, tolerance)
+                tree.build(poses)
+                approx = tree.lcms()
+                attraction_exact = exact - poses
+                attraction_approx = approx - poses
+                scale = np.linalg.norm(attraction_exact, axis=1)
+                error = np.linalg.norm(approx - exact, axis=1) / scale
+                cos = np.sum(attraction_exact * attraction_approx, axis=1) / \
+                    (scale * np.linalg.norm(attraction_approx, axis=1))
+                angle = np.degrees(np.arccos(np.clip(cos, -1, 1)))
+                print(f'{N:6d} {n:6d} {tolerance:10.2f}  {np.mean(error):10.4f} / {np.max(error):8.4f}'
+                      f'  {np.mean(angle):10.3f} / {np.max(angle):8.3f}')
+
+
+if __name__ == '__main__':
+    accuracy_report()
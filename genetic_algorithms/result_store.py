@@ -0,0 +1,219 @@
+"""Compact store of the results of an (N, n) sweep
+Only the valid cells 1 <= n < N <= max_N are kept, one 1-D array per field in the order of cell_index, together with
+the metadata of the sweep (decision type and parameters, sweep seed, number of time steps, ...) in a single
+uncompressed .npz file. The members of such a file are stored as plain .npy data, so open_store memory-maps them and a
+query only reads the pages of the cells it touches.
+The seeds of the simulations are not stored per cell: repetition r of cell (N, n) ran on
+get_sweep_random_state(metadata['sweep_seed'], N, n, r) for r < runs.
+A save rewrites the whole file, so a running sweep saves its store with checkpoint after every cell, which only writes
+every CHECKPOINT_INTERVAL seconds, and once more at the end.
+"""
+import json
+import struct
+import time
+import zipfile
+
+import numpy as np
+
+# fields of a cell and their dtypes, cells which were not evaluated have runs == 0 and nan statistics,
+# runs == -1 marks cells of legacy results with an unknown number of simulations
+FIELDS = {
+    'success_rate': np.float64,
+    'runs': np.int32,
+    'mean_steps': np.float64,  # of the successful runs
+    'p50_steps': np.float64,
+    'p90_steps': np.float64,
+    'estimated': np.bool_,  # interpolated by the adaptive sweep instead of simulated
+}
+METADATA_MEMBER = 'metadata'
+# minimum number of seconds between two saves of ResultStore.checkpoint
+CHECKPOINT_INTERVAL = 300.
+
+
+def num_cells(max_N):
+    return max_N * (max_N - 1) // 2
+
+
+def cell_index(N, n):
+    """
+    Position of the cell (N, n) with 1 <= n < N in the field arrays, the cells are ordered by N, then n.
+    Works element-wise on arrays.
+    """
+    return (N - 1) * (N - 2) // 2 + n - 1
+
+
+def cell_pairs(max_N):
+    """
+    :return: N, n: arrays of all valid cells up to max_N, in the order of cell_index
+    """
+    N, n = np.tril_indices(max_N + 1, k=-1)
+    valid = n >= 1
+    return N[valid], n[valid]
+
+
+def _default_fill(dtype):
+    return np.nan if np.issubdtype(dtype, np.floating) else 0
+
+
+class ResultStore:
+    def __init__(self, max_N, metadata=None, fields=None):
+        """
+        :param max_N: largest total number of sheep of the sweep
+        :param metadata: dict of JSON serializable values describing the sweep
+        :param fields: dict name -> array of num_cells(max_N) values, missing fields are filled as not evaluated
+        """
+        self.max_N = max_N
+        self.metadata = dict(metadata) if metadata is not None else {}
+        self.fields = dict(fields) if fields is not None else {}
+        for name, dtype in FIELDS.items():
+            if name not in self.fields:
+                self.fields[name] = np.full(num_cells(max_N), _default_fill(dtype), dtype=dtype)
+        self.N, self.n = cell_pairs(max_N)
+        # time.monotonic() of the last save
+        self.saved_at = None
+
+    def set_cell(self, N, n, **values):
+        index = cell_index(N, n)
+        for name, value in values.items():
+            self.fields[name][index] = value
+
+    def evaluated(self):
+        """
+        :return: mask of the cells which were simulated or estimated
+        """
+        return (self.fields['runs'] != 0) | self.fields['estimated']
+
+    def query(self, N_range=None, n_range=None, fields=('success_rate',), evaluated_only=True):
+        """
+        Cells of a rectangular range of the sweep.
+        :param N_range: (first, last) total number of sheep, both inclusive, None for all
+        :param n_range: (first, last) number of neighbors, both inclusive, None for all
+        :param fields: names of the fields to return
+        :param evaluated_only: skip the cells which were neither simulated nor estimated
+        :return: dict with the arrays 'N', 'n' and one per field, in the order of cell_index
+        """
+        N_first, N_last = N_range if N_range is not None else (2, self.max_N)
+        N_first, N_last = max(N_first, 2), min(N_last, self.max_N)
+        # the cells of a range of N are contiguous, so only this slice of the fields is read
+        start = cell_index(N_first, 1)
+        stop = max(cell_index(N_last + 1, 1), start)
+        mask = np.ones(stop - start, dtype=bool)
+        if n_range is not None:
+            mask &= (self.n[start:stop] >= n_range[0]) & (self.n[start:stop] <= n_range[1])
+        if evaluated_only:
+            mask &= (self.fields['runs'][start:stop] != 0) | self.fields['estimated'][start:stop]
+        index = start + np.flatnonzero(mask)
+        cells = {'N': self.N[index], 'n': self.n[index]}
+        for name in fields:
+            cells[name] = self.fields[name][index]
+        return cells
+
+    def matrix(self, field='success_rate', fill=np.nan):
+        """
+        Dense matrix of a field indexed [N, n] like the legacy result files, cells which were not evaluated and
+        the invalid cells (n >= N) hold fill.
+        """
+        dtype = np.result_type(self.fields[field].dtype, np.min_scalar_type(fill))
+        out = np.full((self.max_N + 1, self.max_N + 1), fill, dtype=dtype)
+        evaluated = self.evaluated()
+        out[self.N[evaluated], self.n[evaluated]] = self.fields[field][evaluated]
+        return out
+
+    def save(self, path):
+        """
+        Write the store as an uncompressed .npz file, which open_store can memory-map. Fields which hold only their
+        default value (e.g. the step statistics of converted legacy results) are left out.
+        """
+        metadata = json.dumps(dict(self.metadata, max_N=self.max_N))
+        fields = {name: values for name, values in self.fields.items()
+                  if not np.array_equal(values, np.full_like(values, _default_fill(values.dtype)), equal_nan=True)}
+        np.savez(path, **{METADATA_MEMBER: np.array(metadata)}, **fields)
+        self.saved_at = time.monotonic()
+
+    def checkpoint(self, path, interval=CHECKPOINT_INTERVAL):
+        """
+        Save the store unless the last save is less than interval seconds ago
+        """
+        if self.saved_at is None or time.monotonic() - self.saved_at >= interval:
+            self.save(path)
+
+
+def _memmap_member(path, info):
+    """
+    Memory-map a member of an uncompressed .npz file.
+    :param info: zipfile.ZipInfo of the member
+    """
+    with open(path, 'rb') as f:
+        # the local file header has a fixed part of 30 bytes, followed by the file name and the extra field
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack('<HH', f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if not shape or 0 in shape:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+def open_store(path):
+    """
+    Open a store written by ResultStore.save, its fields are read-only memory maps of the file.
+    """
+    fields = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if name == METADATA_MEMBER:
+                with archive.open(info) as f:
+                    metadata = json.loads(str(np.lib.format.read_array(f)))
+            elif info.compress_type != zipfile.ZIP_STORED:
+                raise Exception(f"Field {name} of {path} is compressed and can not be memory-mapped")
+            else:
+                fields[name] = _memmap_member(path, info)
+    max_N = metadata.pop('max_N')
+    return ResultStore(max_N, metadata, fields)
+
+
+def open_results(path, name=None):
+    """
+    Open a store written by ResultStore.save (.npz) or convert a legacy result matrix (.npy), memory-mapped
+    """
+    if path.endswith('.npy'):
+        # success rates are never negative, -1 is the placeholder of the cells which were not evaluated
+        return store_from_matrix(np.load(path, mmap_mode='r'), {'name': name, 'source': path}, placeholder=-1.)
+    return open_store(path)
+
+
+def store_from_matrix(results, metadata=None, placeholder=None, runs=None):
+    """
+    Convert a legacy dense result matrix indexed [N, n] to a store.
+    :param placeholder: value of the cells which were not evaluated, None if every valid cell was evaluated
+    :param runs: number of simulations per evaluated cell, if known
+    """
+    max_N = results.shape[0] - 1
+    store = ResultStore(max_N, metadata)
+    N, n = cell_pairs(max_N)
+    values = results[N, n]
+    evaluated = values != placeholder if placeholder is not None else np.ones(len(values), dtype=bool)
+    store.fields['success_rate'][evaluated] = values[evaluated]
+    store.fields['runs'][evaluated] = runs if runs is not None else -1
+    return store
+
+
+if __name__ == '__main__':
+    # convert the result matrices of the paper
+    legacy_results = [
+        ('evaluation.original_strombom', 'Original Strombom', None),
+        ('evaluation.ga_strombom', 'GA Strombom', None),
+        ('evaluation.sigmoid.transition_only', 'GA Sigmoid', -1.),
+        ('evaluation.sigmoid.original_strombom', 'GA Sigmoid + Original Strombom', None),
+    ]
+    for fname, name, placeholder in legacy_results:
+        store = store_from_matrix(np.load(f'results/{fname}.npy'), {'name': name, 'source': f'{fname}.npy'},
+                                  placeholder=placeholder)
+        store.save(f'results/{fname}.npz')
+        print(f"results/{fname}.npz: {int(np.sum(store.evaluated()))} cells")
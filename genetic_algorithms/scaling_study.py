@@ -0,0 +1,40 @@
+"""Timings of the quadtree step (ShepherdSimulation(lcm_tolerance=...)) for huge herds and strong scaling of the
+sharded step (ShepherdSimulation(num_threads=...)) over 1 to 32 threads
+"""
+import os
+from timeit import default_timer as timer
+
+import numpy as np
+
+from shepherd_simulation import ShepherdSimulation
+
+LARGE_HERDS = (10000, 100000)
+SCALING_N = 20000
+SCALING_THREADS = (1, 2, 4, 8, 16, 32)
+
+
+def time_steps(num_sheep_total, num_sheep_neighbors, num_threads=None, num_steps=3):
+    """
+    Seconds per step of a herd with every sheep near the dog, not possible with the O(k^2) exact step for huge herds
+    """
+    sim = ShepherdSimulation(num_sheep_total=num_sheep_total, num_sheep_neighbors=num_sheep_neighbors,
+                             lcm_tolerance=0.05, random_state=np.random.RandomState(0), num_threads=num_threads)
+    sim.dog_pose = sim.sheep_com.copy()
+    start = timer()
+    for _ in range(num_steps):
+        sim.update_environment()
+    return (timer() - start) / num_steps
+
+
+if __name__ == '__main__':
+    for N in LARGE_HERDS:
+        print(f'N={N}, n={N // 2}: {time_steps(N, N // 2):.2f}s per step')
+
+    # strong scaling of the sharded step, the same herd for every number of threads
+    N = SCALING_N
+    print(f'Strong scaling, N={N}, n={N // 2}, {os.cpu_count()} cores')
+    serial = time_steps(N, N // 2, num_threads=1)
+    for num_threads in SCALING_THREADS:
+        seconds = serial if num_threads == 1 else time_steps(N, N // 2, num_threads=num_threads)
+        print(f'{num_threads:3d} threads: {seconds:.2f}s per step, speedup {serial / seconds:.2f}, '
+              f'efficiency {serial / seconds / num_threads:.2f}')
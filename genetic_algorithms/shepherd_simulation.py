@@ -8,11 +8,35 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from quadtree import LCMQuadtree
+from herd import GrazingScheduler, HerdStatistics
+from neighbor_list import VerletNeighborList
+from progress_monitor import Outcome
 from utils import get_degree_between_3_points
+from workspace import StepWorkspace, normalize_rows
 
 # suppress runtime warnings
 warnings.filterwarnings("ignore")
 
+# smallest herd for which lcm_tolerance takes the quadtree step, smaller herds take the exact step, which is faster
+# for them: with most sheep near the dog a step takes 2 ms exact against 10 ms with the tree for N = 140, 7 against
+# 11 ms for N = 300 and 25 against 15 ms for N = 600
+LCM_TREE_MIN_SHEEP = 500
+# smallest number of sheep near the dog for which num_threads splits the quadtree step into shards, smaller steps are
+# computed in the calling thread: on one core the sharded step took 8% longer than the serial one for 600 sheep, 3%
+# for 2000 and 13% less for 20000 (the smaller shards stay in the cache), more cores only pay off for large steps
+SHARDED_STEP_MIN_SHEEP = 2000
+
+# thread pools of the sharded step by number of threads, shared by all simulations of the process
+_thread_pools = {}
+
+
+def _get_thread_pool(num_threads):
+    if num_threads not in _thread_pools:
+        _thread_pools[num_threads] = ThreadPoolExecutor(num_threads)
+    return _thread_pools[num_threads]
+
 
 # class implementation of shepherding
 
@@ -21,9 +45,18 @@ class Decision_type:
     DEFAULT_STROMBOM = "default_strombom"
 
 
+class State_layout:
+    # (N, 2) float64 arrays of the positions and directions, the reference layout
+    ARRAY_OF_STRUCTS_64 = "aos64"
+    # separate contiguous x and y arrays, (N, 2) views of a (2, N) array, the same trajectories as the reference
+    STRUCT_OF_ARRAYS_64 = "soa64"
+    # separate contiguous x and y arrays in single precision, also for the buffers of the step
+    STRUCT_OF_ARRAYS_32 = "soa32"
+
+
 class ShepherdSimulation:
 
-    def __init__(self, num_sheep_total=30, num_sheep_neighbors=15, decision_type=Decision_type.DEFAULT_STROMBOM, max_steps=1000, random_seed = 0, random_state = None):
+    def __init__(self, num_sheep_total=30, num_sheep_neighbors=15, decision_type=Decision_type.DEFAULT_STROMBOM, max_steps=1000, random_seed = 0, random_state = None, event_driven_grazing=False, workspace=None, verlet_skin=None, lcm_tolerance=None, num_threads=None, fast_forward=False, state_layout=State_layout.ARRAY_OF_STRUCTS_64):
 
         # initialize random state
         # take random_state if not None, else set random state according to random seed
@@ -63,13 +96,24 @@ class ShepherdSimulation:
         # initialize target position
         self.target = np.array([3, 3])
 
+        # storage of the positions and directions of the sheep, see State_layout
+        if state_layout not in (State_layout.ARRAY_OF_STRUCTS_64, State_layout.STRUCT_OF_ARRAYS_64,
+                                State_layout.STRUCT_OF_ARRAYS_32):
+            raise Exception("invalid state layout")
+        self.state_layout = state_layout
+        self.dtype = np.float32 if state_layout == State_layout.STRUCT_OF_ARRAYS_32 else np.float64
+
         # initialize sheep positions
         field_center = np.array(
             [self.field_length // 2, self.field_length // 2])
         init_sheep_pose = self.random_state.uniform(
             0, self.field_length // 2, size=(self.num_sheep_total, 2)) + field_center
-        self.sheep_poses = init_sheep_pose
-        self.sheep_com = self.sheep_poses.mean(axis=0)
+        # the live positions are a copy, the initial ones are kept unchanged
+        self.init_sheep_pose = init_sheep_pose
+        self.sheep_poses = self.__new_state(init_sheep_pose)
+        # com, distances to the com and farthest sheep, shared by all consumers within a step
+        self.herd_stats = HerdStatistics(self.sheep_poses)
+        self.sheep_com = self.herd_stats.com
 
         # initialize dog position
         init_dog_pose = np.array([0, 0])
@@ -79,7 +123,7 @@ class ShepherdSimulation:
         self.dog_speed = 1.5
 
         # initialize inertia
-        self.inertia = np.ones((self.num_sheep_total, 2))
+        self.inertia = self.__new_state(np.ones((self.num_sheep_total, 2)))
 
         # initialize maximum number of steps
         self.max_steps = max_steps
@@ -97,6 +141,73 @@ class ShepherdSimulation:
         self.thresh_variance = 0
         self.thresh_angle = 0
 
+        # outcome of the last run, one of progress_monitor.Outcome
+        self.outcome = None
+
+        # sample the moves of grazing sheep event driven, touching only the sheep which actually move in a step
+        self.grazing_scheduler = None
+        if event_driven_grazing:
+            self.grazing_scheduler = GrazingScheduler(self.num_sheep_total, self.grazing_prob, self.random_state)
+        # sheep which made a grazing move in the last step
+        self.grazing_sheep = np.empty(0, dtype=np.intp)
+
+        # buffers reused by every step, sized for the whole herd up front so that no step has to allocate them
+        # a workspace can be shared by consecutive simulations (e.g. within a pool worker) to keep the buffers warm
+        self.workspace = workspace if workspace is not None else StepWorkspace()
+        N = self.num_sheep_total
+        for name in ('near_poses', 'near_poses_copy', 'near_inertia', 'squares', 'repulsion_sheep', 'repulsion_dog',
+                     'sheep_lcms', 'term', 'normalize_squares'):
+            self.workspace.get(name, (N, 2), self.dtype)
+        for name in ('sq_norms', 'normalize_norms'):
+            self.workspace.get(name, (N,), self.dtype)
+        self.workspace.get('normalize_nans', (N, 2), dtype=bool)
+
+        # approximate LCMs and sparse repulsion from a quadtree of the sheep near the dog, without any (N, N) arrays
+        # (None or 0 computes the exact step from the full distance matrix, so do herds below LCM_TREE_MIN_SHEEP)
+        self.lcm_tree = None
+        if lcm_tolerance and num_sheep_total >= LCM_TREE_MIN_SHEEP:
+            self.lcm_tree = LCMQuadtree(self.num_sheep_neighbors, lcm_tolerance)
+        elif verlet_skin is None:
+            for name in ('distances', 'transit_norms', 'transit_sq'):
+                self.workspace.get(name, (N, N), self.dtype)
+            for name in ('interact', 'not_interact'):
+                self.workspace.get(name, (N, N), dtype=bool)
+            self.workspace.get('pairs', (N, N, 2), self.dtype)
+
+        # split the approximate step into spatial shards computed by a pool of threads (None computes it in the
+        # calling thread, as are steps with less than SHARDED_STEP_MIN_SHEEP sheep near the dog), the result is the
+        # same for any number of threads
+        self.num_threads = num_threads
+        self.thread_pool = None
+        if num_threads is not None and not lcm_tolerance:
+            raise Exception("the sharded step needs lcm_tolerance")
+        if num_threads is not None and self.lcm_tree is not None:
+            self.thread_pool = _get_thread_pool(num_threads)
+            self.shard_workspaces = [StepWorkspace() for _ in range(num_threads)]
+
+        # jump over the steps in which all sheep are far from the dog, see fast_forward_far_phase
+        self.fast_forward = fast_forward
+        # number of steps skipped by jumps in the last run
+        self.skipped_steps = 0
+
+        # cached candidates of the nearest neighbors, rebuilt only after the sheep moved by a fraction of the skin
+        # (None searches the neighbors among all sheep near the dog in every step), the results are the same as long
+        # as BLAS rounds the distance matrix like pair_distances in neighbor_list.py. It only pays off if the
+        # candidates are a small part of the sheep near the dog: for the herds of the GA sweeps (N < 140) the skin
+        # covers the whole herd and the dense step is faster
+        self.neighbor_list = None
+        if verlet_skin is not None:
+            # the interacting pairs are searched among the candidates too
+            if verlet_skin < 2 * self.sheep_repulsion_dist:
+                raise Exception("verlet_skin must be at least twice the sheep repulsion distance")
+            self.neighbor_list = VerletNeighborList(self.num_sheep_neighbors, verlet_skin)
+
+    def __new_state(self, values):
+        # (N, 2) array of the state layout holding a copy of values
+        if self.state_layout == State_layout.ARRAY_OF_STRUCTS_64:
+            return np.array(values, dtype=self.dtype)
+        return np.array(values.T, dtype=self.dtype, order='C').T
+
     def success_criteria(self):
         """
         Function to determine the success of the simulation (to be modified)
@@ -105,7 +216,8 @@ class ShepherdSimulation:
         return np.linalg.norm(self.target - self.sheep_com) < 1.0
 
     # main function to perform simulation
-    def run(self, render=False, verbose=False):
+    # progress_monitor: optional progress_monitor.ProgressMonitor, aborting the run once the herd is stalled
+    def run(self, render=False, verbose=False, progress_monitor=None):
 
         # start the simulation
         if verbose:
@@ -113,6 +225,7 @@ class ShepherdSimulation:
 
         # initialize counter for plotting
         counter = 0
+        self.skipped_steps = 0
 
         # initialize matplotlib figure
         if render:
@@ -122,6 +235,17 @@ class ShepherdSimulation:
 
         # main loop for simulation
         while not self.success_criteria() and counter < self.max_steps:
+            # jump over the steps without any sheep near the dog, they count like single steps
+            if self.fast_forward:
+                skipped = self.fast_forward_far_phase(self.max_steps - counter)
+                if skipped > 0:
+                    counter += skipped
+                    self.skipped_steps += skipped
+                    if progress_monitor is not None and progress_monitor.update(counter, self.target, self.sheep_com,
+                                                                                self.sheep_poses):
+                        break
+                    continue
+
             # update counter variable
             counter += 1
 
@@ -151,12 +275,28 @@ class ShepherdSimulation:
                 plt.draw()
                 plt.pause(0.01)
 
+            # abort the simulation if the herd does not make any progress anymore
+            if progress_monitor is not None and progress_monitor.update(counter, self.target, self.sheep_com,
+                                                                        self.sheep_poses):
+                break
+
         success = False
         if self.success_criteria():
             success = True
+            self.outcome = Outcome.SUCCESS
+        elif counter < self.max_steps:
+            self.outcome = Outcome.STALLED
+        else:
+            self.outcome = Outcome.TIMEOUT
 
         # complete execution
         if verbose:
+            if self.fast_forward:
+                print(f'Fast-forwarded {self.skipped_steps} of {counter} steps')
+            if self.neighbor_list is not None:
+                print(f'Neighbor list rebuilds: {self.neighbor_list.rebuilds}/{self.neighbor_list.steps} steps, '
+                      f'rows sorted in full: {self.neighbor_list.fallback_rows}, '
+                      f'neighbor search per step: {round(1e6 * self.neighbor_list.amortized_cost, 1)}us')
             print('Finish simulation')
         return counter, success, self.sheep_poses
 
@@ -170,11 +310,15 @@ class ShepherdSimulation:
         self.__compute_inertia_for_sheep_near_from_dog(inds_sheep_near_dog)
 
         inds_sheep_far_dog = np.logical_not(inds_sheep_near_dog)
-        self.__compute_inertia_for_sheep_far_from_dog(inds_sheep_far_dog)
+        if self.grazing_scheduler is None:
+            self.__compute_inertia_for_sheep_far_from_dog(inds_sheep_far_dog)
+        else:
+            self.__compute_inertia_for_grazing_sheep(inds_sheep_far_dog)
 
         # find new sheep position
         self.sheep_poses += self.delta_sheep_pose * self.inertia
-        self.sheep_com = np.mean(self.sheep_poses, axis=0)
+        self.herd_stats.update()
+        self.sheep_com = self.herd_stats.com
 
     def __compute_inertia_for_sheep_far_from_dog(self, indices):
         inertia_sheep_far_dog = self.inertia[indices, :]
@@ -191,70 +335,263 @@ class ShepherdSimulation:
         # update general inertia
         self.inertia[indices, :] = inertia_sheep_far_dog
 
+    def __compute_inertia_for_grazing_sheep(self, indices):
+        # event driven version of __compute_inertia_for_sheep_far_from_dog, far sheep only move if their move is due
+        newly_far, moving = self.grazing_scheduler.update(indices)
+
+        # sheep which just left the dog or moved in the last step stand still again
+        self.inertia[newly_far, :] = 0
+        stopping = self.grazing_sheep[indices[self.grazing_sheep]]
+        self.inertia[stopping, :] = 0
+
+        # compute random movements while grazing
+        self.inertia[moving, :] = np.linalg.norm(self.random_state.randn(len(moving), 2), axis=1, keepdims=True)
+        self.grazing_sheep = moving
+
     def __compute_inertia_for_sheep_near_from_dog(self, indices):
-        inertia_sheep_near_dog = self.inertia[indices, :]
-        num_near_sheep = len(inertia_sheep_near_dog)
+        ws = self.workspace
+        num_near_sheep = np.count_nonzero(indices)
+        k = num_near_sheep
+
+        dtype = self.dtype
+        if self.state_layout == State_layout.ARRAY_OF_STRUCTS_64:
+            near_sheep_poses = np.compress(indices, self.sheep_poses, axis=0, out=ws.get('near_poses', (k, 2)))
+        else:
+            # gathered into separate contiguous x and y rows as well
+            near_sheep_poses = np.compress(indices, self.sheep_poses.T, axis=1,
+                                           out=ws.get('near_poses', (2, k), dtype)).T
+        inertia_sheep_near_dog = np.compress(indices, self.inertia, axis=0,
+                                             out=ws.get('near_inertia', (k, 2), dtype))
+        # the pairwise terms below are taken from the first k rows of sheep_poses
+        poses = self.sheep_poses[:k]
+
+        if self.lcm_tree is not None:
+            repulsion_sheep = ws.get('repulsion_sheep', (k, 2), dtype)
+            sheep_lcms = ws.get('sheep_lcms', (k, 2), dtype)
+            if k >= SHARDED_STEP_MIN_SHEEP and self.thread_pool is not None:
+                self.lcm_tree.build(near_sheep_poses, poses)
+                self.__sharded_step(poses, near_sheep_poses, inertia_sheep_near_dog, repulsion_sheep, sheep_lcms)
+                self.inertia[indices, :] = inertia_sheep_near_dog
+                return
+            if k > 0:
+                self.lcm_tree.build(near_sheep_poses, poses)
+                self.__compute_tree_repulsion(poses, repulsion_sheep)
+                normalize_rows(repulsion_sheep, ws)
+                self.lcm_tree.lcms(out=sheep_lcms)
+            self.__update_inertia_for_sheep_near_from_dog(indices, near_sheep_poses, inertia_sheep_near_dog,
+                                                          repulsion_sheep, sheep_lcms)
+            return
 
         # compute a distance matrix
-        distance_matrix = np.sqrt(-2 * np.dot(self.sheep_poses[indices, :], self.sheep_poses[indices, :].T)
-                                  + np.sum(self.sheep_poses[indices, :] ** 2, axis=1) + np.sum(
-            self.sheep_poses[indices, :] ** 2, axis=1)[:,
-                                                                                        np.newaxis])
+        # the expanded form is kept in every layout: its rounding leaves the distance of about one in ten sheep to
+        # itself positive (it then counts as interacting with itself, which cancels its repulsion from the other
+        # sheep) and of another one in ten NaN (it is then left out of its own LCM), the success rates depend on it
+        sq_norms = ws.get('sq_norms', (k,), dtype)
+        squares = ws.get('squares', (k, 2), dtype)
+        np.multiply(near_sheep_poses, near_sheep_poses, out=squares)
+        np.sum(squares, axis=1, out=sq_norms)
+        if self.neighbor_list is not None:
+            # distances of the candidate pairs only, rounded like the distance matrix below
+            near_indices = np.flatnonzero(indices)
+            self.neighbor_list.update(self.sheep_poses)
+            candidates, distances = self.neighbor_list.pairs(near_sheep_poses, sq_norms, near_indices)
+            interact = (distances < self.sheep_repulsion_dist) & (distances != 0)
+            repulsion_sheep = self.__compute_sparse_repulsion(poses, np.nonzero(interact)[0], candidates[interact],
+                                                              ws.get('repulsion_sheep', (k, 2), dtype))
+            normalize_rows(repulsion_sheep, ws)
+            sheep_neighbors = self.neighbor_list.nearest(candidates, distances, near_sheep_poses, sq_norms,
+                                                         near_indices)
+            self.__update_lcm_and_inertia(indices, near_sheep_poses, inertia_sheep_near_dog, repulsion_sheep,
+                                          poses, sheep_neighbors)
+            return
+
+        distance_matrix = ws.get('distances', (k, k), dtype)
+        # multiply with a copy, np.dot takes a different BLAS path (syrk) for an array and its own transpose
+        near_sheep_poses_copy = ws.get('near_poses_copy', (k, 2), dtype)
+        np.copyto(near_sheep_poses_copy, near_sheep_poses)
+        np.dot(near_sheep_poses, near_sheep_poses_copy.T, out=distance_matrix)
+        distance_matrix *= -2
+        distance_matrix += sq_norms[None, :]
+        distance_matrix += sq_norms[:, None]
+        np.sqrt(distance_matrix, out=distance_matrix)
 
         # find the sheep which are within sheep repulsion distance between each other
-        xvals, yvals = np.where(
-            (distance_matrix < self.sheep_repulsion_dist) & (distance_matrix != 0))
-        # list of interacting sheep id pairs (both ways included - i.e. [1,2] & [2,1])
-        interact = np.hstack((xvals[:, None], yvals[:, None]))
+        # (both ways included - i.e. [1,2] & [2,1])
+        interact = ws.get('interact', (k, k), dtype=bool)
+        not_interact = ws.get('not_interact', (k, k), dtype=bool)
+        np.less(distance_matrix, self.sheep_repulsion_dist, out=interact)
+        np.not_equal(distance_matrix, 0, out=not_interact)
+        np.logical_and(interact, not_interact, out=interact)
+        np.logical_not(interact, out=not_interact)
+
+        # compute the repulsion forces within sheep, unit vectors away from every interacting sheep
+        # transit[j, i] points from sheep j to sheep i, summing over the first axis adds the vectors in sequence
+        transit = ws.get('pairs', (k, k, 2), dtype)
+        np.subtract(poses[None, :, :], poses[:, None, :], out=transit)
+        transit_norms = ws.get('transit_norms', (k, k), dtype)
+        transit_sq = ws.get('transit_sq', (k, k), dtype)
+        np.multiply(transit[:, :, 0], transit[:, :, 0], out=transit_norms)
+        np.multiply(transit[:, :, 1], transit[:, :, 1], out=transit_sq)
+        transit_norms += transit_sq
+        np.sqrt(transit_norms, out=transit_norms)
+        np.divide(transit, transit_norms[:, :, None], out=transit, where=interact.T[:, :, None])
+        np.copyto(transit, 0, where=not_interact.T[:, :, None])
+        repulsion_sheep = np.sum(transit, axis=0, out=ws.get('repulsion_sheep', (k, 2), dtype))
+        normalize_rows(repulsion_sheep, ws)
 
-        # compute the repulsion forces within sheep
-        repulsion_sheep = np.zeros((num_near_sheep, 2))
+        # attraction to LCMs
+        sheep_neighbors = np.argsort(distance_matrix, axis=1)[:, 0:self.num_sheep_neighbors + 1]
+        self.__update_lcm_and_inertia(indices, near_sheep_poses, inertia_sheep_near_dog, repulsion_sheep, poses,
+                                      sheep_neighbors)
+
+    def __update_lcm_and_inertia(self, indices, near_sheep_poses, inertia_sheep_near_dog, repulsion_sheep, poses,
+                                 sheep_neighbors):
+        ws = self.workspace
+        k = len(near_sheep_poses)
+        dtype = self.dtype
+        num_lcm_sheep = sheep_neighbors.shape[1]
+        neighbor_poses = np.take(poses, sheep_neighbors.T, axis=0,
+                                 out=ws.get('pairs', (num_lcm_sheep, k, 2), dtype))
+        sheep_lcms = np.sum(neighbor_poses, axis=0, out=ws.get('sheep_lcms', (k, 2), dtype))
+        sheep_lcms /= num_lcm_sheep
+        self.__update_inertia_for_sheep_near_from_dog(indices, near_sheep_poses, inertia_sheep_near_dog,
+                                                      repulsion_sheep, sheep_lcms)
+
+    def __update_inertia_for_sheep_near_from_dog(self, indices, near_sheep_poses, inertia_sheep_near_dog,
+                                                 repulsion_sheep, sheep_lcms):
+        # error term
+        noise = self.random_state.randn(len(near_sheep_poses), 2).astype(self.dtype, copy=False)
+        self.__combine_inertia(near_sheep_poses, inertia_sheep_near_dog, repulsion_sheep, sheep_lcms, noise,
+                               self.workspace)
 
-        for val in range(num_near_sheep):
-            iv = interact[interact[:, 0] == val, 1]
-            transit = self.sheep_poses[val, :][None,
-                      :] - self.sheep_poses[iv, :]
-            transit /= np.linalg.norm(transit, axis=1, keepdims=True)
-            repulsion_sheep[val, :] = np.sum(transit, axis=0)
+        # update general inertia
+        self.inertia[indices, :] = inertia_sheep_near_dog
 
-        repulsion_sheep /= np.linalg.norm(repulsion_sheep,
-                                          axis=1, keepdims=True)
-        repulsion_sheep[np.isnan(repulsion_sheep)] = 0
+    def __combine_inertia(self, near_sheep_poses, inertia_sheep_near_dog, repulsion_sheep, sheep_lcms, noise, ws):
+        # new directions of the given sheep, in place of inertia_sheep_near_dog, every row on its own
+        k = len(near_sheep_poses)
+        dtype = self.dtype
 
         # repulsion from dog
-        repulsion_dog = self.sheep_poses[indices, :] - self.dog_pose[None, :]
-        repulsion_dog /= np.linalg.norm(repulsion_dog, axis=1, keepdims=True)
-        repulsion_dog[np.isnan(repulsion_dog)] = 0
-
-        # attraction to LCMs
-        sheep_neighbors = np.argsort(distance_matrix, axis=1)[
-                          :, 0:self.num_sheep_neighbors + 1]
-        sheep_lcms = np.zeros((num_near_sheep, 2))
-
-        for i in range(num_near_sheep):
-            sheep_lcms[i, :] = self.sheep_poses[sheep_neighbors[i]].mean(
-                axis=0)
+        repulsion_dog = np.subtract(near_sheep_poses, self.dog_pose[None, :],
+                                    out=ws.get('repulsion_dog', (k, 2), dtype))
+        normalize_rows(repulsion_dog, ws)
 
-        attraction_lcm = sheep_lcms - self.sheep_poses[indices, :]
-        attraction_lcm /= np.linalg.norm(attraction_lcm, axis=1, keepdims=True)
-        attraction_lcm[np.isnan(attraction_lcm)] = 0
+        attraction_lcm = np.subtract(sheep_lcms, near_sheep_poses, out=sheep_lcms)
+        normalize_rows(attraction_lcm, ws)
 
-        # error term
-        noise = self.random_state.randn(num_near_sheep, 2)
-        noise /= np.linalg.norm(noise, axis=1, keepdims=True)
+        normalize_rows(noise, ws)
 
         # compute sheep motion direction
-        inertia_sheep_near_dog = self.inertia_term * inertia_sheep_near_dog + self.lcm_term * attraction_lcm + \
-                                 self.repulsion_sheep_term * repulsion_sheep + self.repulsion_dog_term * repulsion_dog + \
-                                 self.noise_term * noise
+        term = ws.get('term', (k, 2), dtype)
+        inertia_sheep_near_dog *= self.inertia_term
+        inertia_sheep_near_dog += np.multiply(attraction_lcm, self.lcm_term, out=term)
+        inertia_sheep_near_dog += np.multiply(repulsion_sheep, self.repulsion_sheep_term, out=term)
+        inertia_sheep_near_dog += np.multiply(repulsion_dog, self.repulsion_dog_term, out=term)
+        inertia_sheep_near_dog += np.multiply(noise, self.noise_term, out=term)
 
         # normalize the inertia terms
-        inertia_sheep_near_dog /= np.linalg.norm(
-            inertia_sheep_near_dog, axis=1, keepdims=True)
-        inertia_sheep_near_dog[np.isnan(inertia_sheep_near_dog)] = 0
+        normalize_rows(inertia_sheep_near_dog, ws)
+
+    @staticmethod
+    def __compute_sparse_repulsion(poses, i, j, out):
+        # same sums as the dense version, over the interacting pairs (i, j) only: adding the zero vectors of the other
+        # pairs does not change a sum, and np.add.at adds the pairs of every sheep in the same order if the pairs of
+        # every sheep i are given in increasing order of j
+        transit = poses[i] - poses[j]
+        transit_norms = np.sqrt(transit[:, 0] * transit[:, 0] + transit[:, 1] * transit[:, 1])
+        transit /= transit_norms[:, None]
+        out.fill(0)
+        np.add.at(out, i, transit)
+        return out
+
+    def __compute_tree_repulsion(self, poses, out, indices=None):
+        # sparse repulsion for the pairs found in the quadtree, the sums of every sheep are accumulated per chunk
+        # indices: sheep (rows of out) to compute the repulsion for, all if None
+        out.fill(0)
+        for p, j in self.lcm_tree.pairs_within(self.sheep_repulsion_dist, indices):
+            transit = (poses[p] if indices is None else poses[indices[p]]) - poses[j]
+            transit /= np.sqrt(transit[:, 0] * transit[:, 0] + transit[:, 1] * transit[:, 1])[:, None]
+            out[:, 0] += np.bincount(p, weights=transit[:, 0], minlength=len(out))
+            out[:, 1] += np.bincount(p, weights=transit[:, 1], minlength=len(out))
+        return out
+
+    def __sharded_step(self, poses, near_sheep_poses, inertia_sheep_near_dog, repulsion_sheep, sheep_lcms):
+        # the sheep are split into strips of rows of the repulsion cell list with about the same number of sheep,
+        # every shard reads the pairs across its border (the halo) from the shared read-only quadtree and writes
+        # only its own rows, every row is computed as in the serial step, so the result equals it for any number
+        # of threads
+        dtype = self.dtype
+        noise = self.random_state.randn(len(near_sheep_poses), 2).astype(dtype, copy=False)
+        _, cells, order, _ = self.lcm_tree.pair_cells(self.sheep_repulsion_dist)
+        by_row = np.argsort(cells[:, 1], kind='stable')
+        shards = [np.sort(shard) for shard in np.array_split(by_row, self.num_threads)]
+
+        def step_shard(shard, ws):
+            rows = self.__compute_tree_repulsion(poses, ws.get('shard_repulsion', (len(shard), 2), dtype), shard)
+            normalize_rows(rows, ws)
+            lcms = self.lcm_tree.lcms(out=ws.get('shard_lcms', (len(shard), 2), dtype), indices=shard)
+            shard_inertia = inertia_sheep_near_dog[shard]
+            self.__combine_inertia(near_sheep_poses[shard], shard_inertia, rows, lcms, noise[shard], ws)
+            repulsion_sheep[shard] = rows
+            sheep_lcms[shard] = lcms
+            inertia_sheep_near_dog[shard] = shard_inertia
+
+        for future in [self.thread_pool.submit(step_shard, shard, ws)
+                       for shard, ws in zip(shards, self.shard_workspaces)]:
+            future.result()
+
+    def fast_forward_far_phase(self, max_steps):
+        """
+        Jump over several steps at once while every sheep is farther than the dog repulsion distance from the dog
+        In this phase the sheep only graze and the dog walks straight toward its goal. The goal is kept as at the
+        start of the jump (grazing shifts it by fractions of a unit), and the jump ends one step before the dog could
+        reach the repulsion distance of the nearest sheep or its goal, so the transition is simulated step by step.
+        The grazing moves of all skipped steps are sampled at once: Binomial(K - 1, p) moves per sheep plus one
+        Bernoulli(p) move in the last step, which also sets the inertia, with one normal draw per move as in a single
+        step. With event driven grazing, the scheduled moves within the jump are applied instead. All draws come
+        from the random state of the simulation, so a run with jumps is reproducible from its seed, but its random
+        stream differs from the one of the step by step run.
+        :param max_steps: maximum number of steps to skip
+        :return: number of skipped steps, 0 if no jump is possible
+        """
+        dist_sheep_dog = np.linalg.norm(self.sheep_poses - self.dog_pose, axis=1)
+        gap = np.min(dist_sheep_dog) - self.dog_repulsion_dist
+        if gap <= 2 * self.dog_speed or max_steps < 2:
+            return 0
 
-        # update general inertia
-        self.inertia[indices, :] = inertia_sheep_near_dog
+        int_goal = self.__get_driving_point() if self.__decision_fuction() == 0 else self.__get_collecting_point()
+        direction = int_goal - self.dog_pose
+        dist_goal = np.linalg.norm(direction)
+        num_steps = int(min(max_steps, gap // self.dog_speed - 1, dist_goal // self.dog_speed - 1))
+        if num_steps < 2:
+            return 0
+        self.dog_pose = self.dog_pose + num_steps * self.dog_speed * direction / dist_goal
+
+        N = self.num_sheep_total
+        if self.grazing_scheduler is None:
+            moves = self.random_state.binomial(num_steps - 1, self.grazing_prob, N)
+            moves_last_step = self.random_state.uniform(size=N) < self.grazing_prob
+            moves += moves_last_step
+            # moves of a sheep are consecutive, its move in the last step (if any) comes last
+            lengths = np.linalg.norm(self.random_state.randn(np.sum(moves), 2), axis=1)
+            owners = np.repeat(np.arange(N), moves)
+            total = np.bincount(owners, weights=lengths, minlength=N)
+            displacement = self.delta_sheep_pose * np.repeat(total[:, None], 2, axis=1)
+            self.inertia[:] = 0
+            last = np.cumsum(moves)[moves_last_step] - 1
+            self.inertia[moves_last_step, :] = lengths[last, None]
+        else:
+            displacement = np.zeros((N, 2))
+            is_far = np.ones(N, dtype=bool)
+            for _ in range(num_steps):
+                self.__compute_inertia_for_grazing_sheep(is_far)
+                displacement[self.grazing_sheep] += self.delta_sheep_pose * self.inertia[self.grazing_sheep]
+
+        self.sheep_poses += displacement
+        self.herd_stats.update()
+        self.sheep_com = self.herd_stats.com
+        return num_steps
 
     # function to get new position of dog according to model presented in paper by Strombom et al.
     def dog_strombom_model(self):
@@ -294,9 +631,7 @@ class ShepherdSimulation:
 
     def __get_collecting_point(self):
         # get the farthest sheep
-        dist_to_com = np.linalg.norm(
-            (self.sheep_poses - self.sheep_com[None, :]), axis=1)
-        farthest_sheep = self.sheep_poses[np.argmax(dist_to_com), :]
+        farthest_sheep = self.herd_stats.farthest_sheep
 
         # compute the direction
         direction = (farthest_sheep - self.sheep_com)
@@ -328,10 +663,7 @@ class ShepherdSimulation:
         # check if sheep are within field
         field = self.thresh_alpha * self.sheep_repulsion_dist * \
                 (self.num_sheep_total ** self.thresh_beta) + self.thresh_gamma
-        dist_to_com = np.linalg.norm(
-            (self.sheep_poses - self.sheep_com[None, :]), axis=1)
-
-        if np.max(dist_to_com) < field:
+        if self.herd_stats.max_dist_to_com < field:
             return 0
         else:
             return 1
@@ -339,9 +671,7 @@ class ShepherdSimulation:
     def __decision_func_sigmoid(self):
 
         # get position of furthest sheep
-        dist_to_com = np.linalg.norm(
-            (self.sheep_poses - self.sheep_com[None, :]), axis=1)
-        farthest_sheep = self.sheep_poses[np.argmax(dist_to_com), :]
+        farthest_sheep = self.herd_stats.farthest_sheep
 
         distance_to_furthest_sheep = np.linalg.norm(farthest_sheep - self.dog_pose)
 
@@ -352,7 +682,7 @@ class ShepherdSimulation:
         # angle between driving point, shepherd, collecting point
         angle = get_degree_between_3_points(driving_point, self.dog_pose, collecting_point)
 
-        variance = np.var(dist_to_com)
+        variance = self.herd_stats.dist_variance
 
         # params must be normalize
         # TODO: better than fixed normalized value
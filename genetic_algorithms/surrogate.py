@@ -0,0 +1,135 @@
+"""Surrogate model of the fitness function, used to simulate only the promising or uncertain offspring
+"""
+import numpy as np
+import pandas as pd
+
+
+class GaussianProcessSurrogate:
+    """Gaussian process regression of the log fitness on the genes
+    Genes are standardized and an RBF kernel with the median distance between the training points as length scale
+    is used. Only the last max_points solutions are kept, so fitting stays cheap over many generations.
+    """
+
+    def __init__(self, noise=1e-2, max_points=500):
+        """
+        :param noise: variance of the observation noise, relative to the variance of the log fitness
+        :param max_points: maximum number of training solutions
+        """
+        self.noise = noise
+        self.max_points = max_points
+        self.genes = np.empty((0, 0))
+        self.log_fitness = np.empty(0)
+        self.fitted = False
+
+    def __len__(self):
+        return len(self.log_fitness)
+
+    def add(self, genes, fitness):
+        genes = np.atleast_2d(np.asarray(genes, dtype=float))
+        self.genes = genes if len(self) == 0 else np.vstack([self.genes, genes])
+        self.log_fitness = np.append(self.log_fitness, np.log(fitness))[-self.max_points:]
+        self.genes = self.genes[-self.max_points:]
+        self.fitted = False
+
+    def add_log(self, fname, gene_columns):
+        """
+        Add the solutions of a generation log of the GA scripts, except for the ones with a predicted fitness
+        :param fname: pickle of the log
+        :param gene_columns: names of the gene columns, e.g. ['alpha', 'beta', 'gamma']
+        """
+        df = pd.read_pickle(fname)
+        if 'simulated' in df:
+            df = df[df['simulated'].astype(bool)]
+        self.add(df[gene_columns].to_numpy(), df['fitness'].to_numpy())
+
+    def fit(self):
+        self.genes_mean = self.genes.mean(axis=0)
+        self.genes_std = self.genes.std(axis=0) + 1e-12
+        self.y_mean = self.log_fitness.mean()
+        self.y_std = self.log_fitness.std() + 1e-12
+
+        X = (self.genes - self.genes_mean) / self.genes_std
+        sq_dists = np.sum((X[:, None, :] - X[None, :, :]) ** 2, axis=2)
+        self.length_scale = np.sqrt(np.median(sq_dists[sq_dists > 0])) if np.any(sq_dists > 0) else 1.
+        K = np.exp(-0.5 * sq_dists / self.length_scale ** 2) + self.noise * np.eye(len(X))
+        self.L = np.linalg.cholesky(K)
+        self.alpha = np.linalg.solve(self.L.T, np.linalg.solve(self.L, (self.log_fitness - self.y_mean) / self.y_std))
+        self.X = X
+        self.fitted = True
+
+    def predict(self, genes):
+        """
+        :return: fitness, std: predicted fitness and standard deviation of the predicted log fitness
+        """
+        if not self.fitted:
+            self.fit()
+        X = (np.atleast_2d(genes) - self.genes_mean) / self.genes_std
+        K_s = np.exp(-0.5 * np.sum((X[:, None, :] - self.X[None, :, :]) ** 2, axis=2) / self.length_scale ** 2)
+        mean = K_s @ self.alpha
+        v = np.linalg.solve(self.L, K_s.T)
+        var = np.maximum(1 - np.sum(v ** 2, axis=0), 0)
+        return np.exp(mean * self.y_std + self.y_mean), np.sqrt(var) * self.y_std
+
+
+class SurrogateScreening:
+    """Pre-screening of a population with a surrogate model
+    Once the surrogate knows min_points solutions, only the num_promising solutions with the highest predicted
+    fitness and the num_uncertain most uncertain ones among the rest are simulated, the others get the predicted
+    fitness. Solutions simulated before are not simulated again. The prediction error on the simulated solutions is
+    recorded for every screened generation. The predicted fitness only guides the selection, the best solution is
+    always a simulated one (see simulated_fitness).
+    """
+
+    def __init__(self, surrogate, num_promising=5, num_uncertain=3, min_points=50):
+        self.surrogate = surrogate
+        self.num_promising = num_promising
+        self.num_uncertain = num_uncertain
+        self.min_points = min_points
+        # fitness of the simulated solutions, by genes
+        self.known = {}
+        # per screened generation: number of simulated solutions and mean relative error of their prediction
+        self.errors = []
+
+    def simulated_fitness(self, population):
+        """
+        :return: simulated fitness of every solution of a population, nan for the solutions never simulated
+        """
+        return np.array([self.known.get(solution.tobytes(), np.nan) for solution in np.asarray(population)])
+
+    def screen(self, population, evaluate):
+        """
+        :param population: genes of the solutions
+        :param evaluate: function returning the real fitness of every solution of a population
+        :return: fitness, simulated: fitness of the solutions and mask of the ones whose fitness was simulated
+        """
+        population = np.asarray(population)
+        keys = [solution.tobytes() for solution in population]
+        fitness = self.simulated_fitness(population)
+        simulated = ~np.isnan(fitness)
+        pending = np.flatnonzero(~simulated)
+
+        predicted = None
+        if len(self.surrogate) >= self.min_points and len(pending) > 0:
+            predicted, std = self.surrogate.predict(population[pending])
+            promising = np.argsort(-predicted, kind='stable')[:self.num_promising]
+            rest = np.setdiff1d(np.arange(len(pending)), promising)
+            uncertain = rest[np.argsort(-std[rest], kind='stable')[:self.num_uncertain]]
+            selected = np.zeros(len(pending), dtype=bool)
+            selected[promising] = True
+            selected[uncertain] = True
+            fitness[pending[~selected]] = predicted[~selected]
+            predicted = predicted[selected]
+            pending = pending[selected]
+
+        if len(pending) > 0:
+            fitness[pending] = evaluate(population[pending])
+            simulated[pending] = True
+            self.surrogate.add(population[pending], fitness[pending])
+            for idx in pending:
+                self.known[keys[idx]] = fitness[idx]
+
+        if predicted is not None and len(pending) > 0:
+            actual = fitness[pending]
+            self.errors.append({'simulated': len(pending),
+                                'mean_relative_error': float(np.mean(np.abs(predicted - actual) / actual))})
+        return fitness, simulated
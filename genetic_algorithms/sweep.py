@@ -0,0 +1,72 @@
+"""Seeding and cell selection of (N, n) sweeps
+get_sweep_random_state derives the random stream of every simulation of a sweep from the sweep seed, adaptive_sweep
+simulates only the cells of the success heatmap which are needed to interpolate the others.
+"""
+import numpy as np
+
+
+def get_sweep_random_state(sweep_seed, N, n, repetition):
+    """
+    Random state of a single simulation within a sweep. The stream is derived with SeedSequence spawning from the
+    sweep seed and the key (N, n, repetition), so all simulations are statistically independent (also across forked
+    pool workers) and any single simulation can be recomputed on its own.
+    Equal to SeedSequence(sweep_seed).spawn(N + 1)[N].spawn(n + 1)[n].spawn(repetition + 1)[repetition].
+    :param sweep_seed: entropy identifying the sweep
+    :param N: total number of sheep
+    :param n: number of neighbors
+    :param repetition: index of the repetition of the simulation for this (N, n)
+    :return: np.random.RandomState
+    """
+    seed_sequence = np.random.SeedSequence(sweep_seed, spawn_key=(N, n, repetition))
+    return np.random.RandomState(np.random.MT19937(seed_sequence))
+
+
+def adaptive_sweep(evaluate_cells, pairs, num_samples, coarse_step=8, max_std_err=0.05, max_disagreement=0.2):
+    """
+    Success rates of all (N, n) pairs, simulating only a fraction of them. The cells on a coarse lattice (N and n
+    multiples of coarse_step) are simulated first, then the step of the lattice is halved until 1. A cell of the finer
+    lattice is simulated if less than two cells within one step around it are known, if they disagree by more than
+    max_disagreement or if any simulated one of them has a binomial standard error above max_std_err (success rate
+    neither ~0 nor ~1). Otherwise it gets the mean of these cells and is flagged as estimated.
+    :param evaluate_cells: function mapping a list of [N, n] pairs to the list of their success rates
+    :param pairs: list of [N, n] pairs of the full resolution sweep
+    :param num_samples: number of simulations per simulated cell
+    :param coarse_step: step of the initial lattice, a power of 2
+    :param max_std_err: maximum standard error of a simulated neighbour for a cell to be interpolated
+    :param max_disagreement: maximum difference between the neighbours for a cell to be interpolated
+    :return: results, estimated: success rates indexed [N, n] (nan outside of pairs), mask of the interpolated cells
+    """
+    pairs = np.array(pairs)
+    size = pairs.max() + 1
+    results = np.full((size, size), np.nan)
+    simulated = np.zeros((size, size), dtype=bool)
+    estimated = np.zeros((size, size), dtype=bool)
+
+    step = coarse_step
+    while step >= 1:
+        on_lattice = (pairs[:, 0] % step == 0) & (pairs[:, 1] % step == 0)
+        candidates = [(N, n) for N, n in pairs[on_lattice] if np.isnan(results[N, n])]
+        to_simulate = []
+        interpolated = {}
+        for N, n in candidates:
+            window = np.s_[max(N - step, 0):N + step + 1, max(n - step, 0):n + step + 1]
+            known = results[window][~np.isnan(results[window])]
+            sampled = results[window][simulated[window]]
+            if len(known) < 2 or known.max() - known.min() > max_disagreement or \
+                    np.any(np.sqrt(sampled * (1 - sampled) / num_samples) > max_std_err):
+                to_simulate.append([N, n])
+            else:
+                interpolated[N, n] = known.mean()
+        # cells are filled in after the decisions, so they do not depend on the order of the candidates
+        for (N, n), success in interpolated.items():
+            results[N, n] = success
+            estimated[N, n] = True
+        if to_simulate:
+            for (N, n), success in zip(to_simulate, evaluate_cells(to_simulate)):
+                results[N, n] = success
+                simulated[N, n] = True
+        print(f"Lattice step {step}: simulated {len(to_simulate)}, estimated {len(candidates) - len(to_simulate)}")
+        step //= 2
+
+    print(f"Simulated {simulated.sum()}/{len(pairs)} cells ({round(100 * simulated.sum() / len(pairs), 2)}%)")
+    return results, estimated
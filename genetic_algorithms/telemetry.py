@@ -0,0 +1,187 @@
+"""Live telemetry of sweeps run on a multiprocessing pool
+The pool workers count their tasks, simulations, steps and busy time in shared counters, SweepTelemetry turns them
+into throughput, ETA and worker utilization, prints them periodically, writes them to a metrics file and optionally
+serves them over HTTP.
+"""
+import http.server
+import json
+import multiprocessing as mp
+import threading
+import time
+
+import numpy as np
+
+
+# row of a worker in the shared telemetry counters: finished tasks, simulations, steps, busy seconds and the start
+# time of the running task (0 while idle)
+TELEMETRY_FIELDS = 5
+_telemetry_row = None
+
+
+def format_duration(seconds):
+    """
+    :return: duration as hh:mm:ss, with the number of days in front if it is a day or longer
+    """
+    days, rest = divmod(int(round(seconds)), 24 * 3600)
+    hours, rest = divmod(rest, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return (f"{days}d " if days > 0 else '') + f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def telemetry_worker_init(counters, next_slot):
+    """
+    Initializer of the pool workers of a SweepTelemetry, every worker claims its own row of the shared counters
+    """
+    global _telemetry_row
+    with next_slot.get_lock():
+        slot = next_slot.value
+        next_slot.value += 1
+    # workers which replace crashed ones find no free row and are not tracked
+    if (slot + 1) * TELEMETRY_FIELDS <= len(counters):
+        _telemetry_row = (counters, slot * TELEMETRY_FIELDS)
+
+
+def report_task_start():
+    """Called by a pool worker when it starts a task, without effect outside of a SweepTelemetry pool"""
+    if _telemetry_row is not None:
+        counters, offset = _telemetry_row
+        counters[offset + 4] = time.time()
+
+
+def report_task_done(simulations=1, steps=0):
+    """Called by a pool worker when it finished a task, with the number of simulations and steps it ran"""
+    if _telemetry_row is not None:
+        counters, offset = _telemetry_row
+        counters[offset + 3] += time.time() - counters[offset + 4]
+        counters[offset + 4] = 0.
+        counters[offset] += 1
+        counters[offset + 1] += simulations
+        counters[offset + 2] += steps
+
+
+class SweepTelemetry:
+    """Live progress of a sweep running in a process pool.
+    The workers account their tasks in shared counters (one row each, written only by its worker), from which the
+    parent derives the throughput in simulations and steps per second, the ETA and the busy and idle time of every
+    worker. A thread of the parent prints a summary every refresh_interval seconds and writes the metrics as JSON to
+    metrics_file, an optional HTTP server on localhost serves the same JSON.
+    Usage:
+        with SweepTelemetry(total_tasks, num_workers) as telemetry:
+            with mp.Pool(num_workers, initializer=telemetry_worker_init, initargs=telemetry.initargs) as pool:
+                ...
+    and the task function calls report_task_start and report_task_done.
+    """
+
+    def __init__(self, total_tasks, num_workers, metrics_file=None, refresh_interval=30., http_port=None, verbose=True):
+        """
+        :param total_tasks: number of tasks of the sweep, may be increased while it runs
+        :param num_workers: number of processes of the pool
+        :param metrics_file: path of the JSON metrics file, rewritten at every refresh (None to disable)
+        :param refresh_interval: seconds between two summaries
+        :param http_port: port of the HTTP endpoint on 127.0.0.1 (None to disable, 0 for any free port)
+        :param verbose: print the summaries
+        """
+        self.total_tasks = total_tasks
+        self.num_workers = num_workers
+        self.metrics_file = metrics_file
+        self.refresh_interval = refresh_interval
+        self.http_port = http_port
+        self.verbose = verbose
+
+        self.counters = mp.Array('d', num_workers * TELEMETRY_FIELDS, lock=False)
+        self.next_slot = mp.Value('i', 0)
+        self.initargs = (self.counters, self.next_slot)
+        self.start_time = None
+        self.stopped = threading.Event()
+        self.thread = None
+        self.server = None
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self.__refresh_loop, daemon=True)
+        self.thread.start()
+        if self.http_port is not None:
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.http_port), self.__handler())
+            self.http_port = self.server.server_address[1]
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            if self.verbose:
+                print(f"Telemetry served at http://127.0.0.1:{self.http_port}/")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.refresh()
+        return False
+
+    def metrics(self):
+        """
+        :return: dict of the progress, throughput, ETA and per worker statistics, JSON serializable
+        """
+        now = time.time()
+        elapsed = now - self.start_time
+        rows = np.frombuffer(self.counters, dtype=np.float64).reshape(self.num_workers, TELEMETRY_FIELDS).copy()
+        running = rows[:, 4] > 0
+        busy = rows[:, 3] + np.where(running, now - rows[:, 4], 0.)
+        tasks, simulations, steps = rows[:, 0].sum(), rows[:, 1].sum(), rows[:, 2].sum()
+        workers = [{'tasks': int(rows[i, 0]), 'simulations': int(rows[i, 1]), 'steps': int(rows[i, 2]),
+                    'busy_s': round(busy[i], 3), 'idle_s': round(elapsed - busy[i], 3), 'running': bool(running[i]),
+                    'utilization': round(busy[i] / elapsed, 4) if elapsed > 0 else 0.}
+                   for i in range(min(self.next_slot.value, self.num_workers))]
+        eta = elapsed / tasks * (self.total_tasks - tasks) if tasks > 0 else None
+        return {
+            'timestamp': now,
+            'elapsed_s': round(elapsed, 3),
+            'tasks_done': int(tasks),
+            'tasks_total': self.total_tasks,
+            'simulations': int(simulations),
+            'steps': int(steps),
+            'simulations_per_s': simulations / elapsed if elapsed > 0 else 0.,
+            'steps_per_s': steps / elapsed if elapsed > 0 else 0.,
+            'eta_s': round(eta, 1) if eta is not None else None,
+            'utilization': round(busy.sum() / (elapsed * self.num_workers), 4) if elapsed > 0 else 0.,
+            'workers': workers,
+        }
+
+    def summary(self, metrics=None):
+        metrics = metrics if metrics is not None else self.metrics()
+        eta = metrics['eta_s']
+        eta = format_duration(eta) if eta is not None else '?'
+        done = f"{metrics['tasks_done']}/{metrics['tasks_total']}"
+        if metrics['tasks_total'] > 0:
+            done += f" ({round(100 * metrics['tasks_done'] / metrics['tasks_total'], 2)}%)"
+        return (f"Tasks: {done}\tsims/s: {metrics['simulations_per_s']:.2f}\tsteps/s: {metrics['steps_per_s']:.0f}"
+                f"\tETA: {eta}\tutilization: {round(100 * metrics['utilization'], 1)}%")
+
+    def refresh(self):
+        """Print the summary and rewrite the metrics file"""
+        metrics = self.metrics()
+        if self.verbose:
+            print(self.summary(metrics))
+        if self.metrics_file is not None:
+            with open(self.metrics_file, 'w') as f:
+                json.dump(metrics, f, indent=2)
+
+    def __refresh_loop(self):
+        while not self.stopped.wait(self.refresh_interval):
+            self.refresh()
+
+    def __handler(self):
+        telemetry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(telemetry.metrics()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
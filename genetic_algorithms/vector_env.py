@@ -0,0 +1,203 @@
+"""Gym-style environment around the shepherding simulation, for driving the dog with an external policy
+ShepherdEnv wraps a single simulation, VectorShepherdEnv steps a batch of them, optionally in worker processes.
+The observations, rewards and done flags of the batch live in preallocated shared memory, so the workers write them
+in place and only small messages go through the pipes.
+"""
+import ctypes
+import multiprocessing as mp
+from timeit import default_timer as timer
+
+import numpy as np
+
+from shepherd_simulation import ShepherdSimulation
+from workspace import StepWorkspace
+
+
+class ShepherdEnv:
+    """Single shepherding environment
+    Action: direction of the dog, scaled to the dog speed (actions longer than 1 are normalized).
+    Observation: dog position, center of mass of the herd, target and the positions of all sheep, flattened.
+    Reward: decrease of the distance between the center of mass of the herd and the target in the step.
+    An episode ends with the success criteria of the simulation or after max_steps steps.
+    """
+
+    def __init__(self, num_sheep_total=30, num_sheep_neighbors=15, max_steps=1000, random_state=None):
+        self.num_sheep_total = num_sheep_total
+        self.num_sheep_neighbors = num_sheep_neighbors
+        self.max_steps = max_steps
+        self.random_state = random_state or np.random.RandomState()
+        # buffers of the simulation steps, kept across episodes
+        self.workspace = StepWorkspace()
+        self.observation_size = 6 + 2 * num_sheep_total
+        self.sim = None
+        self.steps = 0
+
+    def observe(self, out=None):
+        if out is None:
+            out = np.empty(self.observation_size)
+        out[0:2] = self.sim.dog_pose
+        out[2:4] = self.sim.sheep_com
+        out[4:6] = self.sim.target
+        out[6:] = self.sim.sheep_poses.ravel()
+        return out
+
+    def reset(self, out=None):
+        # consecutive episodes continue the random stream of the environment
+        self.sim = ShepherdSimulation(num_sheep_total=self.num_sheep_total, num_sheep_neighbors=self.num_sheep_neighbors,
+                                      max_steps=self.max_steps, random_state=self.random_state,
+                                      workspace=self.workspace)
+        self.steps = 0
+        return self.observe(out)
+
+    def step(self, action, out=None):
+        """
+        :return: observation, reward, done, info
+        """
+        sim = self.sim
+        dist = np.linalg.norm(sim.target - sim.sheep_com)
+
+        action = np.asarray(action, dtype=float)
+        norm = np.linalg.norm(action)
+        if norm > 1:
+            action = action / norm
+        sim.dog_pose = sim.dog_pose + sim.dog_speed * action
+        sim.update_environment()
+        self.steps += 1
+
+        reward = dist - np.linalg.norm(sim.target - sim.sheep_com)
+        success = sim.success_criteria()
+        done = success or self.steps >= self.max_steps
+        return self.observe(out), reward, done, {'success': success, 'steps': self.steps}
+
+
+def _shared_array(shape, ctype=ctypes.c_double, dtype=np.float64):
+    buffer = mp.RawArray(ctype, int(np.prod(shape)))
+    return buffer, np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def _step_envs(envs, offset, actions, observations, rewards, dones):
+    """
+    Step the environments and reset the finished ones, writing into the shared arrays from offset on
+    :return: infos of the finished environments, by index, with the observation of the last step
+    """
+    infos = {}
+    for i, env in enumerate(envs, offset):
+        observation, rewards[i], dones[i], info = env.step(actions[i], out=observations[i])
+        if dones[i]:
+            info['final_observation'] = observation.copy()
+            infos[i] = info
+            env.reset(out=observations[i])
+    return infos
+
+
+def _worker(connection, envs, offset, buffers, shapes):
+    actions, observations, rewards, dones = [
+        np.frombuffer(buffer, dtype=dtype).reshape(shape) for buffer, (shape, dtype) in zip(buffers, shapes)]
+    while True:
+        command = connection.recv()
+        if command == 'step':
+            connection.send(_step_envs(envs, offset, actions, observations, rewards, dones))
+        elif command == 'reset':
+            for i, env in enumerate(envs, offset):
+                env.reset(out=observations[i])
+            connection.send(None)
+        else:
+            break
+
+
+class VectorShepherdEnv:
+    """Batch of shepherding environments with autoreset
+    step() returns the observations, rewards and done flags of all environments as views of the shared arrays, they
+    are overwritten by the next step. A finished environment is reset right away, its info holds the last
+    observation of the episode.
+    """
+
+    def __init__(self, num_envs, num_workers=0, seed=None, **env_kwargs):
+        """
+        :param num_envs: number of environments
+        :param num_workers: number of worker processes stepping the environments, 0 steps them in this process
+        :param seed: entropy of the random streams of the environments
+        :param env_kwargs: arguments of ShepherdEnv
+        """
+        streams = np.random.SeedSequence(seed).spawn(num_envs)
+        self.envs = [ShepherdEnv(random_state=np.random.RandomState(np.random.MT19937(stream)), **env_kwargs)
+                     for stream in streams]
+        self.num_envs = num_envs
+        observation_size = self.envs[0].observation_size
+
+        shapes = [((num_envs, 2), np.float64), ((num_envs, observation_size), np.float64),
+                  ((num_envs,), np.float64), ((num_envs,), np.bool_)]
+        ctypes_ = [ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_bool]
+        buffers, arrays = zip(*[_shared_array(shape, ctype, dtype) for (shape, dtype), ctype in zip(shapes, ctypes_)])
+        self.actions, self.observations, self.rewards, self.dones = arrays
+
+        self.env_steps = 0
+        self.step_time = 0.
+
+        self.connections = []
+        self.workers = []
+        for envs_idx in np.array_split(np.arange(num_envs), num_workers) if num_workers > 0 else []:
+            if len(envs_idx) == 0:
+                continue
+            parent, child = mp.Pipe()
+            # the worker owns its own copies of the environments, the ones in this process are not stepped anymore
+            worker = mp.Process(target=_worker, daemon=True,
+                                args=(child, [self.envs[i] for i in envs_idx], envs_idx[0], buffers, shapes))
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def reset(self):
+        if self.workers:
+            for connection in self.connections:
+                connection.send('reset')
+            for connection in self.connections:
+                connection.recv()
+        else:
+            for i, env in enumerate(self.envs):
+                env.reset(out=self.observations[i])
+        return self.observations
+
+    def step(self, actions):
+        """
+        :param actions: array (num_envs, 2) of dog directions
+        :return: observations, rewards, dones, infos (by index of the finished environments)
+        """
+        start = timer()
+        self.actions[:] = actions
+        if self.workers:
+            for connection in self.connections:
+                connection.send('step')
+            infos = {}
+            for connection in self.connections:
+                infos.update(connection.recv())
+        else:
+            infos = _step_envs(self.envs, 0, self.actions, self.observations, self.rewards, self.dones)
+        self.step_time += timer() - start
+        self.env_steps += self.num_envs
+        return self.observations, self.rewards, self.dones, infos
+
+    @property
+    def steps_per_second(self):
+        return self.env_steps / self.step_time if self.step_time > 0 else 0.
+
+    def close(self):
+        for connection in self.connections:
+            connection.send('close')
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+
+
+if __name__ == '__main__':
+    # throughput of a batch of environments driven by random actions
+    num_envs = 32
+    for num_workers in (0, 1, 2, 4, 8):
+        env = VectorShepherdEnv(num_envs, num_workers=num_workers, seed=0)
+        env.reset()
+        random_state = np.random.RandomState(0)
+        for _ in range(200):
+            env.step(random_state.uniform(-1, 1, size=(num_envs, 2)))
+        print(f'{num_workers} workers: {round(env.steps_per_second)} env-steps/s')
+        env.close()
@@ -0,0 +1,38 @@
+"""Reusable step buffers of a simulation
+"""
+import math
+
+import numpy as np
+
+
+class StepWorkspace:
+    """Preallocated buffers for the computations of one simulation step, reused across steps.
+    Every buffer is handed out as a contiguous view of the size needed in the current step and only reallocated if
+    it is too small. This covers the distance matrix and the other (k, k) and (k, 2) intermediates of the sheep near
+    the dog, the random draws, sorts and index arrays of a step still allocate.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=np.float64):
+        size = math.prod(shape)
+        buf = self.buffers.get(name)
+        if buf is None or buf.size < size or buf.dtype != dtype:
+            buf = np.empty(size, dtype=dtype)
+            self.buffers[name] = buf
+        return buf[:size].reshape(shape)
+
+
+def normalize_rows(vectors, workspace):
+    """Normalize the vectors along the last axis of an array (e.g. the rows of a (k, 2) array) in place, vectors of
+    zero length are set to 0"""
+    squares = workspace.get('normalize_squares', vectors.shape, vectors.dtype)
+    norms = workspace.get('normalize_norms', vectors.shape[:-1], vectors.dtype)
+    nans = workspace.get('normalize_nans', vectors.shape, dtype=bool)
+    np.multiply(vectors, vectors, out=squares)
+    np.sum(squares, axis=-1, out=norms)
+    np.sqrt(norms, out=norms)
+    np.divide(vectors, norms[..., None], out=vectors)
+    np.isnan(vectors, out=nans)
+    np.copyto(vectors, 0, where=nans)
@@ -2,6 +2,10 @@ from matplotlib import pyplot as plt
 import numpy as np
 import os
 
+from genetic_algorithms.progress_monitor import Outcome, ProgressMonitor
+from genetic_algorithms.sweep import get_sweep_random_state
+from genetic_algorithms.telemetry import SweepTelemetry, report_task_done, report_task_start, telemetry_worker_init
+
 
 def plot_driving_collecting_progress(driving_counter):
     fig = plt.figure()
@@ -21,3 +25,109 @@ def plot_driving_collecting_bar(driving_counter):
     plt.bar(x_pos, [num_driving, num_collecting])
     plt.xticks(x_pos, bars)
     fig.savefig('log/driving_bar.png')
+
+
+class VisibilityTracker:
+    """Temporal-coherence cache of the sheep visible to the dog.
+    After a full recompute of the visibility, the visible and hidden sheep keep their status as long as it can be
+    certified from the motion since then, and only the other sheep are re-tested against the visible sheep before
+    them. A hidden sheep is certified if the visible sheep which occluded it is still closer to the dog and still
+    occludes it. A visible sheep is certified while the largest displacement relative to the dog since the full
+    recompute, eps, is below its margin: the distance of sheep i to the line from the dog through sheep j changes by
+    at most eps * (1 + 2 * |u_i| / |u_j|) (u relative to the dog at the full recompute), and a farther sheep can only
+    move in front of i if their distances to the dog differed by less than 2 * eps.
+    If a re-tested sheep changes its status, or after full_interval steps, the visibility is recomputed in full, so
+    the result always equals the full computation.
+    """
+
+    def __init__(self, sheep_radius, get_visible_sheep, full_interval=50):
+        """
+        :param sheep_radius: radius of one sheep, used to check for occlusion
+        :param get_visible_sheep: function(sheep_poses, dog_pose, sheep_radius) computing the visibility in full,
+        returning the indices of the visible sheep ordered by their distance to the dog
+        :param full_interval: maximum number of steps between full recomputes
+        """
+        self.sheep_radius = sheep_radius
+        self.get_visible_sheep = get_visible_sheep
+        self.full_interval = full_interval
+        # mask of the visible sheep and their indices ordered by their distance to the dog
+        self.visible = None
+        self.visible_order = None
+        self.steps_since_full = 0
+        # statistics: sheep certified from the cache, sheep re-tested (all of them in a full recompute after a
+        # status change) and full recomputes
+        self.hits = 0
+        self.retests = 0
+        self.full_recomputes = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.retests
+        return self.hits / total if total else 0.
+
+    @staticmethod
+    def line_distances(u, lengths, i, j):
+        # distances of the sheep i to the lines from the dog through the sheep j, computed as in get_visible_sheep
+        return np.abs(u[j, 0] * u[i, 1] - u[j, 1] * u[i, 0]) / lengths[j]
+
+    def full_recompute(self, sheep_poses, dog_pose):
+        self.visible_order = self.get_visible_sheep(sheep_poses, dog_pose, self.sheep_radius)
+        self.visible = np.zeros(len(sheep_poses), dtype=bool)
+        self.visible[self.visible_order] = True
+        self.full_recomputes += 1
+        self.steps_since_full = 0
+
+        u = sheep_poses - dog_pose
+        lengths = np.linalg.norm(u, axis=1)
+        position = np.empty(len(u), dtype=np.intp)
+        position[np.argsort(lengths, kind='stable')] = np.arange(len(u))
+        self.u = u
+        vis = np.flatnonzero(self.visible)
+        distances = self.line_distances(u, lengths, np.arange(len(u))[:, None], vis[None, :])
+
+        # hidden sheep: the visible sheep before them which occludes them the most
+        occluding = (distances < self.sheep_radius) & (position[vis][None, :] < position[:, None])
+        self.occluder = vis[np.argmin(np.where(occluding, distances, np.inf), axis=1)]
+
+        # visible sheep: largest displacement for which no visible sheep can occlude them
+        eps_dist = (distances - self.sheep_radius) / (1 + 2 * lengths[:, None] / lengths[vis][None, :])
+        eps_order = np.where(lengths[vis][None, :] > lengths[:, None], (lengths[vis][None, :] - lengths[:, None]) / 2,
+                             -np.inf)
+        eps_pairs = np.maximum(eps_dist, eps_order)
+        eps_pairs[vis, np.arange(len(vis))] = np.inf
+        self.margin = np.min(eps_pairs, axis=1, initial=np.inf) - 1e-9
+
+    def update(self, sheep_poses, dog_pose):
+        """
+        :return: indices of the visible sheep, ordered by their distance to the dog
+        """
+        if self.visible is None or self.steps_since_full >= self.full_interval:
+            self.full_recompute(sheep_poses, dog_pose)
+            return self.visible_order
+        self.steps_since_full += 1
+
+        u = sheep_poses - dog_pose
+        lengths = np.linalg.norm(u, axis=1)
+        eps = np.max(np.linalg.norm(u - self.u, axis=1))
+        order = np.argsort(lengths, kind='stable')
+        position = np.empty(len(u), dtype=np.intp)
+        position[order] = np.arange(len(u))
+
+        hidden = np.flatnonzero(~self.visible)
+        occluder = self.occluder[hidden]
+        occluded = (position[occluder] < position[hidden]) & \
+                   (self.line_distances(u, lengths, hidden, occluder) < self.sheep_radius)
+        uncertain = np.concatenate([hidden[~occluded], np.flatnonzero(self.visible & (self.margin < eps))])
+
+        for i in uncertain:
+            before = np.flatnonzero(self.visible & (position < position[i]))
+            is_visible = not np.any(self.line_distances(u, lengths, i, before) < self.sheep_radius)
+            if is_visible != self.visible[i]:
+                # the statuses of the sheep behind it may change as well
+                self.retests += len(u)
+                self.full_recompute(sheep_poses, dog_pose)
+                return self.visible_order
+        self.hits += len(u) - len(uncertain)
+        self.retests += len(uncertain)
+        self.visible_order = order[self.visible[order]]
+        return self.visible_order
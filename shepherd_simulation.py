@@ -5,6 +5,9 @@
    Based on: https://github.com/buntyke/shepherd_gym
 """
 import argparse
+import json
+import multiprocessing as mp
+import time
 import warnings
 
 import matplotlib
@@ -12,20 +15,37 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from fuzzy_dog import get_fuzzy_system
-from helper import plot_driving_collecting_progress, plot_driving_collecting_bar
+from helper import (VisibilityTracker, plot_driving_collecting_progress, plot_driving_collecting_bar, Outcome,
+                    get_sweep_random_state)
 
 # Following line is needed to get an updated graphic plot of the env.
-# Important: Comment this line out if run on server without frontend!
-matplotlib.use("TkAgg")
+# On a server without frontend the default backend is kept, which is enough for headless runs.
+try:
+    matplotlib.use("TkAgg")
+except ImportError:
+    pass
 
 # suppress runtime warnings
 warnings.filterwarnings("ignore")
 
 
+class Dog_model:
+    FUZZY = "fuzzy"
+    STROMBOM = "strombom"
+
+
 class ShepherdSimulation:
     genVideo = False
 
-    def __init__(self, num_sheep_total=30, num_sheep_neighbors=15, max_steps=1500):
+    def __init__(self, num_sheep_total=30, num_sheep_neighbors=15, max_steps=1500, random_seed=None, random_state=None,
+                 visibility_cache=False, dog_model=Dog_model.FUZZY):
+
+        # initialize random state
+        # take random_state if not None, else seed a new random state (from OS entropy if random_seed is None)
+        if random_state is not None:
+            self.random_state = random_state
+        else:
+            self.random_state = np.random.RandomState(random_seed)
 
         # radius for sheep to be considered as collected by dog
         self.dog_collect_radius = 2.0
@@ -61,13 +81,22 @@ class ShepherdSimulation:
         # initialize sheep positions
         field_center = np.array(
             [self.field_length // 2, self.field_length // 2])
-        self.init_sheep_pose = np.random.uniform(
+        self.init_sheep_pose = self.random_state.uniform(
             0, self.field_length // 2, size=(self.num_sheep_total, 2)) + field_center
-        self.sheep_poses = self.init_sheep_pose
+        # the live positions are a copy, the initial ones are kept unchanged
+        self.sheep_poses = self.init_sheep_pose.copy()
+        # boolean mask over sheep_poses marking the sheep the dog can see (all of them before the first step)
+        self.vis_sheep_mask = np.ones(self.num_sheep_total, dtype=bool)
         self.vis_sheep_poses = self.sheep_poses
         self.sheep_com = self.sheep_poses.mean(axis=0)
 
         self.sheep_radius = 2
+        # reuse the visibility of the previous steps for the sheep whose status is certain (same result as
+        # get_visible_sheep in every step), None recomputes it in full every step. Off by default: the dog moves
+        # every step, so few statuses stay certified (hit rate of a few percent in typical runs)
+        self.visibility_tracker = None
+        if visibility_cache:
+            self.visibility_tracker = VisibilityTracker(self.sheep_radius, self.get_visible_sheep)
 
         # initialize dog position
         init_dog_pose = np.array([0, 0])
@@ -82,10 +111,22 @@ class ShepherdSimulation:
         # initialize maximum number of steps
         self.max_steps = max_steps
 
+        # decision model of the dog, one of Dog_model
+        self.dog_model = dog_model
+
         # number of executed steps
         self.counter = 0
         self.driving_counter = [0]
         self.video_counter = 0
+        # outcome of the last run, one of helper.Outcome
+        self.outcome = None
+
+        # persistent artists of the environment plot, created on the first call of plot_env
+        self.env_artists = None
+        self.env_background = None
+        # rendering statistics of plot_env (number of frames and time spent drawing them)
+        self.render_frames = 0
+        self.render_time = 0.0
 
     def success_criteria(self):
         """
@@ -94,11 +135,12 @@ class ShepherdSimulation:
         """
         return np.linalg.norm(self.target - self.sheep_com) < 5.0
 
-    def run(self, render=False, verbose=False):
+    def run(self, render=False, verbose=False, progress_monitor=None):
         """
         main function to perform the simulation loop
         :param render: argument specifying if the environment shall be plotted
         :param verbose: Output verbose information during the run
+        :param progress_monitor: optional helper.ProgressMonitor, aborting the run once the herd is stalled
         :return: counter, success: specifying if simulation successful and how long it took.
         """
         # start the simulation
@@ -110,8 +152,8 @@ class ShepherdSimulation:
             # Init plot - 1 figure for the gamefield and 3 for the fuzzy memberships.
             fuzzy_rows = 1
             fuzzy_cols = 4
-            plt.subplots(fuzzy_rows, fuzzy_cols, figsize=(fuzzy_cols * 5, fuzzy_rows * 5),
-                         gridspec_kw={'width_ratios': [2, 1, 1, 1], 'wspace': 0.5})
+            self.fig, self.axes = plt.subplots(fuzzy_rows, fuzzy_cols, figsize=(fuzzy_cols * 5, fuzzy_rows * 5),
+                                               gridspec_kw={'width_ratios': [2, 1, 1, 1], 'wspace': 0.5})
             plt.ion()
             if not ShepherdSimulation.genVideo:
                 plt.show()
@@ -123,24 +165,49 @@ class ShepherdSimulation:
 
             # get the new dog position
             # self.dog_heuristic_model()
-            # self.dog_strombom_model(self.vis_sheep_poses)
-            self.dog_fuzzy_model(self.vis_sheep_poses, verbose=verbose, render=render)
+            if self.dog_model == Dog_model.STROMBOM:
+                self.dog_strombom_model(self.vis_sheep_poses)
+            else:
+                self.dog_fuzzy_model(self.vis_sheep_poses, verbose=verbose, render=render)
 
             # find new inertia
             self.update_environment()
             # Update the list of visible sheep
-            self.vis_sheep_poses = self.get_visible_sheep(self.sheep_poses, self.dog_pose, self.sheep_radius)
+            # the dog functions get the visible sheep ordered by their distance to the dog, which determines the
+            # rounding of the means they take
+            if self.visibility_tracker is not None:
+                visible = self.visibility_tracker.update(self.sheep_poses, self.dog_pose)
+            else:
+                visible = self.get_visible_sheep(self.sheep_poses, self.dog_pose, self.sheep_radius)
+            self.vis_sheep_mask[:] = False
+            self.vis_sheep_mask[visible] = True
+            self.vis_sheep_poses = self.sheep_poses[visible]
 
             # plot every 5th frame, export every frame if making a video
             if (render and self.counter % 5 == 0) or ShepherdSimulation.genVideo:
                 self.plot_env()
 
+            # abort the simulation if the herd does not make any progress anymore
+            if progress_monitor is not None and progress_monitor.update(self.counter, self.target, self.sheep_com,
+                                                                        self.sheep_poses):
+                break
+
         success = False
         if self.success_criteria():
             success = True
+            self.outcome = Outcome.SUCCESS
+        elif self.counter < self.max_steps:
+            self.outcome = Outcome.STALLED
+        else:
+            self.outcome = Outcome.TIMEOUT
         # complete execution
         if verbose:
-            print('Finish simulation')
+            print(f'Finish simulation: {self.outcome} after {self.counter} steps')
+            if self.visibility_tracker is not None:
+                print(f"Visibility cache hit rate: {100 * self.visibility_tracker.hit_rate:.1f}% "
+                      f"({self.visibility_tracker.full_recomputes} full recomputes)")
+            if self.render_frames > 0:
+                print(f"Rendered {self.render_frames} frames at {self.render_frames / self.render_time:.1f} fps")
 
         if render:
             plot_driving_collecting_bar(self.driving_counter)
@@ -148,28 +215,60 @@ class ShepherdSimulation:
 
         return self.counter, success
 
-    def plot_env(self):
+    def init_plot_env(self):
+        """
+        Create the persistent artists of the shepherding plot. They are updated in place by plot_env, which allows
+        to blit only the moving artists instead of redrawing the whole figure every frame.
+        :return:
+        """
         # The first subplot is the plot for our simulation.
-        ax = plt.subplot(141)  # 1 row, 4 cols and we select the 1. subplot (most left)
-        ax.clear()
-        plt.scatter(self.target[0], self.target[1],
-                    c='orange', s=40, label='Goal')
-        plt.scatter(
-            self.dog_pose[0], self.dog_pose[1], c='r', s=50, label='Dog')
-        vis_sheep = self.vis_sheep_poses
-        other_sheep = np.asarray([i for i in self.sheep_poses if i not in vis_sheep])
-        if len(other_sheep) > 0:
-            plt.scatter(
-                other_sheep[:, 0], other_sheep[:, 1], c='b', s=50, label='Not visible Sheep')
-        plt.scatter(
-            vis_sheep[:, 0], vis_sheep[:, 1], c='g', s=50, label='Visible Sheep')
-        plt.title('Shepherding (N=' + str(self.num_sheep_total) + ', n=' + str(self.num_sheep_neighbors) + ')')
+        ax = self.axes[0]  # 1 row, 4 cols and we select the 1. subplot (most left)
+        # Artists have to be drawn by the figure itself when frames are exported for a video
+        animated = not ShepherdSimulation.genVideo
+        ax.scatter(self.target[0], self.target[1], c='orange', s=40, label='Goal')
+        self.env_artists = [
+            ax.scatter(self.dog_pose[0], self.dog_pose[1], c='r', s=50, label='Dog', animated=animated),
+            ax.scatter(np.empty(0), np.empty(0), c='b', s=50, label='Not visible Sheep', animated=animated),
+            ax.scatter(np.empty(0), np.empty(0), c='g', s=50, label='Visible Sheep', animated=animated),
+        ]
+        ax.set_title('Shepherding (N=' + str(self.num_sheep_total) + ', n=' + str(self.num_sheep_neighbors) + ')')
         border = 20
-        plt.xlim([0 - border, self.field_length + border])
-        plt.ylim([0 - border, self.field_length + border])
-        plt.legend()
+        ax.set_xlim([0 - border, self.field_length + border])
+        ax.set_ylim([0 - border, self.field_length + border])
+        ax.legend(loc='upper left')
+        if animated:
+            # the static background has to be grabbed again whenever the whole figure is redrawn (e.g. resizing)
+            self.fig.canvas.mpl_connect('draw_event', self.__on_draw)
+            self.fig.canvas.draw()
+
+    def __on_draw(self, event):
+        ax = self.axes[0]
+        self.env_background = self.fig.canvas.copy_from_bbox(ax.bbox)
+        for artist in self.env_artists:
+            ax.draw_artist(artist)
+
+    def plot_env(self):
+        start = time.perf_counter()
+        if self.env_artists is None:
+            self.init_plot_env()
+
+        dog, other_sheep, vis_sheep = self.env_artists
+        dog.set_offsets(self.dog_pose[None, :])
+        other_sheep.set_offsets(self.sheep_poses[~self.vis_sheep_mask])
+        vis_sheep.set_offsets(self.sheep_poses[self.vis_sheep_mask])
+
         if not ShepherdSimulation.genVideo:
-            plt.pause(0.01)
+            # blit the moving artists on top of the cached background
+            ax = self.axes[0]
+            canvas = self.fig.canvas
+            canvas.restore_region(self.env_background)
+            for artist in self.env_artists:
+                ax.draw_artist(artist)
+            canvas.blit(ax.bbox)
+            canvas.flush_events()
+
+        self.render_frames += 1
+        self.render_time += time.perf_counter() - start
 
     # function to find new inertia for sheep
     def update_environment(self):
@@ -193,9 +292,9 @@ class ShepherdSimulation:
 
         # compute random movements while grazing (with prob self.grazing_prob)
         inertia_sheep_far_dog = np.zeros(inertia_sheep_far_dog.shape)
-        moving_sheep = np.random.choice([True, False], num_far_sheep, p=[
+        moving_sheep = self.random_state.choice([True, False], num_far_sheep, p=[
             self.grazing_prob, 1 - self.grazing_prob])
-        inertia_sheep_far_dog[moving_sheep, :] = np.random.randn(
+        inertia_sheep_far_dog[moving_sheep, :] = self.random_state.randn(
             inertia_sheep_far_dog[moving_sheep, :].shape[0], 2)
         inertia_sheep_far_dog[moving_sheep, :] = np.linalg.norm(inertia_sheep_far_dog[moving_sheep, :], axis=1,
                                                                 keepdims=True)
@@ -248,7 +347,7 @@ class ShepherdSimulation:
         attraction_lcm[np.isnan(attraction_lcm)] = 0
 
         # error term
-        noise = np.random.randn(num_near_sheep, 2)
+        noise = self.random_state.randn(num_near_sheep, 2)
         noise /= np.linalg.norm(noise, axis=1, keepdims=True)
 
         # compute sheep motion direction
@@ -323,7 +422,7 @@ class ShepherdSimulation:
         direction /= np.linalg.norm(direction)
 
         # error term
-        noise = np.random.randn(2)
+        noise = self.random_state.randn(2)
         noise /= np.linalg.norm(noise, keepdims=True)
 
         # update position
@@ -354,7 +453,8 @@ class ShepherdSimulation:
         distance_P_d = np.linalg.norm(P_d - self.dog_pose)
 
         # calculate distance of initial sheep position to target
-        initial_distance_target = np.linalg.norm(self.target - self.init_sheep_pose)
+        # init_sheep_pose used to be the live array, the fuzzy system was tuned with the current positions here
+        initial_distance_target = np.linalg.norm(self.target - self.sheep_poses)
 
         t_min = np.linalg.norm(self.target - self.dog_pose) / self.dog_speed
 
@@ -420,7 +520,7 @@ class ShepherdSimulation:
         direction /= np.linalg.norm(direction)
 
         # error term
-        noise = np.random.randn(2)
+        noise = self.random_state.randn(2)
         noise /= np.linalg.norm(noise, keepdims=True)
 
         # update position
@@ -466,7 +566,10 @@ class ShepherdSimulation:
     def get_visible_sheep(sheep_poses, dog_pose, sheep_radius):
         """
         Calculates the sheeps the dog can actually see
-        :return:
+        :param sheep_poses: positions of all sheep
+        :param dog_pose: position of the dog
+        :param sheep_radius: radius of one sheep, used to check for occlusion
+        :return: indices of the visible sheep, ordered by their distance to the dog
         """
         # 1. Remove sheeps which are not in the field of view of the dog
         # sheep poses: self.sheep_poses
@@ -478,33 +581,32 @@ class ShepherdSimulation:
 
         # 2. Remove sheep which are occluded by other sheep
         # Calculate distance of sheep to dog
-        dist_sheep_dog = np.linalg.norm(
-            sheep_poses - dog_pose, axis=1)
+        sheep_to_dog = sheep_poses - dog_pose
+        dist_sheep_dog = np.linalg.norm(sheep_to_dog, axis=1)
         # Sort sheep by their distances
-        sheep_pos_sorted = [x for _, x in sorted(zip(dist_sheep_dog, sheep_poses))]
+        order = np.argsort(dist_sheep_dog, kind='stable')
 
         # Iterate over every sheep, calculate the line between the sheep and the dog & save the line.
-        # In the next step, check if a sheep collides with the line
-        visible_sheep_positions = list()
-        for i in range(len(sheep_pos_sorted)):
-            sheep_pos = sheep_pos_sorted[i]
-            # Check if sheep collides with previous sheep
-            occluded = False
-            for vis_sheep_pos in visible_sheep_positions:
-                # distance between sheep and the line formed by the visible sheep and the dog
-                p1 = dog_pose
-                p2 = vis_sheep_pos
-                p3 = sheep_pos
-                distance = np.linalg.norm(np.cross(p2 - p1, p1 - p3)) / np.linalg.norm(p2 - p1)
-                # Check if the distance is smaller than the radius of one sheep
-                if distance < sheep_radius:
-                    occluded = True
-                    break
-            if occluded:
+        # In the next step, check if a sheep collides with any of the saved lines
+        visible = np.zeros(len(sheep_poses), dtype=bool)
+        # lines from the dog to the visible sheep, stored as direction and length
+        vis_directions = np.empty((len(sheep_poses), 2))
+        vis_lengths = np.empty(len(sheep_poses))
+        num_visible = 0
+        for i in order:
+            # distance between sheep and the lines formed by the visible sheep and the dog
+            directions = vis_directions[:num_visible]
+            cross = directions[:, 0] * sheep_to_dog[i, 1] - directions[:, 1] * sheep_to_dog[i, 0]
+            distances = np.abs(cross) / vis_lengths[:num_visible]
+            # Check if the distance is smaller than the radius of one sheep
+            if np.any(distances < sheep_radius):
                 continue
-            # sheep is not occluded by other sheep, add to visible sheep list
-            visible_sheep_positions.append(sheep_pos)
-        return np.asarray(visible_sheep_positions)
+            # sheep is not occluded by other sheep, add to visible sheep
+            visible[i] = True
+            vis_directions[num_visible] = sheep_to_dog[i]
+            vis_lengths[num_visible] = dist_sheep_dog[i]
+            num_visible += 1
+        return order[visible[order]]
 
 
 def get_args():
@@ -521,15 +623,96 @@ def get_args():
     parser.add_argument('-vi', '--video', action='store_true',
                         help='Toggle to enable exporting of every frame into a folder "/video",'
                              ' to create a video with ffmpeg afterwards.')
-
-    return parser.parse_args()
+    parser.add_argument('--dog', choices=[Dog_model.FUZZY, Dog_model.STROMBOM], default=Dog_model.FUZZY,
+                        help='Decision model of the dog')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Random seed (of the whole batch with --repeat), drawn from OS entropy if not given')
+    parser.add_argument('--repeat', metavar='K', type=int, default=None,
+                        help='Run K headless episodes and print their statistics as JSON')
+    parser.add_argument('--jobs', metavar='J', type=int, default=1,
+                        help='Number of processes running the episodes of --repeat')
+
+    args = parser.parse_args()
+    if args.repeat is not None and args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    return args
+
+
+def run_episode(num_sheep, num_neighbors, max_steps, dog_model, seed, repetition):
+    """
+    Run one headless episode of a batch, its random stream is derived from the seed of the batch and the repetition
+    :return: dict steps, success, outcome and the number of driving and collecting steps of the dog
+    """
+    sim = ShepherdSimulation(num_sheep_total=num_sheep, num_sheep_neighbors=num_neighbors, max_steps=max_steps,
+                             random_state=get_sweep_random_state(seed, num_sheep, num_neighbors, repetition),
+                             dog_model=dog_model)
+    steps, success = sim.run(render=False)
+    # the dog appends to driving_counter in every step in which it moved, incremented if it was driving
+    driving_steps = sim.driving_counter[-1]
+    return {'steps': steps, 'success': bool(success), 'outcome': sim.outcome, 'driving_steps': driving_steps,
+            'collecting_steps': len(sim.driving_counter) - 1 - driving_steps}
+
+
+def run_batch(num_sheep, num_neighbors, max_steps, dog_model, repeat, jobs=1, seed=None):
+    """
+    Run repeat seeded headless episodes on jobs processes
+    :return: dict of the statistics of the episodes, JSON serializable
+    """
+    seed = seed if seed is not None else np.random.SeedSequence().entropy
+    args = [(num_sheep, num_neighbors, max_steps, dog_model, seed, repetition) for repetition in range(repeat)]
+    start = time.perf_counter()
+    if jobs > 1:
+        with mp.Pool(jobs) as pool:
+            episodes = pool.starmap(run_episode, args, chunksize=1)
+    else:
+        episodes = [run_episode(*arg) for arg in args]
+    wall_clock = time.perf_counter() - start
+
+    steps = np.array([episode['steps'] for episode in episodes])
+    successes = np.array([episode['success'] for episode in episodes], dtype=bool)
+
+    def distribution(values):
+        if len(values) == 0:
+            return None
+        p10, p50, p90 = np.percentile(values, [10, 50, 90])
+        return {'mean': float(np.mean(values)), 'std': float(np.std(values)), 'min': int(np.min(values)),
+                'p10': float(p10), 'p50': float(p50), 'p90': float(p90), 'max': int(np.max(values))}
+
+    driving = sum(episode['driving_steps'] for episode in episodes)
+    collecting = sum(episode['collecting_steps'] for episode in episodes)
+    return {
+        'num_sheep': num_sheep,
+        'num_neighbors': num_neighbors,
+        'max_steps': max_steps,
+        'dog': dog_model,
+        'seed': int(seed),
+        'repeat': repeat,
+        'jobs': jobs,
+        'success_rate': float(np.mean(successes)) if repeat > 0 else None,
+        'outcomes': {outcome: sum(episode['outcome'] == outcome for episode in episodes)
+                     for outcome in (Outcome.SUCCESS, Outcome.STALLED, Outcome.TIMEOUT)},
+        'steps': distribution(steps),
+        'steps_successful': distribution(steps[successes]),
+        # share of all steps in which the dog was driving / collecting, the rest it was waiting for close sheep
+        'driving_share': driving / max(int(np.sum(steps)), 1),
+        'collecting_share': collecting / max(int(np.sum(steps)), 1),
+        'wall_clock_s': wall_clock,
+        'episodes_per_s': repeat / wall_clock if wall_clock > 0 else None,
+        'steps_per_s': float(np.sum(steps)) / wall_clock if wall_clock > 0 else None,
+    }
 
 
 def main():
     args = get_args()
+    if args.repeat is not None:
+        stats = run_batch(args.num_sheep, args.num_neighbors, args.max_steps, args.dog, args.repeat,
+                          jobs=args.jobs, seed=args.seed)
+        print(json.dumps(stats, indent=2))
+        return
     ShepherdSimulation.genVideo = args.video
     shepherd_sim = ShepherdSimulation(
-        num_sheep_total=args.num_sheep, num_sheep_neighbors=args.num_neighbors, max_steps=args.max_steps)
+        num_sheep_total=args.num_sheep, num_sheep_neighbors=args.num_neighbors, max_steps=args.max_steps,
+        random_seed=args.seed, dog_model=args.dog)
     shepherd_sim.run(render=not args.no_render, verbose=args.verbose)
 
 